@@ -0,0 +1,208 @@
+"""Benchmark delle fasi di analisi su risposte sintetiche di diverse dimensioni.
+
+Per ogni dimensione (in token) e granularità misura il tempo migliore su
+più ripetizioni e il picco di memoria (tracemalloc, in un'esecuzione
+separata) di ogni fase: decodifica della risposta (con il backend JSON
+scelto da logprob.decoding, vedi LOGPROB_JSON_BACKEND), tabella dei token,
+segmentazione, estrazione delle parole, analisi, raggruppamento in frasi
+di logprob_gradio, rendering HTML e paginazione. Le risposte vengono dal
+generatore deterministico di logprob.synthetic, quindi i risultati sono
+confrontabili tra commit.
+
+Uso:
+
+    python benchmarks/run.py --output risultati.json
+    python benchmarks/run.py --sizes 100,1000 --repeat 5
+    python benchmarks/run.py --compare risultati.json
+
+Il JSON prodotto contiene commit, versioni e una riga per fase, dimensione
+e granularità. Con --compare le misure vengono confrontate con un file
+precedente e vengono segnalate le fasi più lente della soglia indicata.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+
+from logprob.analysis import (  # noqa: E402
+    GRANULARITIES,
+    create_confidence_analyses,
+    create_confidence_analysis,
+    segment_spans,
+)
+from logprob.decoding import BACKEND, decode_completion  # noqa: E402
+from logprob.render import format_results  # noqa: E402
+from logprob.synthetic import generate_completion  # noqa: E402
+from logprob.tokens import TokenTable  # noqa: E402
+from logprob.viewer import build_page  # noqa: E402
+
+DEFAULT_SIZES = (100, 1000, 10000, 100000)
+
+Stage = Tuple[str, Optional[str], Callable[[], Any]]
+
+
+def load_group_tokens_into_sentences() -> Optional[Callable]:
+    """La versione base dell'app importa gradio: se non è installato la fase viene saltata."""
+    try:
+        from logprob_gradio import group_tokens_into_sentences
+    except ImportError:
+        return None
+    return group_tokens_into_sentences
+
+
+def build_stages(size: int, seed: int) -> List[Stage]:
+    """Prepara i dati di una dimensione e restituisce le fasi da misurare."""
+    payload = json.dumps(generate_completion(size, seed=seed)).encode('utf-8')
+    data = json.loads(payload)
+    choice = data['choices'][0]
+    text = choice['message']['content']
+    tokens = choice['logprobs']['content']
+    analyses = create_confidence_analyses(text, tokens)
+
+    stages: List[Stage] = [
+        ("decode", None, lambda: decode_completion(payload)),
+        ("token_table", None, lambda: TokenTable.from_tokens(tokens)),
+        ("segment", None, lambda: segment_spans(text)),
+        ("analysis_all", None, lambda: create_confidence_analyses(text, tokens)),
+    ]
+    for granularity in GRANULARITIES:
+        stages.append(("analysis", granularity,
+                       lambda g=granularity: create_confidence_analysis(text, tokens, g)))
+
+    group_tokens_into_sentences = load_group_tokens_into_sentences()
+    if group_tokens_into_sentences is not None:
+        stages.append(("group_sentences", None, lambda: group_tokens_into_sentences(text, tokens)))
+
+    for granularity in GRANULARITIES:
+        stages.append(("render", granularity, lambda g=granularity: format_results(analyses[g])))
+        stages.append(("page", granularity, lambda g=granularity: build_page(analyses[g], 1)))
+    return stages
+
+
+def measure(fn: Callable[[], Any], repeat: int) -> Tuple[float, int]:
+    """Tempo migliore su `repeat` esecuzioni e picco di memoria allocata."""
+    best = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes: List[int], repeat: int, seed: int, only: Optional[List[str]] = None) -> Dict[str, Any]:
+    results = []
+    for size in sizes:
+        # Le risposte grandi vengono misurate meno volte
+        times = repeat if size < 50000 else max(1, repeat // 3)
+        for stage, granularity, fn in build_stages(size, seed):
+            if only and stage not in only:
+                continue
+            seconds, peak = measure(fn, times)
+            results.append({
+                'stage': stage,
+                'granularity': granularity,
+                'size': size,
+                'seconds': seconds,
+                'peak_bytes': peak,
+            })
+            label = stage + (f"[{granularity}]" if granularity else "")
+            print(f"{size:>7} {label:<24} {seconds * 1000:>10.2f} ms {peak / 1024 / 1024:>9.2f} MB",
+                  file=sys.stderr)
+
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'json_backend': BACKEND,
+        'platform': platform.platform(),
+        'seed': seed,
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    """Confronta due esecuzioni e restituisce le fasi più lente di `threshold` volte."""
+    def key(row):
+        return row['stage'], row['granularity'], row['size']
+
+    previous = {key(row): row for row in baseline['results']}
+    regressions = []
+    print(f"\nConfronto con {baseline.get('commit') or 'baseline'}:", file=sys.stderr)
+    for row in current['results']:
+        old = previous.get(key(row))
+        if old is None or not old['seconds']:
+            continue
+        ratio = row['seconds'] / old['seconds']
+        memory_ratio = row['peak_bytes'] / old['peak_bytes'] if old['peak_bytes'] else 1.0
+        label = row['stage'] + (f"[{row['granularity']}]" if row['granularity'] else "")
+        flag = " REGRESSIONE" if ratio > threshold else ""
+        print(f"{row['size']:>7} {label:<24} tempo x{ratio:5.2f} memoria x{memory_ratio:5.2f}{flag}",
+              file=sys.stderr)
+        if ratio > threshold:
+            regressions.append(dict(row, ratio=ratio))
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark delle fasi di analisi della confidenza.")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="dimensioni delle risposte in token, separate da virgole")
+    parser.add_argument("--repeat", type=int, default=5, help="ripetizioni per misura (si tiene la migliore)")
+    parser.add_argument("--seed", type=int, default=0, help="seed del generatore sintetico")
+    parser.add_argument("--stages", help="fasi da misurare, separate da virgole (default: tutte)")
+    parser.add_argument("--output", help="file JSON dei risultati (default: stdout)")
+    parser.add_argument("--compare", help="file JSON di un'esecuzione precedente da confrontare")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="rapporto di tempo oltre il quale una fase è una regressione")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    only = args.stages.split(",") if args.stages else None
+    current = run(sizes, args.repeat, args.seed, only)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=2)
+    else:
+        json.dump(current, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(current, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
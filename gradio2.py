@@ -1,540 +1,273 @@
-!pip install gradio
-import gradio as gr
-import requests
-import re
-import math
-from typing import List, Dict, Any, Union
+"""Sentence Confidence Analyzer Pro: interfaccia Gradio sopra logprob.core.
 
-# Funzioni di utilità
-def logprob_to_confidence(logprob: float) -> float:
-    """Converte logprob in percentuale di confidenza."""
-    return math.exp(logprob) * 100
+gradio viene importato solo quando serve (creazione dell'interfaccia e
+aggiornamenti dei componenti), così questo modulo e le funzioni di analisi
+restano utilizzabili da script e notebook senza pagarne il tempo di import.
+"""
+import time
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 
-def get_confidence_label(confidence: float) -> str:
-    """Restituisce l'etichetta del livello di confidenza."""
-    if confidence > 95:
-        return "Altissima confidenza"
-    if confidence > 85:
-        return "Alta confidenza"
-    if confidence > 70:
-        return "Media confidenza"
-    if confidence > 50:
-        return "Bassa confidenza"
-    return "Molto bassa confidenza"
+from logprob import offload, serving
+from logprob.api import MAX_TOP_LOGPROBS
+from logprob.comparison import compare_models
+from logprob.core import (
+    analyze_confidence,
+    analyze_confidence_stream,
+    analyze_consensus,
+    test_api_connection,
+)
+from logprob.cache import api_key_hash
+from logprob.history import get_history, record_analysis
+from logprob.metrics import StageTimer, start_metrics_server
+from logprob.ratelimit import RateLimitExceeded
+from logprob.render import (
+    format_comparison,
+    format_consensus,
+    format_history_runs,
+    format_history_segments,
+    format_results,
+    format_segment,
+)
+from logprob.viewer import VIEWER_JS, build_page, viewer_html
 
-def get_confidence_color(confidence: float) -> str:
-    """Restituisce il colore basato sulla confidenza (da rosso a verde)."""
-    r = max(0, min(255, round(255 * (1 - confidence / 100))))
-    g = max(0, min(255, round(255 * (confidence / 100))))
-    b = 0
-    return f"rgb({r}, {g}, {b})"
+MODEL_CHOICES = [
+    "gpt-4.1",
+    "gpt-4o-2024-08-06",
+    "gpt-4o-mini-2024-07-18",
+    "gpt-4-turbo-2024-04-09",
+    "gpt-3.5-turbo-0125"
+]
 
-# APPROCCIO COMPLETAMENTE NUOVO PER LA SEGMENTAZIONE DEL TESTO
-def segment_text(text: str) -> List[str]:
-    """Versione completamente rivista per segmentare il testo in frasi."""
-    
-    # Rimuovi spazi extra e normalizza il testo
-    text = re.sub(r'\s+', ' ', text).strip()
-    
-    # Definisci pattern di terminazione frase
-    end_patterns = [
-        r'(?<=[.!?])\s+(?=[A-Z])',  # Punto/esclamativo/interrogativo seguito da spazio e maiuscola
-        r'(?<=\.)\s+(?=\-)',  # Punto seguito da trattino (per elenchi)
-        r'(?<=\.)\s+(?=\*\*)',  # Punto seguito da asterischi (per formattazione markdown)
-        r'(?<=\.)\s+(?=###)',  # Punto seguito da ### (per titoli markdown)
-        r'(?<=\n)(?=###)',  # Newline seguito da ### (per titoli markdown)
-        r'(?<=\n)(?=\-)',  # Newline seguito da trattino (per elenchi)
-    ]
-    
-    # Combina i pattern
-    combined_pattern = '|'.join(end_patterns)
+# Voce del filtro per modello dello storico che non filtra
+ALL_MODELS = "Tutti i modelli"
+
+# Righe per pagina nella scheda Storico
+HISTORY_PAGE_SIZE = 25
+
+# Lo storico di ogni API key è visibile solo a chi la inserisce
+HISTORY_KEY_REQUIRED = "Inserisci la tua API key per vedere le analisi salvate con essa"
+
+# Funzioni per gli indicatori di caricamento
+def start_processing():
+    return "<div style='display: flex; align-items: center; margin-top: 10px;'><div style='width: 20px; height: 20px; border-radius: 50%; border: 3px solid #3498db; border-top-color: transparent; animation: spin 1s linear infinite; margin-right: 10px;'></div><span style='color: #3498db;'><strong>Elaborazione in corso...</strong> Sto analizzando il testo con il modello selezionato</span></div><style>@keyframes spin { 0% { transform: rotate(0deg); } 100% { transform: rotate(360deg); } }</style>"
+
+def end_processing():
+    return "<div style='color: #28a745; margin-top: 10px;'><strong>✓ Analisi completata!</strong></div>"
+
+# Funzioni per Gradio
+def unchanged() -> Any:
+    """Valore che lascia invariato un componente (gr.update() senza argomenti)."""
+    import gradio as gr
+    return gr.update()
+
+# Segmenti mostrati durante lo streaming: i precedenti restano nella vista paginata finale
+STREAM_WINDOW = 40
+
+def format_timings(timer: StageTimer) -> str:
+    """Tabella markdown con il tempo di ogni fase dell'ultima analisi."""
+    rows = [f"| {name} | {seconds * 1000:.1f} ms | {share:.0f}% |" for name, seconds, share in timer.breakdown()]
+    return "\n".join([
+        "| Fase | Tempo | Quota |",
+        "|---|---|---|",
+        *rows,
+        f"| **totale** | **{timer.total * 1000:.1f} ms** | |",
+    ])
+
+def run_analysis(api_key: str, model: str, prompt: str, granularity: str, stream: bool = True,
+                 use_cache: bool = True, samples: int = 1,
+                 top_logprobs: int = 1) -> Iterator[Tuple[str, Optional[Dict[str, Any]], Optional[Dict[str, Any]], int, Any]]:
+    """Funzione principale per l'analisi.
     
-    # Dividi il testo
-    segments = re.split(combined_pattern, text)
+    Restituisce l'HTML, le analisi a tutte le granularità da conservare
+    nello stato della sessione, la prima pagina della vista paginata, il
+    numero di pagina e, alla fine, la tabella dei tempi per fase. In
+    modalità streaming l'HTML mostra solo gli ultimi segmenti e viene
+    aggiornato man mano che diventano definitivi; quelli già formattati non
+    vengono ricalcolati. Il risultato finale viene disegnato nel browser una
+    pagina alla volta (vedi logprob.viewer).
     
-    # Gestione speciale per titoli e sottotitoli
-    refined_segments = []
-    for segment in segments:
-        # Cerca titoli nel segmento
-        title_matches = re.findall(r'###\s+[^\n]+', segment)
-        
-        if title_matches:
-            # Se ci sono titoli, trattali come segmenti separati
-            remaining = segment
-            for title in title_matches:
-                parts = remaining.split(title, 1)
-                if parts[0].strip():
-                    refined_segments.append(parts[0].strip())
-                refined_segments.append(title.strip())
-                remaining = parts[1] if len(parts) > 1 else ""
-            if remaining.strip():
-                refined_segments.append(remaining.strip())
-        else:
-            # Altrimenti, aggiungi l'intero segmento
-            if segment.strip():
-                refined_segments.append(segment.strip())
+    Con più di un campione l'analisi è di consenso, senza streaming: lo
+    stato conserva le analisi della risposta di riferimento. Con
+    top_logprobs > 1 vengono mostrate anche entropia e margine delle
+    alternative di ogni token. Ogni analisi completata viene salvata nello
+    storico della API key (vedi logprob.history). Se l'API key ha superato i limiti di
+    richieste o token al minuto l'analisi viene rifiutata prima di
+    chiamare l'API (vedi logprob.serving).
+    """
+    timer = StageTimer()
+    samples = int(samples or 1)
+    top_logprobs = int(top_logprobs or 1)
+    mode = "consensus" if samples > 1 else "stream" if stream else "full"
     
-    # Gestione speciale per elenchi puntati
-    final_segments = []
-    for segment in refined_segments:
-        # Trova elenchi puntati
-        list_items = re.findall(r'\-\s+[^\n\-]+', segment)
-        
-        if list_items and not segment.startswith('-'):
-            # Se ci sono elementi di elenco ma non è un elenco completo, dividi
-            parts = []
-            current = segment
-            for item in list_items:
-                item_parts = current.split(item, 1)
-                if item_parts[0].strip():
-                    parts.append(item_parts[0].strip())
-                parts.append(item.strip())
-                current = item_parts[1] if len(item_parts) > 1 else ""
-            if current.strip():
-                parts.append(current.strip())
-            final_segments.extend(parts)
-        else:
-            final_segments.append(segment)
+    def final(html, analyses, page):
+        if analyses is not None:
+            with timer.stage("history"):
+                record_analysis({'analyses': analyses}, model, prompt, api_key)
+        timer.finish(mode)
+        return html, analyses, page, 1, format_timings(timer)
     
-    return [s for s in final_segments if s.strip()]
-
-def extract_words(text: str) -> List[str]:
-    """Estrae le parole dal testo in modo più robusto."""
-    # Rimuove la punteggiatura eccetto trattini interni alle parole
-    cleaned_text = re.sub(r'[^\w\s\-]|(?<!\w)\-|\-(?!\w)', ' ', text)
-    words = [w for w in cleaned_text.split() if w.strip()]
-    return words
-
-# NUOVO SISTEMA DI MAPPATURA TOKEN-PAROLE-FRASI
-def create_confidence_analysis(text: str, tokens: List[Dict[str, Any]], granularity: str) -> Dict[str, Any]:
-    """Crea un'analisi della confidenza con un approccio completamente nuovo."""
+    try:
+        estimated = serving.admit(api_key, prompt, completions=samples) if api_key and prompt else 0
+    except RateLimitExceeded as e:
+        yield final(format_results({"error": str(e)}), None, None)
+        return
     
-    # Ottieni il testo completo dai token
-    full_text = "".join(token['token'] for token in tokens)
+    if samples > 1:
+        result = analyze_consensus(api_key, model, prompt, samples, use_cache, timer, top_logprobs)
+        serving.record_usage(api_key, estimated, result.get('usage'))
+        with timer.stage("render"):
+            html = format_consensus(result)
+        yield final(html, result.get('analyses'), None)
+        return
     
-    # Aggiungi la confidenza a ciascun token
-    for token in tokens:
-        token['confidence'] = logprob_to_confidence(token['logprob'])
+    if not stream:
+        result = analyze_confidence(api_key, model, prompt, granularity, use_cache, timer, top_logprobs)
+        serving.record_usage(api_key, estimated, result.get('usage'))
+        with timer.stage("render"):
+            if "error" in result:
+                html, analyses, page = format_results(result), None, None
+            else:
+                html, analyses, page = viewer_html(result['granularity']), result['analyses'], build_page(result)
+        yield final(html, analyses, page)
+        return
     
-    if granularity == "token":
-        # Ottieni i segmenti 
-        segments = segment_text(full_text)
-        segment_map = []
-        
-        # Per ogni segmento, mappa i token
-        token_offset = 0
-        for segment in segments:
-            segment_tokens = []
-            segment_len = len(segment)
-            current_len = 0
-            
-            while token_offset < len(tokens) and current_len < segment_len:
-                token = tokens[token_offset]
-                token_text = token['token']
-                segment_tokens.append(token)
-                current_len += len(token_text)
-                token_offset += 1
-                
-                # Verifica se abbiamo superato la lunghezza del segmento
-                if current_len >= segment_len:
-                    break
-            
-            if segment_tokens:
-                segment_map.append({
-                    'text': segment,
-                    'tokens': segment_tokens,
-                })
-        
-        return {
-            'text': full_text,
-            'segments': segment_map,
-            'granularity': 'token'
-        }
-        
-    elif granularity == "word":
-        # Ottieni i segmenti
-        segments = segment_text(full_text)
-        words = extract_words(full_text)
-        
-        # Crea indici di parole
-        word_indices = []
-        word_start_index = 0
-        
-        for word in words:
-            # Trova la prossima occorrenza della parola
-            word_pos = full_text[word_start_index:].lower().find(word.lower())
-            if word_pos != -1:
-                word_pos += word_start_index
-                word_end = word_pos + len(word)
-                word_indices.append((word, word_pos, word_end))
-                word_start_index = word_end
-        
-        # Mappa i token alle parole
-        word_data = []
-        for word, start_pos, end_pos in word_indices:
-            word_tokens = []
-            token_offset = 0
-            token_pos = 0
-            
-            for i, token in enumerate(tokens):
-                token_start = token_pos
-                token_end = token_start + len(token['token'])
-                
-                # Verifica se il token si sovrappone alla parola
-                if (token_start <= end_pos and token_end >= start_pos):
-                    word_tokens.append(token)
-                
-                token_pos += len(token['token'])
-                
-                # Se abbiamo superato la posizione di fine della parola, fermati
-                if token_start > end_pos:
-                    break
-            
-            if word_tokens:
-                avg_logprob = sum(token['logprob'] for token in word_tokens) / len(word_tokens)
-                confidence = logprob_to_confidence(avg_logprob)
-                
-                word_data.append({
-                    'text': word,
-                    'confidence': confidence,
-                    'start': start_pos,
-                    'end': end_pos
-                })
-        
-        # Mappa le parole ai segmenti
-        segment_map = []
-        for segment in segments:
-            segment_start = full_text.find(segment)
-            segment_end = segment_start + len(segment)
-            
-            segment_words = []
-            for word_info in word_data:
-                # Verifica se la parola è all'interno del segmento
-                if word_info['start'] >= segment_start and word_info['end'] <= segment_end:
-                    segment_words.append(word_info)
-            
-            if segment_words:
-                segment_map.append({
-                    'text': segment,
-                    'words': segment_words
-                })
-        
-        return {
-            'text': full_text,
-            'segments': segment_map,
-            'granularity': 'word'
-        }
-        
-    else:  # sentence
-        # Ottieni i segmenti
-        segments = segment_text(full_text)
-        segment_data = []
-        
-        # Per ogni segmento, calcola la confidenza media
-        token_offset = 0
-        for segment in segments:
-            segment_start = full_text.find(segment)
-            segment_end = segment_start + len(segment)
-            
-            segment_tokens = []
-            token_pos = 0
-            
-            for token in tokens:
-                token_start = token_pos
-                token_end = token_start + len(token['token'])
-                
-                # Verifica se il token si sovrappone al segmento
-                if (token_start <= segment_end and token_end >= segment_start):
-                    segment_tokens.append(token)
-                
-                token_pos += len(token['token'])
-                
-                # Se abbiamo superato la posizione di fine del segmento, fermati
-                if token_start > segment_end:
-                    break
-            
-            if segment_tokens:
-                avg_logprob = sum(token['logprob'] for token in segment_tokens) / len(segment_tokens)
-                confidence = logprob_to_confidence(avg_logprob)
-                
-                segment_data.append({
-                    'text': segment,
-                    'confidence': confidence
-                })
+    rendered = []
+    for result in analyze_confidence_stream(api_key, model, prompt, granularity, use_cache, timer, top_logprobs):
+        with timer.stage("render"):
+            if "error" in result:
+                html = format_results(result)
+            elif 'analyses' in result:
+                html = viewer_html(result['granularity'])
+                page = build_page(result)
+            else:
+                segments = result['segments']
+                for i in range(len(rendered), result['final_segments']):
+                    rendered.append(format_segment(segments[i], i, result['granularity'], result['table']))
+                html = format_results(result, rendered, window=STREAM_WINDOW)
         
-        return {
-            'text': full_text,
-            'segments': segment_data,
-            'granularity': 'sentence'
-        }
+        if "error" in result:
+            serving.record_usage(api_key, estimated, result.get('usage'))
+            yield final(html, None, None)
+            return
+        if 'analyses' in result:
+            serving.record_usage(api_key, estimated, result.get('usage'))
+            yield final(html, result['analyses'], page)
+            return
+        yield html, None, None, 1, unchanged()
 
-# Funzioni API e analisi
-def test_api_connection(api_key: str) -> str:
-    """Testa la connessione all'API OpenAI."""
-    if not api_key:
-        return "❌ Inserisci una API key prima di testare"
+def run_comparison(api_key: str, models: List[str], prompt: str, use_cache: bool = True) -> Iterator[str]:
+    """Confronta i modelli scelti sullo stesso prompt.
     
-    try:
-        headers = {
-            "Authorization": f"Bearer {api_key}"
-        }
-        response = requests.get("https://api.openai.com/v1/models", headers=headers)
-        
-        if response.status_code == 200:
-            return "✅ Connessione riuscita! API key valida."
-        else:
-            error_data = response.json()
-            error_message = error_data.get('error', {}).get('message', response.reason)
-            return f"❌ Errore API: {error_message}"
-    except Exception as e:
-        return f"❌ Errore di connessione: {str(e)}"
-
-def analyze_confidence(api_key: str, model: str, prompt: str, granularity: str) -> Union[Dict[str, Any], Dict[str, str]]:
-    """Analizza la confidenza del testo generato dal modello."""
+    Le richieste partono in parallelo e la vista viene aggiornata appena
+    arriva ogni risposta: il tempo totale è quello del modello più lento.
+    """
     if not api_key:
-        return {"error": "Inserisci una API key valida"}
-    
+        yield format_results({"error": "Inserisci una API key valida"})
+        return
     if not prompt:
-        return {"error": "Inserisci un prompt"}
+        yield format_results({"error": "Inserisci un prompt"})
+        return
+    if not models:
+        yield format_results({"error": "Seleziona almeno un modello da confrontare"})
+        return
     
     try:
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}"
-        }
-        
-        payload = {
-            "model": model,
-            "messages": [
-                {
-                    "role": "system",
-                    "content": "You are a helpful assistant providing accurate and detailed information."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            "temperature": 0.7,
-            "logprobs": True,
-            "top_logprobs": 1
-        }
-        
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers=headers,
-            json=payload
-        )
-        
-        if response.status_code != 200:
-            error_data = response.json()
-            error_message = error_data.get('error', {}).get('message', response.reason)
-            return {"error": f"Errore API: {error_message}"}
-        
-        data = response.json()
-        
-        text = data['choices'][0]['message']['content']
-        
-        # Verifica se logprobs sono disponibili
-        if 'logprobs' not in data['choices'][0] or 'content' not in data['choices'][0]['logprobs']:
-            return {"error": "Logprobs non disponibili. Potrebbe essere dovuto alle limitazioni dell'API."}
-        
-        logprobs = data['choices'][0]['logprobs']['content']
-        
-        # Usa la nuova funzione unificata per l'analisi
-        return create_confidence_analysis(text, logprobs, granularity)
-            
-    except Exception as e:
-        return {"error": f"Errore: {str(e)}"}
-
-# VISUALIZZAZIONE MIGLIORATA
-def format_results(result: Union[Dict[str, Any], Dict[str, str]]) -> str:
-    """Formatta i risultati dell'analisi in HTML."""
-    if isinstance(result, dict) and "error" in result:
-        return f"<div style='color: red; padding: 10px; border-left: 4px solid red; background-color: #ffeeee;'><strong>Errore:</strong> {result['error']}</div>"
-    
-    html = "<h2>Risultati dell'analisi</h2>"
+        estimated = serving.admit(api_key, prompt, len(models), len(models))
+    except RateLimitExceeded as e:
+        yield format_results({"error": str(e)})
+        return
     
-    if result['granularity'] == 'token':
-        html += "<h3>Analisi a livello di token</h3>"
-        
-        for i, segment in enumerate(result.get('segments', [])):
-            # Determina il tipo di segmento (titolo, elenco, testo normale)
-            is_title = segment['text'].startswith('###')
-            is_list_item = segment['text'].startswith('-')
-            
-            if is_title:
-                html += f"<div style='margin: 20px 0 10px 0; padding: 10px; background-color: #e9ecef; border-radius: 5px; font-weight: bold;'>"
-            elif is_list_item:
-                html += f"<div style='margin: 5px 0 5px 20px; padding: 5px 10px; background-color: #f8f9fa; border-left: 3px solid #6c757d;'>"
-            else:
-                html += f"<div style='margin: 15px 0; padding: 10px; border-radius: 5px; background-color: #f8f9fa; border-left: 4px solid #6c757d;'>"
-            
-            if not is_title and not is_list_item:
-                html += f"<strong>Segmento {i + 1}:</strong> "
-            
-            for token in segment.get('tokens', []):
-                color = get_confidence_color(token['confidence'])
-                confidence_pct = f"{token['confidence']:.1f}%"
-                label = get_confidence_label(token['confidence'])
-                
-                html += f"<span title='{confidence_pct} - {label}' style='color: {color}; font-weight: 600;'>{token['token']}</span>"
-            
-            html += "</div>"
+    results = {}
+    yield format_comparison(models, results)
+    for result in compare_models(api_key, models, prompt, use_cache):
+        results[result['model']] = result
+        yield format_comparison(models, results)
     
-    elif result['granularity'] == 'word':
-        html += "<h3>Analisi a livello di parola</h3>"
-        
-        for i, segment in enumerate(result.get('segments', [])):
-            # Determina il tipo di segmento
-            is_title = segment['text'].startswith('###')
-            is_list_item = segment['text'].startswith('-')
-            
-            if is_title:
-                html += f"<div style='margin: 20px 0 10px 0; padding: 10px; background-color: #e9ecef; border-radius: 5px; font-weight: bold;'>"
-            elif is_list_item:
-                html += f"<div style='margin: 5px 0 5px 20px; padding: 5px 10px; background-color: #f8f9fa; border-left: 3px solid #6c757d;'>"
-            else:
-                html += f"<div style='margin: 15px 0; padding: 10px; border-radius: 5px; background-color: #f8f9fa; border-left: 4px solid #6c757d;'>"
-            
-            if not is_title and not is_list_item:
-                html += f"<strong>Segmento {i + 1}:</strong> "
-            
-            # Ottieni il testo del segmento
-            segment_text = segment['text']
-            word_infos = segment.get('words', [])
-            
-            # Se non ci sono informazioni sulle parole, mostra il testo normale
-            if not word_infos:
-                html += segment_text
-            else:
-                # Costruisci una mappa delle posizioni delle parole
-                word_map = {}
-                for word_info in word_infos:
-                    # Trova la posizione relativa all'interno del segmento
-                    word_text = word_info['text']
-                    segment_start = result['text'].find(segment_text)
-                    relative_start = word_info['start'] - segment_start
-                    
-                    if relative_start >= 0 and relative_start < len(segment_text):
-                        color = get_confidence_color(word_info['confidence'])
-                        confidence_pct = f"{word_info['confidence']:.1f}%"
-                        label = get_confidence_label(word_info['confidence'])
-                        
-                        word_map[relative_start] = {
-                            'text': word_text,
-                            'color': color,
-                            'title': f"{confidence_pct} - {label}"
-                        }
-                
-                # Ricostruisci il testo con le parole colorate
-                if word_map:
-                    positions = sorted(word_map.keys())
-                    last_pos = 0
-                    colored_text = ""
-                    
-                    for pos in positions:
-                        # Aggiungi il testo prima della parola
-                        if pos > last_pos:
-                            colored_text += segment_text[last_pos:pos]
-                        
-                        # Aggiungi la parola colorata
-                        word_info = word_map[pos]
-                        word_len = len(word_info['text'])
-                        
-                        colored_text += f"<span title='{word_info['title']}' style='color: {word_info['color']}; font-weight: 600;'>{segment_text[pos:pos+word_len]}</span>"
-                        
-                        last_pos = pos + word_len
-                    
-                    # Aggiungi il testo rimanente
-                    if last_pos < len(segment_text):
-                        colored_text += segment_text[last_pos:]
-                    
-                    html += colored_text
-                else:
-                    html += segment_text
-            
-            html += "</div>"
-            
-    else:  # sentence
-        html += "<h3>Analisi a livello di frase</h3>"
-        
-        for i, segment in enumerate(result.get('segments', [])):
-            # Determina il tipo di segmento
-            is_title = segment['text'].startswith('###')
-            is_list_item = segment['text'].startswith('-')
-            
-            color = get_confidence_color(segment['confidence'])
-            label = get_confidence_label(segment['confidence'])
-            
-            if is_title:
-                html += f"""
-                <div style='margin: 20px 0 10px 0; padding: 10px; background-color: #e9ecef; border-radius: 5px; 
-                     color: {color}; border-left: 4px solid {color}; font-weight: bold;'>
-                    {segment['text']}
-                    <span style='margin-left: 10px; font-size: 0.9em;'>({segment['confidence']:.2f}% - {label})</span>
-                </div>"""
-            elif is_list_item:
-                html += f"""
-                <div style='margin: 5px 0 5px 20px; padding: 5px 10px; background-color: #f8f9fa; 
-                     color: {color}; border-left: 4px solid {color};'>
-                    {segment['text']}
-                    <span style='margin-left: 10px; font-size: 0.9em;'>({segment['confidence']:.2f}% - {label})</span>
-                </div>"""
-            else:
-                html += f"""
-                <div style='margin: 10px 0; padding: 10px; border-radius: 4px; color: {color}; 
-                     background-color: {color}15; border-left: 4px solid {color};'>
-                    <strong>Segmento {i + 1}:</strong> {segment['text']}
-                    <span style='margin-left: 10px; font-size: 0.9em;'>({segment['confidence']:.2f}% - {label})</span>
-                </div>"""
+    # Il limitatore si riallinea ai token di tutte le risposte arrivate
+    usages = [result['usage'] for result in results.values() if result.get('usage')]
+    if usages:
+        serving.record_usage(api_key, estimated, {'total_tokens': sum(usage.get('total_tokens', 0) for usage in usages)})
+
+def render_view(analyses: Optional[Dict[str, Dict[str, Any]]], granularity: str) -> Any:
+    """Mostra l'analisi già calcolata alla granularità scelta, senza nuove richieste."""
+    if not analyses:
+        return unchanged(), unchanged(), unchanged()
+    return viewer_html(granularity), build_page(analyses[granularity]), 1
+
+def show_page(analyses: Optional[Dict[str, Dict[str, Any]]], granularity: str, page: float) -> Any:
+    """Restituisce la pagina richiesta dell'analisi già calcolata."""
+    if not analyses:
+        return unchanged(), unchanged()
+    data = build_page(analyses[granularity], int(page or 1))
+    return data, data['page']
+
+def _history_cursors(state: Optional[Dict[str, Any]], step: int) -> Optional[List[Any]]:
+    """Inizi di pagina dopo uno spostamento di `step` pagine (0 = dalla prima), o None se non ci sono altre pagine."""
+    if not state or step == 0:
+        return [None]
+    cursors = list(state['cursors'])
+    if step > 0:
+        if state['next'] is None:
+            return None
+        cursors.append(state['next'])
+    elif len(cursors) > 1:
+        cursors.pop()
+    return cursors
+
+def show_history_segments(api_key: str, model: str, threshold: float, days: float,
+                          state: Optional[Dict[str, Any]], step: int = 0) -> Any:
+    """Pagina dei segmenti dello storico della API key sotto la soglia di confidenza, dal meno sicuro.
     
-    # LEGENDA MIGLIORATA CON BLOCCHI COLORATI
-    html += """
-    <div style='margin-top: 20px; padding: 15px; background-color: #f0f0f0; border-radius: 8px; border: 1px solid #ddd;'>
-        <h4 style='margin-top: 0; margin-bottom: 10px;'>Legenda Confidenza:</h4>
-        <div style='display: flex; flex-direction: column; gap: 8px;'>
-            <div style='display: flex; align-items: center;'>
-                <span style='display: inline-block; width: 25px; height: 25px; background-color: rgb(0, 255, 0); margin-right: 10px; border: 1px solid #333;'></span>
-                <span style='font-weight: bold;'>Altissima confidenza (95-100%)</span>
-            </div>
-            <div style='display: flex; align-items: center;'>
-                <span style='display: inline-block; width: 25px; height: 25px; background-color: rgb(85, 170, 0); margin-right: 10px; border: 1px solid #333;'></span>
-                <span style='font-weight: bold;'>Alta confidenza (85-95%)</span>
-            </div>
-            <div style='display: flex; align-items: center;'>
-                <span style='display: inline-block; width: 25px; height: 25px; background-color: rgb(170, 85, 0); margin-right: 10px; border: 1px solid #333;'></span>
-                <span style='font-weight: bold;'>Media confidenza (70-85%)</span>
-            </div>
-            <div style='display: flex; align-items: center;'>
-                <span style='display: inline-block; width: 25px; height: 25px; background-color: rgb(210, 45, 0); margin-right: 10px; border: 1px solid #333;'></span>
-                <span style='font-weight: bold;'>Bassa confidenza (50-70%)</span>
-            </div>
-            <div style='display: flex; align-items: center;'>
-                <span style='display: inline-block; width: 25px; height: 25px; background-color: rgb(255, 0, 0); margin-right: 10px; border: 1px solid #333;'></span>
-                <span style='font-weight: bold;'>Molto bassa confidenza (0-50%)</span>
-            </div>
-        </div>
-    </div>
+    Lo stato conserva la chiave di inizio di ogni pagina già vista e quella
+    della successiva: ogni pagina è una sola interrogazione sugli indici,
+    senza contare né leggere i segmenti delle pagine precedenti.
     """
-    
-    return html
-
-# Funzioni per gli indicatori di caricamento
-def start_processing():
-    return "<div style='display: flex; align-items: center; margin-top: 10px;'><div style='width: 20px; height: 20px; border-radius: 50%; border: 3px solid #3498db; border-top-color: transparent; animation: spin 1s linear infinite; margin-right: 10px;'></div><span style='color: #3498db;'><strong>Elaborazione in corso...</strong> Sto analizzando il testo con il modello selezionato</span></div><style>@keyframes spin { 0% { transform: rotate(0deg); } 100% { transform: rotate(360deg); } }</style>"
+    history = get_history()
+    if history is None:
+        return format_results({"error": "Storico disattivato (LOGPROB_HISTORY=0)"}), None
+    if not api_key:
+        return format_results({"error": HISTORY_KEY_REQUIRED}), None
+    cursors = _history_cursors(state, step)
+    if cursors is None:
+        return unchanged(), state
+    since = time.time() - float(days) * 86400 if days else None
+    rows = history.low_confidence_segments(api_key_hash(api_key), float(threshold),
+                                           None if model == ALL_MODELS else model, since=since, after=cursors[-1], limit=HISTORY_PAGE_SIZE + 1)
+    more = len(rows) > HISTORY_PAGE_SIZE
+    rows = rows[:HISTORY_PAGE_SIZE]
+    following = (rows[-1]['confidence'], rows[-1]['id']) if more else None
+    return format_history_segments(rows, len(cursors)), {'cursors': cursors, 'next': following}
 
-def end_processing():
-    return "<div style='color: #28a745; margin-top: 10px;'><strong>✓ Analisi completata!</strong></div>"
+def show_history_runs(api_key: str, model: str, state: Optional[Dict[str, Any]], step: int = 0) -> Any:
+    """Pagina delle analisi salvate con la API key, dalla più recente (paginazione a chiave come per i segmenti)."""
+    history = get_history()
+    if history is None:
+        return format_results({"error": "Storico disattivato (LOGPROB_HISTORY=0)"}), None
+    if not api_key:
+        return format_results({"error": HISTORY_KEY_REQUIRED}), None
+    cursors = _history_cursors(state, step)
+    if cursors is None:
+        return unchanged(), state
+    rows = history.runs(api_key_hash(api_key), None if model == ALL_MODELS else model,
+                        before=cursors[-1], limit=HISTORY_PAGE_SIZE + 1)
+    more = len(rows) > HISTORY_PAGE_SIZE
+    rows = rows[:HISTORY_PAGE_SIZE]
+    following = rows[-1]['id'] if more else None
+    return format_history_runs(rows, len(cursors)), {'cursors': cursors, 'next': following}
 
-# Funzioni per Gradio
-def run_analysis(api_key: str, model: str, prompt: str, granularity: str) -> str:
-    """Funzione principale per l'analisi."""
-    result = analyze_confidence(api_key, model, prompt, granularity)
-    return format_results(result)
+def open_history_run(api_key: str, run_id: float, granularity: str) -> Any:
+    """Mostra un'analisi salvata con la API key come se fosse appena stata eseguita."""
+    history = get_history()
+    run = history.load_run(int(run_id), api_key_hash(api_key)) if history is not None and api_key and run_id else None
+    if run is None:
+        return format_results({"error": f"Run non trovato: {run_id}"}), None, None, 1
+    analyses = run['analyses']
+    return viewer_html(granularity), analyses, build_page(analyses[granularity]), 1
 
 # Interfaccia Gradio
 def create_interface():
+    import gradio as gr
+    
     with gr.Blocks(title="Sentence Confidence Analyzer Pro") as app:
         gr.Markdown("# Sentence Confidence Analyzer Pro")
         
@@ -557,65 +290,236 @@ def create_interface():
                 outputs=[connection_status]
             )
         
-        with gr.Group():
-            gr.Markdown("## Impostazioni Analisi")
-            
-            with gr.Row():
-                with gr.Column():
-                    model_select = gr.Dropdown(
-                        choices=[
-                            "gpt-4.1",
-                            "gpt-4o-2024-08-06",
-                            "gpt-4o-mini-2024-07-18",
-                            "gpt-4-turbo-2024-04-09",
-                            "gpt-3.5-turbo-0125"
-                        ],
-                        value="gpt-4o-2024-08-06",
-                        label="Modello"
-                    )
+        # Analisi e confronto in una scheda, lo storico delle analisi salvate in un'altra
+        with gr.Tabs() as tabs:
+            with gr.Tab("Analisi", id="analysis"):
+                with gr.Group():
+                    gr.Markdown("## Impostazioni Analisi")
+            
+                    with gr.Row():
+                        with gr.Column():
+                            model_select = gr.Dropdown(
+                                choices=MODEL_CHOICES,
+                                value="gpt-4o-2024-08-06",
+                                label="Modello"
+                            )
                 
-                with gr.Column():
-                    granularity_select = gr.Radio(
-                        choices=["token", "word", "sentence"],
-                        value="sentence",
-                        label="Granularità di analisi",
-                        info="Scegli a che livello analizzare la confidenza"
-                    )
+                        with gr.Column():
+                            granularity_select = gr.Radio(
+                                choices=["token", "word", "sentence"],
+                                value="sentence",
+                                label="Granularità di analisi",
+                                info="Scegli a che livello analizzare la confidenza"
+                            )
+                            stream_checkbox = gr.Checkbox(
+                                value=True,
+                                label="Streaming",
+                                info="Mostra i risultati man mano che il modello genera la risposta"
+                            )
+                            cache_checkbox = gr.Checkbox(
+                                value=True,
+                                label="Usa cache",
+                                info="Riusa la risposta già ottenuta per lo stesso prompt e modello invece di inviare una nuova richiesta"
+                            )
+                            samples_slider = gr.Slider(
+                                minimum=1,
+                                maximum=10,
+                                value=1,
+                                step=1,
+                                label="Campioni (consenso)",
+                                info="Con più di un campione chiede più risposte nella stessa richiesta e mostra quanto concordano (senza streaming)"
+                            )
+                            top_logprobs_slider = gr.Slider(
+                                minimum=1,
+                                maximum=MAX_TOP_LOGPROBS,
+                                value=5,
+                                step=1,
+                                label="Alternative per token (top-k)",
+                                info="Con più di un'alternativa mostra anche entropia, margine e massa di probabilità delle alternative"
+                            )
         
-        with gr.Group():
-            gr.Markdown("## Prompt")
-            prompt_input = gr.Textbox(
-                label="Prompt",
-                placeholder="Inserisci il tuo prompt",
-                value="Descrivi le tecniche di scavo e i principali ritrovamenti archeologici del sito di Göbekli Tepe in Turchia, confrontandoli con quelli di Gunung Padang in Indonesia.",
-                lines=5
-            )
+                with gr.Group():
+                    gr.Markdown("## Prompt")
+                    prompt_input = gr.Textbox(
+                        label="Prompt",
+                        placeholder="Inserisci il tuo prompt",
+                        value="Descrivi le tecniche di scavo e i principali ritrovamenti archeologici del sito di Göbekli Tepe in Turchia, confrontandoli con quelli di Gunung Padang in Indonesia.",
+                        lines=5
+                    )
         
-        # Migliorato indicatore di elaborazione
-        with gr.Group():
-            analyze_btn = gr.Button("Analizza Confidenza", variant="primary", size="large")
+                # Migliorato indicatore di elaborazione
+                with gr.Group():
+                    analyze_btn = gr.Button("Analizza Confidenza", variant="primary", size="large")
             
-            with gr.Row():
-                status_indicator = gr.Markdown("")
+                    with gr.Row():
+                        status_indicator = gr.Markdown("")
                 
-        # Risultati
-        results_html = gr.HTML()
+                # Risultati
+                results_html = gr.HTML()
+        
+                # Navigazione tra le pagine dei risultati: il browser riceve solo la
+                # pagina corrente, in JSON compatto, e la disegna con VIEWER_JS
+                with gr.Row():
+                    prev_btn = gr.Button("◀ Pagina precedente", size="sm")
+                    page_number = gr.Number(value=1, label="Pagina", precision=0, minimum=1)
+                    next_btn = gr.Button("Pagina successiva ▶", size="sm")
+                page_data = gr.JSON(visible=False)
+        
+                # Risposta già analizzata a tutte le granularità, per cambiare vista senza nuove richieste
+                analysis_state = gr.State(None)
+        
+                # Tempi per fase dell'ultima analisi, per capire dove va il tempo
+                with gr.Accordion("Dettaglio tempi (debug)", open=False):
+                    timings = gr.Markdown("")
         
-        # Colleghiamo l'analisi con gli indicatori di caricamento migliorati
-        analyze_btn.click(
-            fn=start_processing,
-            inputs=None,
-            outputs=status_indicator
-        ).then(
-            fn=run_analysis,
-            inputs=[api_key_input, model_select, prompt_input, granularity_select],
-            outputs=results_html,
-            show_progress=True
-        ).then(
-            fn=end_processing,
-            inputs=None,
-            outputs=status_indicator
-        )
+                # Colleghiamo l'analisi con gli indicatori di caricamento migliorati
+                analyze_btn.click(
+                    fn=start_processing,
+                    inputs=None,
+                    outputs=status_indicator
+                ).then(
+                    fn=run_analysis,
+                    inputs=[api_key_input, model_select, prompt_input, granularity_select, stream_checkbox, cache_checkbox,
+                            samples_slider, top_logprobs_slider],
+                    outputs=[results_html, analysis_state, page_data, page_number, timings],
+                    show_progress=True,
+                    **serving.analysis_options()
+                ).then(
+                    fn=None,
+                    inputs=page_data,
+                    js=VIEWER_JS
+                ).then(
+                    fn=end_processing,
+                    inputs=None,
+                    outputs=status_indicator
+                )
+        
+                # Cambiare granularità mostra la stessa risposta senza rieseguire l'analisi
+                granularity_select.change(
+                    fn=render_view,
+                    inputs=[analysis_state, granularity_select],
+                    outputs=[results_html, page_data, page_number]
+                ).then(fn=None, inputs=page_data, js=VIEWER_JS)
+        
+                prev_btn.click(
+                    fn=lambda analyses, granularity, page: show_page(analyses, granularity, (page or 1) - 1),
+                    inputs=[analysis_state, granularity_select, page_number],
+                    outputs=[page_data, page_number]
+                ).then(fn=None, inputs=page_data, js=VIEWER_JS)
+                next_btn.click(
+                    fn=lambda analyses, granularity, page: show_page(analyses, granularity, (page or 1) + 1),
+                    inputs=[analysis_state, granularity_select, page_number],
+                    outputs=[page_data, page_number]
+                ).then(fn=None, inputs=page_data, js=VIEWER_JS)
+                page_number.submit(
+                    fn=show_page,
+                    inputs=[analysis_state, granularity_select, page_number],
+                    outputs=[page_data, page_number]
+                ).then(fn=None, inputs=page_data, js=VIEWER_JS)
+        
+                # Stesso prompt su più modelli in parallelo, con una colonna per modello
+                with gr.Group():
+                    gr.Markdown("## Confronto tra modelli")
+                    compare_models_select = gr.CheckboxGroup(
+                        choices=MODEL_CHOICES,
+                        value=["gpt-4o-2024-08-06", "gpt-4o-mini-2024-07-18"],
+                        label="Modelli da confrontare",
+                        info="Le richieste partono insieme: ogni colonna compare appena arriva la risposta del modello"
+                    )
+                    compare_btn = gr.Button("Confronta modelli")
+                comparison_html = gr.HTML()
+        
+                compare_btn.click(
+                    fn=run_comparison,
+                    inputs=[api_key_input, compare_models_select, prompt_input, cache_checkbox],
+                    outputs=comparison_html,
+                    show_progress=True,
+                    **serving.analysis_options()
+                )
+            
+            # Analisi salvate: filtri, una pagina di risultati alla volta e
+            # apertura di un run nella scheda Analisi senza nuove richieste
+            with gr.Tab("Storico", id="history"):
+                with gr.Group():
+                    gr.Markdown("## Segmenti poco sicuri")
+                    with gr.Row():
+                        history_model = gr.Dropdown(
+                            choices=[ALL_MODELS] + MODEL_CHOICES,
+                            value=ALL_MODELS,
+                            label="Modello"
+                        )
+                        history_threshold = gr.Slider(
+                            minimum=1,
+                            maximum=100,
+                            value=50,
+                            step=1,
+                            label="Confidenza sotto (%)"
+                        )
+                        history_days = gr.Number(
+                            value=7,
+                            minimum=0,
+                            precision=0,
+                            label="Ultimi giorni",
+                            info="0 = tutto lo storico"
+                        )
+                    history_search_btn = gr.Button("Cerca", variant="primary")
+                segments_html = gr.HTML()
+                with gr.Row():
+                    segments_prev_btn = gr.Button("◀ Pagina precedente", size="sm")
+                    segments_next_btn = gr.Button("Pagina successiva ▶", size="sm")
+                segments_state = gr.State(None)
+                
+                with gr.Group():
+                    gr.Markdown("## Analisi salvate")
+                    runs_refresh_btn = gr.Button("Aggiorna")
+                runs_html = gr.HTML()
+                with gr.Row():
+                    runs_prev_btn = gr.Button("◀ Pagina precedente", size="sm")
+                    runs_next_btn = gr.Button("Pagina successiva ▶", size="sm")
+                runs_state = gr.State(None)
+                with gr.Row():
+                    run_id_input = gr.Number(label="Run", precision=0, minimum=1)
+                    open_run_btn = gr.Button("Apri nella scheda Analisi")
+                
+                history_filters = [api_key_input, history_model, history_threshold, history_days, segments_state]
+                history_search_btn.click(
+                    fn=show_history_segments,
+                    inputs=history_filters,
+                    outputs=[segments_html, segments_state]
+                )
+                segments_prev_btn.click(
+                    fn=lambda *filters: show_history_segments(*filters, step=-1),
+                    inputs=history_filters,
+                    outputs=[segments_html, segments_state]
+                )
+                segments_next_btn.click(
+                    fn=lambda *filters: show_history_segments(*filters, step=1),
+                    inputs=history_filters,
+                    outputs=[segments_html, segments_state]
+                )
+                runs_refresh_btn.click(
+                    fn=show_history_runs,
+                    inputs=[api_key_input, history_model, runs_state],
+                    outputs=[runs_html, runs_state]
+                )
+                runs_prev_btn.click(
+                    fn=lambda api_key, model, state: show_history_runs(api_key, model, state, step=-1),
+                    inputs=[api_key_input, history_model, runs_state],
+                    outputs=[runs_html, runs_state]
+                )
+                runs_next_btn.click(
+                    fn=lambda api_key, model, state: show_history_runs(api_key, model, state, step=1),
+                    inputs=[api_key_input, history_model, runs_state],
+                    outputs=[runs_html, runs_state]
+                )
+                open_run_btn.click(
+                    fn=open_history_run,
+                    inputs=[api_key_input, run_id_input, granularity_select],
+                    outputs=[results_html, analysis_state, page_data, page_number]
+                ).then(
+                    fn=lambda: gr.Tabs(selected="analysis"),
+                    outputs=tabs
+                ).then(fn=None, inputs=page_data, js=VIEWER_JS)
         
         # Aggiungiamo una sezione informativa
         with gr.Accordion("Informazioni sull'app", open=False):
@@ -642,9 +546,16 @@ def create_interface():
             - Utilizza il parametro `logprobs=True` disponibile in alcuni modelli
             """)
     
+    # Coda con concorrenza e lunghezza limitate: chi è in attesa vede
+    # posizione e tempo stimato, oltre il limite la richiesta è rifiutata subito
+    app.queue(**serving.queue_options())
     return app
 
 # Avvia l'applicazione
 if __name__ == "__main__":
+    # Metriche Prometheus su /metrics se LOGPROB_METRICS_PORT è impostata
+    start_metrics_server()
+    # Pool di processi per l'analisi, se LOGPROB_WORKERS è impostata: avviato e preparato subito
+    offload.start()
     app = create_interface()
     app.launch(share=True)  # Aggiunto 'share=True' per generare un link pubblico
@@ -0,0 +1 @@
+"""Componenti condivisi dalle interfacce del Sentence Confidence Analyzer."""
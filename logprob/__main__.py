@@ -0,0 +1,125 @@
+"""Analisi della confidenza da riga di comando, senza interfaccia grafica.
+
+Esempi:
+
+    python -m logprob "Chi ha scoperto Göbekli Tepe?" --granularity word
+    python -m logprob --response risposta.json --format json
+    curl ... | python -m logprob --response - --top-logprobs 5
+
+Con un prompt la risposta viene richiesta all'API (API key da --api-key o
+OPENAI_API_KEY); con --response si analizza una risposta di chat completion
+già salvata (il JSON restituito dall'API), senza rete. Per molti prompt
+c'è python -m logprob.batch.
+
+I moduli di analisi vengono importati solo dopo aver letto gli argomenti e
+`requests` solo se serve una richiesta, così l'avvio resta rapido.
+"""
+import argparse
+import os
+import sys
+from typing import Any, Dict, List, Optional
+
+
+def format_text(result: Dict[str, Any]) -> str:
+    """Risultato in testo semplice: una riga per frase, parola o token con la confidenza."""
+    from logprob.render import format_uncertainty, get_confidence_label
+
+    granularity = result['granularity']
+    lines = []
+    for segment in result['segments']:
+        if granularity == "sentence":
+            lines.append(f"{segment['confidence']:6.2f}%  {segment['text']}")
+            lines.append(f"         {get_confidence_label(segment['confidence'])}{format_uncertainty(segment)}")
+        elif granularity == "word":
+            lines.extend(f"{word['confidence']:6.2f}%  {word['text']}" for word in segment['words'])
+        else:
+            table = result['table']
+            first, last = segment['token_start'], segment['token_end']
+            lines.extend(
+                f"{confidence:6.2f}%  {token!r}"
+                for token, confidence in zip(table.token_texts(first, last), table.confidences[first:last].tolist())
+            )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m logprob",
+        description="Analizza la confidenza di una risposta di un modello OpenAI a partire dai logprobs."
+    )
+    parser.add_argument("prompt", nargs="?", help="prompt da inviare al modello")
+    parser.add_argument("--response", metavar="FILE",
+                        help="analizza una risposta di chat completion già salvata (JSON; - per stdin)")
+    parser.add_argument("--model", default="gpt-4o-2024-08-06")
+    parser.add_argument("--granularity", choices=["token", "word", "sentence"], default="sentence")
+    parser.add_argument("--top-logprobs", type=int, default=1,
+                        help="alternative per token (1-20); con più di una calcola anche entropia e margine")
+    parser.add_argument("--format", choices=["text", "json", "html"], default="text", dest="output_format")
+    parser.add_argument("--export", metavar="DIR",
+                        help="salva token e segmenti nell'archivio Arrow/Parquet DIR (richiede pyarrow)")
+    parser.add_argument("--export-format", choices=["arrow", "parquet"], default="arrow")
+    parser.add_argument("--timings", action="store_true", help="mostra su stderr il tempo di ogni fase")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="non leggere né scrivere la cache delle risposte")
+    parser.add_argument("--api-key", default=os.environ.get("OPENAI_API_KEY"),
+                        help="API key OpenAI (default: variabile OPENAI_API_KEY)")
+    parser.add_argument("--api-base", help="URL base dell'API (default: variabile LOGPROB_API_BASE o l'API OpenAI)")
+    args = parser.parse_args(argv)
+
+    if (args.prompt is None) == (args.response is None):
+        parser.error("Indica un prompt oppure --response")
+    if args.prompt is not None and not args.api_key:
+        parser.error("Inserisci una API key con --api-key o OPENAI_API_KEY")
+
+    from logprob import core
+    from logprob.metrics import StageTimer
+
+    timer = StageTimer()
+    if args.response is not None:
+        if args.response == "-":
+            body = sys.stdin.buffer.read()
+        else:
+            with open(args.response, 'rb') as f:
+                body = f.read()
+        result = core.analyze_response(body, args.granularity, timer)
+    else:
+        if args.api_base:
+            from logprob import transport
+            transport.configure(api_base=args.api_base)
+        result = core.analyze_confidence(args.api_key, args.model, args.prompt, args.granularity,
+                                         not args.no_cache, timer, args.top_logprobs)
+
+    if "error" in result:
+        print(result['error'], file=sys.stderr)
+        return 1
+
+    if args.export:
+        from logprob.export import export_analysis
+        with timer.stage("export"):
+            # Di una risposta salvata non si conosce il prompt: l'hash è quello del prompt vuoto
+            paths = export_analysis(args.export, result, args.model, args.prompt or "", args.export_format)
+        print(f"Esportato in {paths['tokens']} e {paths['segments']}", file=sys.stderr)
+
+    with timer.stage("render"):
+        if args.output_format == "json":
+            import json
+            from logprob.analysis import serialize_analysis
+            result = {key: value for key, value in result.items() if key != 'analyses'}
+            output = json.dumps(serialize_analysis(result), ensure_ascii=False)
+        elif args.output_format == "html":
+            from logprob.render import format_results
+            output = format_results(result)
+        else:
+            output = format_text(result)
+    print(output)
+
+    timer.finish("cli")
+    if args.timings:
+        for name, seconds, share in timer.breakdown():
+            print(f"{name:>10} {seconds * 1000:8.1f} ms {share:4.0f}%", file=sys.stderr)
+        print(f"{'totale':>10} {timer.total * 1000:8.1f} ms", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
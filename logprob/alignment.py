@@ -0,0 +1,167 @@
+"""Indice di allineamento tra i token restituiti dall'API e il testo generato."""
+import re
+from typing import Any, Dict, Iterable, List, Pattern, Sequence, Tuple, Union
+
+import numpy as np
+
+from logprob.tokens import TokenTable
+
+Span = Tuple[int, int]
+
+# Segmento del testo: (inizio, fine, tipo)
+Segment = Tuple[int, int, str]
+
+# Una parola è una sequenza alfanumerica con eventuali trattini interni
+WORD_PATTERN = re.compile(r'\w+(?:-\w+)*')
+
+# Separatore tra frasi: spazi preceduti da punto, esclamativo o interrogativo
+SENTENCE_BREAK = re.compile(r'(?<=[.!?])\s+')
+
+
+class AlignmentIndex:
+    """Allineamento tra span di caratteri e token di una TokenTable.
+
+    Gli offset dei token sono ordinati, quindi il token che contiene un
+    carattere si trova con una ricerca binaria (np.searchsorted), anche per
+    molti span con una sola chiamata vettoriale. Le statistiche di molti
+    intervalli di token si calcolano insieme con np.add.reduceat e
+    np.minimum.reduceat.
+    """
+
+    def __init__(self, tokens: Union[TokenTable, Sequence[Dict[str, Any]]] = ()):
+        self.table = tokens if isinstance(tokens, TokenTable) else TokenTable.from_tokens(list(tokens))
+
+    def append(self, token: Dict[str, Any]) -> str:
+        """Aggiunge un token in coda (usato anche durante lo streaming); restituisce il testo aggiunto."""
+        return self.table.append_token(token)
+
+    def extend(self, tokens: Iterable[Dict[str, Any]]) -> None:
+        """Aggiunge più token in coda."""
+        self.table.extend(tokens)
+
+    @property
+    def text(self) -> str:
+        """Testo completo ricostruito dai token."""
+        return self.table.text
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def token_range(self, start: int, end: int) -> Tuple[int, int]:
+        """Restituisce l'intervallo [primo, ultimo) dei token che si sovrappongono a [start, end)."""
+        offsets = self.table.offsets
+        end = min(end, int(offsets[-1]))
+        if start >= end:
+            return (0, 0)
+        return (int(offsets.searchsorted(start, 'right')) - 1, int(offsets.searchsorted(end - 1, 'right')))
+
+    def token_ranges(self, starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Versione vettoriale di token_range per array di inizi e fini.
+
+        Gli span vuoti (o oltre la fine del testo) danno l'intervallo (0, 0).
+        """
+        offsets = self.table.offsets
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.minimum(np.asarray(ends, dtype=np.int64), offsets[-1])
+        valid = starts < ends
+        firsts = np.where(valid, offsets.searchsorted(starts, 'right') - 1, 0)
+        lasts = np.where(valid, offsets.searchsorted(ends - 1, 'right'), 0)
+        return firsts, lasts
+
+    def map_spans(self, spans: Iterable[Span]) -> List[Tuple[int, int]]:
+        """Mappa una sequenza di span di caratteri sui rispettivi intervalli di token."""
+        return [self.token_range(start, end) for start, end in spans]
+
+    def mean_logprob(self, first: int, last: int) -> float:
+        """Logprob media dei token nell'intervallo [first, last)."""
+        return float(self.table.logprobs[first:last].mean())
+
+    def segment_stats(self, firsts: np.ndarray, lasts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Logprob media e minima di ogni intervallo di token [firsts[i], lasts[i]).
+
+        Gli intervalli possono sovrapporsi o lasciare buchi: i confini vengono
+        intercalati (inizio, fine, inizio, fine...) e di reduceat si tengono
+        solo le posizioni pari. Gli intervalli vuoti danno NaN. Si legge solo
+        la parte della tabella coperta dagli intervalli (vedi _window), così
+        in streaming il costo non cresce con i token già ricevuti.
+        """
+        count = len(firsts)
+        if count == 0:
+            return np.empty(0), np.empty(0)
+
+        lengths = np.asarray(lasts) - np.asarray(firsts)
+        empty = lengths <= 0
+        low, high, bounds = _window(firsts, lasts, empty)
+        # Un elemento in più perché reduceat accetta solo indici < len
+        values = np.append(self.table.logprobs[low:high], 0.0)
+        sums = np.add.reduceat(values, bounds)[0::2]
+        means = np.divide(sums, lengths, out=np.full(count, np.nan), where=~empty)
+        minima = np.minimum.reduceat(values, bounds)[0::2]
+        minima[empty] = np.nan
+        return means, minima
+
+    def segment_means(self, columns: np.ndarray, firsts: np.ndarray, lasts: np.ndarray) -> np.ndarray:
+        """Media per colonna di una matrice (token x m) su ogni intervallo di token.
+
+        Come segment_stats, ma per più colonne con un'unica reduceat; i NaN
+        vengono ignorati e gli intervalli senza valori danno NaN.
+        """
+        count = len(firsts)
+        width = columns.shape[1]
+        if count == 0:
+            return np.empty((0, width))
+
+        lengths = np.asarray(lasts) - np.asarray(firsts)
+        low, high, bounds = _window(firsts, lasts, lengths <= 0)
+        columns = columns[low:high]
+        # Somme dei valori e conteggi dei valori validi affiancati nella stessa matrice
+        valid = ~np.isnan(columns)
+        stacked = np.zeros((len(columns) + 1, 2 * width))
+        stacked[:-1, :width] = np.where(valid, columns, 0.0)
+        stacked[:-1, width:] = valid
+        reduced = np.add.reduceat(stacked, bounds, axis=0)[0::2]
+
+        counts = reduced[:, width:]
+        empty = (lengths <= 0)[:, None] | (counts == 0)
+        return np.divide(reduced[:, :width], counts, out=np.full((count, width), np.nan), where=~empty)
+
+
+def _window(firsts: np.ndarray, lasts: np.ndarray, empty: np.ndarray) -> Tuple[int, int, np.ndarray]:
+    """Righe [low, high) coperte dagli intervalli non vuoti e confini per reduceat relativi a low.
+
+    I confini sono intercalati (inizio, fine, inizio, fine...); quelli degli
+    intervalli vuoti, il cui risultato viene scartato, sono riportati dentro
+    la finestra.
+    """
+    firsts = np.asarray(firsts, dtype=np.intp)
+    lasts = np.asarray(lasts, dtype=np.intp)
+    if empty.all():
+        low = high = 0
+    else:
+        low = int(firsts[~empty].min())
+        high = int(lasts[~empty].max())
+    bounds = np.empty(2 * len(firsts), dtype=np.intp)
+    bounds[0::2] = firsts
+    bounds[1::2] = lasts
+    np.clip(bounds - low, 0, high - low, out=bounds)
+    return low, high, bounds
+
+
+def word_spans(text: str) -> List[Span]:
+    """Restituisce gli span (inizio, fine) di tutte le parole del testo."""
+    return [match.span() for match in WORD_PATTERN.finditer(text)]
+
+
+def split_spans(text: str, separator: Pattern, start: int = 0) -> List[Span]:
+    """Equivalente di re.split che restituisce gli span dei pezzi non vuoti.
+
+    La divisione inizia dalla posizione `start` del testo.
+    """
+    spans = []
+    for match in separator.finditer(text, start):
+        if text[start:match.start()].strip():
+            spans.append((start, match.start()))
+        start = match.end()
+    if text[start:].strip():
+        spans.append((start, len(text)))
+    return spans
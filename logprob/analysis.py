@@ -0,0 +1,255 @@
+"""Segmentazione del testo e calcolo della confidenza a partire dai logprob.
+
+Modulo senza dipendenze dall'interfaccia, usato sia dalle app Gradio sia
+dall'elaborazione batch.
+"""
+import math
+import re
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+from logprob.alignment import WORD_PATTERN, AlignmentIndex, Segment
+from logprob.metrics import TOKENS_PROCESSED, StageTimer
+from logprob.tokens import TokenTable
+from logprob.uncertainty import UNCERTAINTY_FIELDS
+
+
+GRANULARITIES = ("token", "word", "sentence")
+
+
+def logprob_to_confidence(logprob: float) -> float:
+    """Converte logprob in percentuale di confidenza."""
+    return math.exp(logprob) * 100
+
+# SEGMENTAZIONE DEL TESTO IN UN'UNICA PASSATA
+# Titoli markdown ed elementi di elenco: occupano sempre un'intera riga
+BLOCK_LINE = re.compile(r'^[ \t]*(?:(?P<heading>#{1,6})|(?P<list_item>[-*+]|\d+[.)]))[ \t]+\S', re.MULTILINE)
+
+# Confine tra frasi: punteggiatura finale (con eventuali virgolette o
+# parentesi di chiusura) seguita da spazi, oppure una riga vuota
+SENTENCE_BOUNDARY = re.compile(r'[.!?]+["\'»”’)\]]*(\s+)|\n[ \t\r]*\n')
+
+def _append_segment(text: str, start: int, end: int, kind: str, segments: List[Segment]) -> None:
+    """Aggiunge lo span [start, end) senza gli spazi iniziali e finali, se non è vuoto."""
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    if start < end:
+        segments.append((start, end, kind))
+
+def _sentence_spans(text: str, start: int, end: int, segments: List[Segment]) -> None:
+    """Divide in frasi il testo in [start, end), che non contiene titoli né elenchi."""
+    piece = start
+    for match in SENTENCE_BOUNDARY.finditer(text, start, end):
+        if match.group(1) is None:
+            gap_start, gap_end = match.span()
+        else:
+            gap_start, gap_end = match.span(1)
+            # Dopo la punteggiatura la frase finisce solo se segue una
+            # maiuscola, un trattino, un asterisco o un titolo (o una riga vuota)
+            following = text[gap_end:gap_end + 1]
+            if text.count('\n', gap_start, gap_end) < 2 and not (following.isupper() or following in ('-', '*', '#')):
+                continue
+        _append_segment(text, piece, gap_start, "sentence", segments)
+        piece = gap_end
+    _append_segment(text, piece, end, "sentence", segments)
+
+def segment_spans(text: str, start: int = 0) -> List[Segment]:
+    """Segmenta il testo in titoli, elementi di elenco e frasi con un'unica passata.
+    
+    Restituisce gli span (inizio, fine, tipo) dei segmenti nel testo
+    originale, senza spazi iniziali e finali; il tipo è "heading",
+    "list_item" o "sentence". La scansione parte da `start`, che non deve
+    cadere a metà di un titolo o di un elemento di elenco; l'inizio riga
+    resta quello del testo completo.
+    """
+    segments: List[Segment] = []
+    prose = start
+    for match in BLOCK_LINE.finditer(text, start):
+        _sentence_spans(text, prose, match.start(), segments)
+        
+        line_end = text.find('\n', match.end())
+        if line_end == -1:
+            line_end = len(text)
+        _append_segment(text, match.start(), line_end, "heading" if match.group('heading') else "list_item", segments)
+        prose = line_end
+    
+    _sentence_spans(text, prose, len(text), segments)
+    return segments
+
+# CONFIDENZA DEI SEGMENTI ALLE DIVERSE GRANULARITÀ
+def analyze_spans(index: AlignmentIndex, spans: Sequence[Segment],
+                  granularities: Sequence[str] = GRANULARITIES,
+                  token_offset: int = 0) -> Dict[str, List[Dict[str, Any]]]:
+    """Calcola la confidenza dei segmenti alle granularità richieste.
+    
+    `spans` sono i segmenti (inizio, fine, tipo) nel testo dell'indice, in
+    ordine. Intervalli di token, medie e minimi di tutti i segmenti e di
+    tutte le parole si ottengono con poche operazioni vettoriali sulla
+    tabella dei token; `exp` viene applicato una sola volta per array. In
+    modalità token ogni token viene assegnato solo al primo segmento che lo
+    contiene (e mai a segmenti prima di token_offset).
+    
+    Se la tabella contiene le alternative top-k, frasi e parole riportano
+    anche la media di entropia, margine e massa dei loro token
+    (UNCERTAINTY_FIELDS), calcolata con un'unica reduceat per tutti i campi;
+    in modalità token non serve e non viene letta.
+    """
+    text = index.text
+    uncertainty = index.table.uncertainty if {"sentence", "word"} & set(granularities) else None
+    count = len(spans)
+    starts = np.fromiter((span[0] for span in spans), dtype=np.int64, count=count)
+    ends = np.fromiter((span[1] for span in spans), dtype=np.int64, count=count)
+    firsts, lasts = index.token_ranges(starts, ends)
+    segment_data: Dict[str, List[Dict[str, Any]]] = {granularity: [] for granularity in granularities}
+    
+    if "token" in segment_data:
+        # Primo token non ancora assegnato ai segmenti precedenti
+        assigned = np.maximum.accumulate(np.concatenate(([token_offset], lasts[:-1])))
+        token_firsts = np.maximum(firsts, assigned)
+        for (start, end, kind), first, last in zip(spans, token_firsts.tolist(), lasts.tolist()):
+            if first < last:
+                segment_data["token"].append({
+                    'text': text[start:end],
+                    'kind': kind,
+                    'token_start': first,
+                    'token_end': last,
+                })
+    
+    if "sentence" in segment_data:
+        # sentence: confidenza media e minima dei token del segmento
+        means, minima = index.segment_stats(firsts, lasts)
+        confidences = np.exp(means) * 100
+        min_confidences = np.exp(minima) * 100
+        segment_uncertainty = _uncertainty_rows(index, uncertainty, firsts, lasts)
+        for (start, end, kind), mean, confidence, min_confidence, extra in zip(
+                spans, means.tolist(), confidences.tolist(), min_confidences.tolist(), segment_uncertainty):
+            if not math.isnan(mean):
+                segment_data["sentence"].append({
+                    'text': text[start:end],
+                    'kind': kind,
+                    'confidence': confidence,
+                    'min_confidence': min_confidence,
+                    'mean_logprob': mean,
+                    **extra,
+                })
+    
+    if "word" in segment_data:
+        # Le parole di tutti i segmenti vengono raccolte in un unico array;
+        # la ricerca si ferma alla fine del segmento come sul testo isolato
+        word_starts: List[int] = []
+        word_ends: List[int] = []
+        word_counts = []
+        for start, end, _ in spans:
+            found = len(word_starts)
+            for match in WORD_PATTERN.finditer(text, start, end):
+                word_starts.append(match.start())
+                word_ends.append(match.end())
+            word_counts.append(len(word_starts) - found)
+        
+        word_firsts, word_lasts = index.token_ranges(word_starts, word_ends)
+        word_confidences = (np.exp(index.segment_stats(word_firsts, word_lasts)[0]) * 100).tolist()
+        word_valid = (word_firsts < word_lasts).tolist()
+        word_uncertainty = _uncertainty_rows(index, uncertainty, word_firsts, word_lasts)
+        
+        position = 0
+        for (start, end, kind), word_count in zip(spans, word_counts):
+            words = [
+                {
+                    'text': text[word_starts[j]:word_ends[j]],
+                    'confidence': word_confidences[j],
+                    'start': word_starts[j],
+                    'end': word_ends[j],
+                    **word_uncertainty[j]
+                }
+                for j in range(position, position + word_count)
+                if word_valid[j]
+            ]
+            position += word_count
+            if words:
+                segment_data["word"].append({
+                    'text': text[start:end],
+                    'kind': kind,
+                    'start': start,
+                    'words': words
+                })
+    
+    return segment_data
+
+def _uncertainty_rows(index: AlignmentIndex, uncertainty: Optional[np.ndarray],
+                      firsts: np.ndarray, lasts: np.ndarray) -> List[Dict[str, float]]:
+    """Medie di entropia, margine e massa per intervallo, come dizionari (vuoti senza alternative)."""
+    if uncertainty is None:
+        return [{}] * len(firsts)
+    means = index.segment_means(uncertainty, firsts, lasts)
+    return [dict(zip(UNCERTAINTY_FIELDS, row)) for row in means.tolist()]
+
+def analyze_segment(index: AlignmentIndex, span: Segment, granularity: str,
+                    token_offset: int = 0) -> Optional[Dict[str, Any]]:
+    """Calcola la confidenza di un singolo segmento (inizio, fine, tipo).
+    
+    In modalità token vengono ignorati i token già assegnati ai segmenti
+    precedenti (quelli prima di token_offset).
+    """
+    data = analyze_spans(index, [span], (granularity,), token_offset)
+    return data[granularity][0] if data[granularity] else None
+
+def create_confidence_analyses(text: str, tokens: Union[TokenTable, List[Dict[str, Any]]],
+                               granularities: Sequence[str] = GRANULARITIES,
+                               timer: Optional[StageTimer] = None) -> Dict[str, Dict[str, Any]]:
+    """Calcola in un'unica passata sui token le analisi alle granularità richieste.
+    
+    Allineamento e segmentazione vengono eseguiti una sola volta; per ogni
+    segmento si producono i dati di tutte le granularità, così passare da
+    una vista all'altra non richiede altri calcoli. I segmenti a livello di
+    token contengono solo l'intervallo [token_start, token_end) nella
+    tabella dei token, restituita nella chiave 'table'. Se indicato, `timer`
+    riceve i tempi delle fasi "alignment", "segment" e "analysis".
+    """
+    timer = timer or StageTimer()
+    
+    # Tabella colonnare dei token e indice di allineamento sul testo
+    with timer.stage("alignment"):
+        table = tokens if isinstance(tokens, TokenTable) else TokenTable.from_tokens(tokens)
+        index = AlignmentIndex(table)
+        full_text = index.text
+    TOKENS_PROCESSED.inc(len(table))
+    
+    # I segmenti sono già span nel testo originale: nessuna ricerca a posteriori
+    with timer.stage("segment"):
+        spans = segment_spans(full_text)
+    with timer.stage("analysis"):
+        segment_data = analyze_spans(index, spans, granularities)
+    
+    return {
+        granularity: {
+            'text': full_text,
+            'segments': segment_data[granularity],
+            'granularity': granularity,
+            'table': table
+        }
+        for granularity in granularities
+    }
+
+def create_confidence_analysis(text: str, tokens: Union[TokenTable, List[Dict[str, Any]]], granularity: str) -> Dict[str, Any]:
+    """Analisi della confidenza a una sola granularità (token, word o sentence).
+
+    Come create_confidence_analyses, con un'unica passata di segmentazione e
+    allineamento; le granularità non riconosciute valgono come "sentence".
+    """
+    if granularity not in ("token", "word"):
+        granularity = "sentence"
+    return create_confidence_analyses(text, tokens, (granularity,))[granularity]
+
+def serialize_analysis(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Restituisce l'analisi in forma serializzabile in JSON.
+    
+    La tabella dei token viene inclusa solo a livello di token, come due
+    liste parallele di testi e logprob a cui rimandano token_start/token_end.
+    """
+    data = {key: value for key, value in result.items() if key != 'table'}
+    if result.get('granularity') == "token" and 'table' in result:
+        data['tokens'] = result['table'].to_dict()
+    return data
@@ -0,0 +1,250 @@
+"""Richieste di chat completion con logprobs all'API OpenAI."""
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+from logprob import transport
+from logprob.cache import ResponseCache, api_key_hash, cache_key, get_cache
+from logprob.decoding import decode_choices
+from logprob.metrics import API_ERRORS, CACHE_LOOKUPS, StageTimer
+from logprob.singleflight import SingleFlight
+from logprob.streaming import StreamError, iter_stream_tokens
+from logprob.tokens import TokenTable
+
+SYSTEM_PROMPT = "You are a helpful assistant providing accurate and detailed information."
+
+# Massimo numero di alternative per token accettato dall'API
+MAX_TOP_LOGPROBS = 20
+
+# Richieste identiche in corso nello stesso momento partono una sola volta
+_flights = SingleFlight()
+
+# Consumo di una risposta che non ha richiesto una chiamata all'API
+NO_USAGE = {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+
+
+class APIError(Exception):
+    """Errore restituito dall'API o risposta senza logprobs."""
+
+
+class Completion(NamedTuple):
+    """Testo generato, tabella dei token con logprob e conteggio dei token usati.
+
+    `shared` è vero se la risposta è stata letta dalla cache o ricevuta da
+    una richiesta identica già in corso: `usage` resta quello della risposta
+    originale, ma questa richiesta non ha consumato token (vedi `consumed`).
+    """
+    text: str
+    tokens: TokenTable
+    usage: Dict[str, int]
+    shared: bool = False
+
+    @property
+    def consumed(self) -> Dict[str, int]:
+        """Token consumati da questa richiesta: nessuno se la risposta è condivisa."""
+        return dict(NO_USAGE) if self.shared else self.usage
+
+    def to_cache(self) -> List[Any]:
+        """Forma compatta salvata in cache (testi dei token e logprob, senza dizionari per token)."""
+        return [self.text, self.tokens.to_dict(), self.usage]
+
+    @classmethod
+    def from_cache(cls, value: List[Any]) -> "Completion":
+        text, tokens, usage = value
+        # Le voci salvate dalle versioni precedenti contengono la lista dei token dell'API
+        table = TokenTable.from_tokens(tokens) if isinstance(tokens, list) else TokenTable.from_dict(tokens)
+        return cls(text, table, usage, shared=True)
+
+
+class TokenStream:
+    """Token di una risposta in streaming, da iterare una sola volta.
+
+    Come Completion.shared, `shared` è vero se i token vengono dalla cache
+    o da uno stream identico già in corso; il valore è definitivo a stream
+    concluso.
+    """
+
+    def __init__(self, tokens: Iterable[Dict[str, Any]], fetched: Optional[threading.Event] = None):
+        self._tokens = tokens
+        self._fetched = fetched
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(self._tokens)
+
+    @property
+    def shared(self) -> bool:
+        return self._fetched is None or not self._fetched.is_set()
+
+
+def build_payload(model: str, prompt: str, temperature: float = 0.7, top_logprobs: int = 1,
+                  system_prompt: str = SYSTEM_PROMPT, n: int = 1) -> Dict[str, Any]:
+    """Costruisce il payload della richiesta di chat completion con logprobs.
+
+    Con n > 1 l'API genera n risposte indipendenti nella stessa chiamata.
+    Con top_logprobs > 1 ogni token riporta anche le alternative più
+    probabili, da cui si calcolano entropia e margine (logprob.uncertainty).
+    """
+    if not 0 <= top_logprobs <= MAX_TOP_LOGPROBS:
+        raise ValueError(f"top_logprobs deve essere tra 0 e {MAX_TOP_LOGPROBS}")
+    payload = {
+        "model": model,
+        "messages": [
+            {
+                "role": "system",
+                "content": system_prompt
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ],
+        "temperature": temperature,
+        "logprobs": True,
+        "top_logprobs": top_logprobs
+    }
+    if n > 1:
+        payload["n"] = n
+    return payload
+
+
+def error_message(response: Any) -> str:
+    """Estrae il messaggio di errore da una risposta non riuscita."""
+    try:
+        error_data = response.json()
+    except ValueError:
+        return response.reason
+    return error_data.get('error', {}).get('message', response.reason)
+
+
+def _flight_key(api_key: str, key: str) -> str:
+    # Solo richieste con la stessa API key vengono unite: errori di
+    # autenticazione o di limite e costi restano della chiave che li causa
+    return f"{api_key_hash(api_key)}:{key}"
+
+
+def _cached(cache: ResponseCache, key: str) -> Optional[Any]:
+    cached = cache.get(key)
+    CACHE_LOOKUPS.inc(result="hit" if cached is not None else "miss")
+    return cached
+
+
+def _check_status(response: Any) -> None:
+    if response.status_code != 200:
+        API_ERRORS.inc(status=response.status_code)
+        raise APIError(f"Errore API: {error_message(response)}")
+
+
+def request_completion(api_key: str, payload: Dict[str, Any], use_cache: bool = True,
+                       timer: Optional[StageTimer] = None) -> Completion:
+    """Invia la richiesta e restituisce il testo generato con i relativi logprob.
+
+    Con `use_cache` le risposte già ottenute per lo stesso payload vengono
+    lette dalla cache invece di ripetere la chiamata. Se indicato, `timer`
+    riceve i tempi delle fasi "cache", "network" e "decode".
+    """
+    return request_samples(api_key, payload, use_cache, timer)[0]
+
+
+def request_samples(api_key: str, payload: Dict[str, Any], use_cache: bool = True,
+                    timer: Optional[StageTimer] = None) -> List[Completion]:
+    """Come request_completion, ma restituisce tutte le n risposte del payload.
+
+    Le voci in cache di richieste con n = 1 restano nel formato di una
+    singola risposta. Se la stessa richiesta è già in corso (ad esempio da
+    un'altra sessione con la stessa API key) non ne parte una nuova: si
+    attende e si condivide la sua risposta (vedi logprob.singleflight). Le
+    risposte lette dalla cache o condivise hanno `shared` impostato.
+    """
+    timer = timer or StageTimer()
+    cache = get_cache() if use_cache else None
+    key = cache_key(payload)
+    if cache is not None:
+        with timer.stage("cache"):
+            cached = _cached(cache, key)
+        if cached is not None:
+            if payload.get("n", 1) == 1:
+                return [Completion.from_cache(cached)]
+            return [Completion.from_cache(value) for value in cached]
+
+    fetched = threading.Event()
+
+    def fetch() -> List[Completion]:
+        fetched.set()
+        return _fetch_samples(api_key, payload, cache, key, timer)
+
+    completions = _flights.do(_flight_key(api_key, key), fetch, timer)
+    if not fetched.is_set():
+        return [completion._replace(shared=True) for completion in completions]
+    return completions
+
+
+def _fetch_samples(api_key: str, payload: Dict[str, Any], cache: Optional[ResponseCache], key: str,
+                   timer: StageTimer) -> List[Completion]:
+    with timer.stage("network"):
+        response = transport.request("POST", "/chat/completions", api_key, json=payload)
+        _check_status(response)
+        # Il corpo viene letto qui, così "decode" misura solo la decodifica del JSON
+        response.content
+
+    # Il corpo viene decodificato direttamente nella tabella dei token
+    with timer.stage("decode"):
+        choices = decode_choices(response.content, payload.get("top_logprobs", 0) > 1)
+
+    # Verifica se logprobs sono disponibili
+    if not choices or any(decoded.table is None for decoded in choices):
+        raise APIError("Logprobs non disponibili. Potrebbe essere dovuto alle limitazioni dell'API.")
+
+    completions = [Completion(decoded.text, decoded.table, decoded.usage) for decoded in choices]
+    if cache is not None:
+        if payload.get("n", 1) == 1:
+            cache.put(key, completions[0].to_cache())
+        else:
+            cache.put(key, [completion.to_cache() for completion in completions])
+    return completions
+
+
+def stream_completion(api_key: str, payload: Dict[str, Any], use_cache: bool = True) -> TokenStream:
+    """Invia la richiesta in streaming e restituisce i token man mano che arrivano.
+
+    Se la risposta è in cache i token vengono restituiti subito; altrimenti,
+    a stream completato, la risposta viene salvata in cache. Le richieste
+    identiche in corso nello stesso momento con la stessa API key
+    condividono un solo stream.
+    """
+    cache = get_cache() if use_cache else None
+    key = cache_key(payload)
+    if cache is not None:
+        cached = _cached(cache, key)
+        if cached is not None:
+            return TokenStream(Completion.from_cache(cached).tokens.iter_tokens())
+
+    # Lo stream viene aperto dal thread della prima richiesta: chi si
+    # aggancia a uno stream in corso non esegue fetch
+    fetched = threading.Event()
+
+    def fetch() -> Iterator[Dict[str, Any]]:
+        fetched.set()
+        return _stream_tokens(api_key, payload, cache, key)
+
+    return TokenStream(_flights.stream(_flight_key(api_key, key), fetch), fetched)
+
+
+def _stream_tokens(api_key: str, payload: Dict[str, Any], cache: Optional[ResponseCache],
+                   key: str) -> Iterator[Dict[str, Any]]:
+    response = transport.request("POST", "/chat/completions", api_key,
+                                 json=dict(payload, stream=True), stream=True)
+    _check_status(response)
+
+    tokens = []
+    try:
+        for token in iter_stream_tokens(response):
+            tokens.append(token)
+            yield token
+    except StreamError:
+        API_ERRORS.inc(status="stream")
+        raise
+    finally:
+        response.close()
+
+    if cache is not None and tokens:
+        table = TokenTable.from_tokens(tokens)
+        cache.put(key, Completion(table.text, table, {}).to_cache())
@@ -0,0 +1,229 @@
+"""Analisi batch asincrona di prompt letti da un file JSONL.
+
+Esempio:
+
+    python -m logprob.batch prompts.jsonl risultati.jsonl --concurrency 16 --rpm 500 --tpm 300000
+
+Ogni riga dell'input è un oggetto JSON con almeno il campo "prompt"; i
+campi "id", "model" e "granularity" sono facoltativi (come id viene usato
+il numero di riga). I risultati vengono aggiunti al file di output in
+ordine di completamento, una riga per prompt: il file di output fa anche
+da checkpoint, quindi rilanciando lo stesso comando dopo un'interruzione i
+prompt già completati vengono saltati e quelli falliti ritentati.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, Optional, Set
+
+from logprob import transport
+from logprob.analysis import create_confidence_analysis, serialize_analysis
+from logprob.api import APIError, build_payload, request_completion
+from logprob.export import export_analysis
+from logprob.ratelimit import RateLimiter, estimate_tokens
+
+DEFAULT_MODEL = "gpt-4o-2024-08-06"
+
+
+@dataclass
+class BatchOptions:
+    """Parametri di un'esecuzione batch."""
+    model: str = DEFAULT_MODEL
+    granularity: str = "sentence"
+    concurrency: int = 8
+    requests_per_minute: Optional[float] = None
+    tokens_per_minute: Optional[float] = None
+    # Token di completamento stimati per richiesta, usati dal limitatore
+    # finché l'API non restituisce il consumo reale
+    completion_tokens: int = 512
+    use_cache: bool = True
+    # Alternative per token: con più di una i risultati riportano anche
+    # entropia, margine e massa medi di frasi e parole
+    top_logprobs: int = 1
+    # Archivio Arrow/Parquet in cui salvare token e segmenti (logprob.export)
+    export_dir: Optional[str] = None
+    export_format: str = "arrow"
+
+
+@dataclass
+class BatchStats:
+    """Conteggi di un'esecuzione batch."""
+    completed: int = 0
+    failed: int = 0
+    skipped: int = 0
+
+
+def read_prompts(path: str) -> Iterator[Dict[str, Any]]:
+    """Legge i prompt dal file JSONL, assegnando come id il numero di riga se manca."""
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            record.setdefault('id', line_number)
+            yield record
+
+
+def load_checkpoint(path: str) -> Set[str]:
+    """Restituisce gli id già completati con successo nel file di output.
+
+    Un'eventuale ultima riga incompleta (scrittura interrotta) viene
+    eliminata, così le nuove righe ripartono da un punto valido.
+    """
+    if not os.path.exists(path):
+        return set()
+
+    with open(path, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            f.truncate(end)
+
+    done = set()
+    for line in data[:end].splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if 'result' in record:
+            done.add(str(record['id']))
+    return done
+
+
+def analyze_prompt(api_key: str, record: Dict[str, Any], options: BatchOptions) -> Dict[str, Any]:
+    """Esegue richiesta e analisi per un singolo prompt (chiamata nei thread del pool)."""
+    model = record.get('model', options.model)
+    granularity = record.get('granularity', options.granularity)
+    output = {'id': record['id'], 'model': model, 'granularity': granularity, 'prompt': record['prompt']}
+
+    try:
+        payload = build_payload(model, record['prompt'], top_logprobs=options.top_logprobs)
+        completion = request_completion(api_key, payload, options.use_cache)
+        output['usage'] = completion.consumed
+        result = create_confidence_analysis(completion.text, completion.tokens, granularity)
+        output['result'] = serialize_analysis(result)
+        if options.export_dir:
+            exported = export_analysis(options.export_dir, result, model, record['prompt'], options.export_format)
+            output['run_id'] = exported['run_id']
+    except APIError as e:
+        output['error'] = str(e)
+    except Exception as e:
+        output['error'] = f"Errore: {str(e)}"
+    return output
+
+
+async def run_batch(api_key: str, input_path: str, output_path: str,
+                    options: BatchOptions, progress: bool = False) -> BatchStats:
+    """Analizza tutti i prompt dell'input con al più `concurrency` richieste in volo."""
+    stats = BatchStats()
+    done = load_checkpoint(output_path)
+    limiter = RateLimiter(options.requests_per_minute, options.tokens_per_minute)
+
+    # Il pool HTTP deve poter tenere aperte tutte le richieste in volo
+    if transport.get_settings().pool_maxsize < options.concurrency:
+        transport.configure(pool_maxsize=options.concurrency)
+
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=options.concurrency * 2)
+    started = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=options.concurrency) as executor, \
+            open(output_path, 'a', encoding='utf-8') as out:
+
+        async def producer():
+            for record in read_prompts(input_path):
+                if str(record['id']) in done:
+                    stats.skipped += 1
+                    continue
+                await queue.put(record)
+            for _ in range(options.concurrency):
+                await queue.put(None)
+
+        async def worker():
+            while True:
+                record = await queue.get()
+                if record is None:
+                    return
+
+                estimated = estimate_tokens(record['prompt'], options.completion_tokens)
+                await limiter.acquire(estimated)
+                output = await loop.run_in_executor(executor, analyze_prompt, api_key, record, options)
+                limiter.record_usage(estimated, (output.get('usage') or {}).get('total_tokens'))
+
+                # Una riga completa per risultato: il file resta un checkpoint valido
+                out.write(json.dumps(output, ensure_ascii=False) + '\n')
+                out.flush()
+
+                if 'error' in output:
+                    stats.failed += 1
+                else:
+                    stats.completed += 1
+
+                if progress:
+                    elapsed = time.monotonic() - started
+                    print(f"\r{stats.completed} completati, {stats.failed} falliti, "
+                          f"{stats.skipped} saltati ({elapsed:.0f}s)", end='', file=sys.stderr)
+
+        await asyncio.gather(producer(), *(worker() for _ in range(options.concurrency)))
+
+    if progress:
+        print(file=sys.stderr)
+    return stats
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m logprob.batch",
+        description="Analizza la confidenza di un file JSONL di prompt."
+    )
+    parser.add_argument("input", help="file JSONL con un oggetto {\"prompt\": ...} per riga")
+    parser.add_argument("output", help="file JSONL dei risultati (usato anche come checkpoint)")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--granularity", choices=["token", "word", "sentence"], default="sentence")
+    parser.add_argument("--concurrency", type=int, default=8, help="richieste in volo contemporaneamente")
+    parser.add_argument("--rpm", type=float, help="limite di richieste al minuto")
+    parser.add_argument("--tpm", type=float, help="limite di token al minuto")
+    parser.add_argument("--completion-tokens", type=int, default=512,
+                        help="token di risposta stimati per richiesta (per --tpm)")
+    parser.add_argument("--top-logprobs", type=int, default=1,
+                        help="alternative per token (1-20); con più di una calcola anche entropia e margine")
+    parser.add_argument("--export", metavar="DIR",
+                        help="salva token e segmenti di ogni risultato nell'archivio Arrow/Parquet DIR "
+                             "(richiede pyarrow)")
+    parser.add_argument("--export-format", choices=["arrow", "parquet"], default="arrow")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="non leggere né scrivere la cache delle risposte")
+    parser.add_argument("--api-key", default=os.environ.get("OPENAI_API_KEY"),
+                        help="API key OpenAI (default: variabile OPENAI_API_KEY)")
+    parser.add_argument("--api-base", help="URL base dell'API, ad esempio quello di logprob.mock_server "
+                                           "(default: variabile LOGPROB_API_BASE o l'API OpenAI)")
+    args = parser.parse_args(argv)
+
+    if not args.api_key:
+        parser.error("Inserisci una API key con --api-key o OPENAI_API_KEY")
+    if args.api_base:
+        transport.configure(api_base=args.api_base)
+
+    options = BatchOptions(
+        model=args.model,
+        granularity=args.granularity,
+        concurrency=args.concurrency,
+        requests_per_minute=args.rpm,
+        tokens_per_minute=args.tpm,
+        completion_tokens=args.completion_tokens,
+        use_cache=not args.no_cache,
+        top_logprobs=args.top_logprobs,
+        export_dir=args.export,
+        export_format=args.export_format,
+    )
+    stats = asyncio.run(run_batch(args.api_key, args.input, args.output, options, progress=True))
+    print(f"Completati: {stats.completed}, falliti: {stats.failed}, saltati: {stats.skipped}", file=sys.stderr)
+    return 1 if stats.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
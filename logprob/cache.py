@@ -0,0 +1,201 @@
+"""Cache su disco delle risposte dell'API, indirizzata per contenuto.
+
+La chiave è l'hash SHA-256 del payload della richiesta (modello, messaggi
+incluso il prompt di sistema, temperatura, top_logprobs...). Ogni risposta
+viene salvata compressa in un file `<dir>/<xx>/<hash>.z`; davanti al disco
+c'è un piccolo LRU in memoria.
+
+La cache può essere condivisa da più processi (ad esempio più worker
+Gradio): le scritture sono atomiche (file temporaneo + rename), le letture
+di file mancanti o danneggiati valgono come miss e l'evizione tollera file
+già rimossi da altri processi. I file temporanei recenti appartengono a
+scritture in corso e non vengono mai toccati; quelli più vecchi di
+TMP_GRACE_SECONDS sono orfani di processi interrotti e vengono rimossi
+dall'evizione. L'ordine LRU su disco è dato dalla data di
+modifica, aggiornata a ogni hit.
+
+Configurazione tramite variabili d'ambiente:
+
+- LOGPROB_CACHE: "0" per disattivare la cache
+- LOGPROB_CACHE_DIR: cartella (default ~/.cache/logprob)
+- LOGPROB_CACHE_MAX_BYTES: dimensione massima su disco (default 512 MB)
+- LOGPROB_CACHE_MEMORY_ITEMS: risposte tenute in memoria (default 128)
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from logprob.decoding import loads
+
+# Campi del payload che non cambiano il contenuto della risposta
+IGNORED_FIELDS = ("stream", "stream_options")
+
+# Età oltre la quale un file temporaneo è considerato orfano
+TMP_GRACE_SECONDS = 3600
+
+
+def cache_key(payload: Dict[str, Any]) -> str:
+    """Hash SHA-256 della forma canonica del payload."""
+    relevant = {k: v for k, v in payload.items() if k not in IGNORED_FIELDS}
+    canonical = json.dumps(relevant, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def prompt_hash(prompt: str) -> str:
+    """Hash SHA-256 del prompt, per raggruppare i run senza salvarne il testo."""
+    return hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+
+def api_key_hash(api_key: str) -> str:
+    """Hash SHA-256 della API key, per distinguere gli utenti senza conservarne la chiave."""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Cache a due livelli: LRU in memoria e file compressi su disco."""
+
+    def __init__(self, directory: str, max_bytes: int = 512 * 1024 * 1024, memory_items: int = 128):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self._memory: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Byte scritti dall'ultimo controllo della dimensione complessiva
+        self._written = max_bytes
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".z")
+
+    def _remember(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Any]:
+        """Restituisce il valore in cache o None."""
+        path = self._path(key)
+
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+
+        if value is None:
+            try:
+                with open(path, 'rb') as f:
+                    value = loads(zlib.decompress(f.read()))
+            except FileNotFoundError:
+                return None
+            except (OSError, ValueError, zlib.error):
+                # File danneggiato o rimosso durante la lettura
+                self._discard(path)
+                return None
+            self._remember(key, value)
+
+        # Aggiorna la posizione LRU su disco
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        """Salva un valore serializzabile in JSON."""
+        data = zlib.compress(json.dumps(value, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            self._discard(tmp_path)
+            raise
+
+        self._remember(key, value)
+
+        # La dimensione totale viene ricontrollata ogni 5% della capacità scritto
+        with self._lock:
+            self._written += len(data)
+            check = self._written >= self.max_bytes // 20
+            if check:
+                self._written = 0
+        if check:
+            self.evict()
+
+    def evict(self) -> None:
+        """Elimina i file usati meno di recente finché la cache supera il limite."""
+        entries = []
+        total = 0
+        stale = time.time() - TMP_GRACE_SECONDS
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if name.endswith(".tmp"):
+                    # Scrittura in corso (di questo o di un altro processo) oppure orfano
+                    if stat.st_mtime < stale:
+                        self._discard(path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        if total <= self.max_bytes:
+            return
+
+        # Scende sotto il 90% del limite per non rieseguire subito l'evizione
+        entries.sort()
+        target = self.max_bytes * 9 // 10
+        for _, size, path in entries:
+            if total <= target:
+                break
+            self._discard(path)
+            total -= size
+
+    def clear(self) -> None:
+        """Svuota entrambi i livelli della cache."""
+        with self._lock:
+            self._memory.clear()
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".tmp"):
+                    self._discard(os.path.join(root, name))
+
+    @staticmethod
+    def _discard(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+_default_cache: Optional[ResponseCache] = None
+_default_lock = threading.Lock()
+
+
+def get_cache() -> Optional[ResponseCache]:
+    """Restituisce la cache condivisa, o None se disattivata da LOGPROB_CACHE=0."""
+    global _default_cache
+    if os.environ.get("LOGPROB_CACHE", "1") == "0":
+        return None
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache(
+                os.environ.get("LOGPROB_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "logprob"),
+                max_bytes=int(os.environ.get("LOGPROB_CACHE_MAX_BYTES", 512 * 1024 * 1024)),
+                memory_items=int(os.environ.get("LOGPROB_CACHE_MEMORY_ITEMS", 128)),
+            )
+        return _default_cache
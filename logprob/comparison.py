@@ -0,0 +1,63 @@
+"""Confronto dello stesso prompt su più modelli in parallelo.
+
+Le richieste ai modelli partono tutte insieme in un pool di thread e i
+risultati vengono restituiti nell'ordine in cui arrivano, così
+l'interfaccia può mostrare ogni colonna appena pronta: il tempo totale è
+quello del modello più lento, non la somma dei tempi.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, Optional, Sequence
+
+import numpy as np
+
+from logprob.analysis import create_confidence_analyses
+from logprob.api import APIError, build_payload, request_completion
+
+# Segmenti sotto questa confidenza contano come incerti nelle statistiche
+UNCERTAIN_CONFIDENCE = 70.0
+
+
+def model_stats(analysis: Dict[str, Any], latency: float) -> Dict[str, Any]:
+    """Statistiche aggregate di un'analisi a livello di frase."""
+    logprobs = analysis['table'].logprobs
+    confidences = np.array([segment['confidence'] for segment in analysis['segments']], dtype=np.float64)
+    return {
+        'latency': latency,
+        'tokens': len(logprobs),
+        'segments': len(confidences),
+        'mean_confidence': float(np.exp(logprobs.mean()) * 100) if len(logprobs) else 0.0,
+        'min_confidence': float(confidences.min()) if len(confidences) else 0.0,
+        'uncertain': float((confidences < UNCERTAIN_CONFIDENCE).mean()) if len(confidences) else 0.0,
+    }
+
+
+def analyze_model(api_key: str, model: str, prompt: str, use_cache: bool = True) -> Dict[str, Any]:
+    """Analizza a livello di frase la risposta di un modello.
+
+    Restituisce {'model', 'analysis', 'stats', 'usage'} oppure {'model',
+    'error'}; in entrambi i casi 'latency' è la durata in secondi.
+    """
+    start = time.perf_counter()
+    try:
+        completion = request_completion(api_key, build_payload(model, prompt), use_cache)
+        analysis = create_confidence_analyses(completion.text, completion.tokens, ("sentence",))['sentence']
+    except APIError as e:
+        return {'model': model, 'error': str(e), 'latency': time.perf_counter() - start}
+    except Exception as e:
+        return {'model': model, 'error': f"Errore: {str(e)}", 'latency': time.perf_counter() - start}
+
+    latency = time.perf_counter() - start
+    return {'model': model, 'analysis': analysis, 'stats': model_stats(analysis, latency), 'latency': latency,
+            'usage': completion.consumed}
+
+
+def compare_models(api_key: str, models: Sequence[str], prompt: str, use_cache: bool = True,
+                   max_workers: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """Invia il prompt a tutti i modelli in parallelo e restituisce i risultati appena arrivano."""
+    if not models:
+        return
+    with ThreadPoolExecutor(max_workers=max_workers or len(models), thread_name_prefix="logprob-compare") as pool:
+        futures = [pool.submit(analyze_model, api_key, model, prompt, use_cache) for model in models]
+        for future in as_completed(futures):
+            yield future.result()
@@ -0,0 +1,140 @@
+"""Analisi di consenso tra più risposte campionate dallo stesso prompt.
+
+Con una sola risposta la confidenza mostrata riflette un unico percorso di
+campionamento. Chiedendo n risposte nella stessa chiamata (parametro `n`
+dell'API) si può misurare anche quanto i campioni concordano: i segmenti
+della risposta di riferimento vengono allineati a quelli degli altri
+campioni per similarità del coseno tra i vettori bag-of-words, e per ogni
+segmento si riporta la frazione di campioni che contiene un segmento
+equivalente.
+
+Tutti i confronti si fanno con un unico prodotto matriciale tra i segmenti
+di riferimento e i segmenti di tutti i campioni, quindi restano rapidi
+anche con n = 10 o più.
+"""
+from typing import Any, Dict, List, Sequence, Tuple, Union
+
+import numpy as np
+
+from logprob.alignment import WORD_PATTERN
+from logprob.analysis import create_confidence_analyses
+from logprob.tokens import TokenTable
+
+# Similarità minima perché due segmenti siano considerati equivalenti
+AGREEMENT_THRESHOLD = 0.5
+
+Sample = Tuple[str, Union[TokenTable, List[Dict[str, Any]]]]
+
+
+def bag_of_words(texts: Sequence[str]) -> np.ndarray:
+    """Matrice (testi x vocabolario) delle occorrenze delle parole, con righe di norma 1."""
+    vocabulary: Dict[str, int] = {}
+    rows: List[int] = []
+    columns: List[int] = []
+    for row, text in enumerate(texts):
+        for word in WORD_PATTERN.findall(text.lower()):
+            rows.append(row)
+            columns.append(vocabulary.setdefault(word, len(vocabulary)))
+
+    matrix = np.zeros((len(texts), len(vocabulary)), dtype=np.float32)
+    np.add.at(matrix, (np.asarray(rows, dtype=np.intp), np.asarray(columns, dtype=np.intp)), 1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+def best_matches(reference: np.ndarray, vectors: np.ndarray, counts: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+    """Per ogni riga di `reference`, il segmento più simile di ogni campione.
+
+    `vectors` contiene i segmenti di tutti i campioni uno dopo l'altro,
+    `counts[j]` quanti appartengono al campione j. Restituisce due matrici
+    (righe x campioni): la similarità migliore (-1 per i campioni senza
+    segmenti) e la posizione del segmento corrispondente in `vectors`.
+    """
+    counts = np.asarray(counts, dtype=np.intp)
+    samples = len(counts)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    similarity = reference @ vectors.T
+
+    # Le similarità vengono disposte in una matrice (righe, campioni, segmenti)
+    # riempita con -1, così massimo e argmax per campione sono un'unica operazione
+    width = int(counts.max()) if samples else 0
+    sample_of = np.repeat(np.arange(samples), counts)
+    position = np.arange(len(vectors)) - starts[sample_of]
+    padded = np.full((len(reference), samples, max(width, 1)), -1.0, dtype=np.float32)
+    padded[:, sample_of, position] = similarity
+
+    best_position = padded.argmax(axis=2)
+    best = np.take_along_axis(padded, best_position[:, :, None], axis=2)[:, :, 0]
+    index = np.minimum(starts[None, :] + best_position, max(len(vectors) - 1, 0))
+    return best, index
+
+
+def analyze_samples(samples: Sequence[Sample], threshold: float = AGREEMENT_THRESHOLD) -> Dict[str, Any]:
+    """Confronta le risposte campionate e calcola l'accordo per segmento.
+
+    La risposta di riferimento è quella con la logprob media più alta. Per
+    ogni suo segmento il risultato riporta, oltre alla confidenza:
+
+    - agreement: frazione degli altri campioni con un segmento di similarità
+      almeno pari a `threshold`
+    - similarity: similarità media del segmento migliore degli altri campioni
+    - consensus_confidence / consensus_logprob: media delle logprob medie del
+      segmento di riferimento e dei segmenti equivalenti degli altri campioni
+
+    Nella chiave 'analyses' ci sono le analisi complete della risposta di
+    riferimento a tutte le granularità.
+    """
+    tables = [tokens if isinstance(tokens, TokenTable) else TokenTable.from_tokens(tokens) for _, tokens in samples]
+    mean_logprobs = [float(table.logprobs.mean()) if len(table) else -np.inf for table in tables]
+    reference = int(np.argmax(mean_logprobs))
+
+    analyses = create_confidence_analyses(samples[reference][0], tables[reference])
+    segments = [
+        analyses['sentence']['segments'] if i == reference
+        else create_confidence_analyses(text, tables[i], ("sentence",))['sentence']['segments']
+        for i, (text, _) in enumerate(samples)
+    ]
+    counts = [len(sample_segments) for sample_segments in segments]
+    flat = [segment for sample_segments in segments for segment in sample_segments]
+
+    vectors = bag_of_words([segment['text'] for segment in flat])
+    first = sum(counts[:reference])
+    best, index = best_matches(vectors[first:first + counts[reference]], vectors, counts)
+
+    others = np.arange(len(samples)) != reference
+    matched = best >= threshold
+    matched[:, reference] = True
+    if others.any():
+        agreement = matched[:, others].mean(axis=1)
+        similarity = best[:, others].mean(axis=1)
+    else:
+        agreement = np.ones(len(best))
+        similarity = np.ones(len(best))
+
+    segment_logprobs = np.array([segment['mean_logprob'] for segment in flat], dtype=np.float64)
+    consensus_logprobs = np.where(matched, segment_logprobs[index], 0.0).sum(axis=1) / matched.sum(axis=1)
+
+    result_segments = []
+    for segment, agree, similar, consensus, matches in zip(
+            segments[reference], agreement.tolist(), similarity.tolist(), consensus_logprobs.tolist(),
+            matched[:, others].sum(axis=1).tolist()):
+        result_segments.append(dict(
+            segment,
+            agreement=agree,
+            similarity=similar,
+            matches=matches,
+            consensus_logprob=consensus,
+            consensus_confidence=float(np.exp(consensus) * 100),
+        ))
+
+    return {
+        'text': samples[reference][0],
+        'granularity': "consensus",
+        'segments': result_segments,
+        'samples': len(samples),
+        'reference': reference,
+        'sample_confidences': [float(np.exp(mean) * 100) for mean in mean_logprobs],
+        'agreement': float(agreement.mean()) if len(agreement) else 0.0,
+        'analyses': analyses,
+    }
@@ -0,0 +1,242 @@
+"""Analisi della confidenza senza interfaccia grafica.
+
+Punto di ingresso comune delle interfacce Gradio, della riga di comando
+(python -m logprob) e degli script: richieste all'API, segmentazione,
+allineamento e calcolo della confidenza. Il modulo non importa gradio né
+altre dipendenze pesanti; `requests` viene caricato solo alla prima
+richiesta (vedi logprob.transport).
+
+Con LOGPROB_WORKERS l'analisi delle risposte lunghe viene eseguita in un
+pool di processi (vedi logprob.offload).
+
+Le funzioni non sollevano eccezioni per gli errori dell'API o dei dati:
+restituiscono un dizionario {"error": messaggio} che le interfacce
+mostrano così com'è.
+"""
+from typing import Any, Dict, Iterator, Optional, Union
+
+from logprob import transport
+from logprob.alignment import WORD_PATTERN, AlignmentIndex
+from logprob.analysis import analyze_segment, segment_spans
+from logprob.api import (
+    NO_USAGE,
+    APIError,
+    build_payload,
+    error_message,
+    request_completion,
+    request_samples,
+    stream_completion,
+)
+from logprob.consensus import analyze_samples
+from logprob.decoding import decode_completion
+from logprob.metrics import StageTimer
+from logprob.offload import analyze_table
+from logprob.ratelimit import estimate_tokens
+from logprob.streaming import IncrementalSegmenter
+
+
+def test_api_connection(api_key: str) -> str:
+    """Testa la connessione all'API OpenAI."""
+    if not api_key:
+        return "❌ Inserisci una API key prima di testare"
+
+    try:
+        response = transport.request("GET", "/models", api_key)
+
+        if response.status_code == 200:
+            return "✅ Connessione riuscita! API key valida."
+        return f"❌ Errore API: {error_message(response)}"
+    except Exception as e:
+        return f"❌ Errore di connessione: {str(e)}"
+
+
+def analyze_confidence(api_key: str, model: str, prompt: str, granularity: str,
+                       use_cache: bool = True, timer: Optional[StageTimer] = None,
+                       top_logprobs: int = 1) -> Union[Dict[str, Any], Dict[str, str]]:
+    """Analizza la confidenza del testo generato dal modello.
+
+    Il risultato contiene anche, nella chiave 'analyses', le analisi a tutte
+    le granularità, calcolate nella stessa passata sui token, e in 'usage'
+    i token consumati (nessuno se la risposta era in cache o condivisa con
+    una richiesta identica in corso). Se indicato,
+    `timer` riceve i tempi di ogni fase. Con top_logprobs > 1 frasi e
+    parole riportano anche entropia, margine e massa delle alternative.
+    """
+    if not api_key:
+        return {"error": "Inserisci una API key valida"}
+
+    if not prompt:
+        return {"error": "Inserisci un prompt"}
+
+    try:
+        completion = request_completion(api_key, build_payload(model, prompt, top_logprobs=top_logprobs),
+                                        use_cache, timer)
+
+        # Usa la nuova funzione unificata per l'analisi
+        analyses = analyze_table(completion.tokens, timer=timer)
+        return dict(analyses.get(granularity, analyses['sentence']), analyses=analyses, usage=completion.consumed)
+
+    except APIError as e:
+        return {"error": str(e)}
+    except Exception as e:
+        return {"error": f"Errore: {str(e)}"}
+
+
+def analyze_consensus(api_key: str, model: str, prompt: str, samples: int, use_cache: bool = True,
+                      timer: Optional[StageTimer] = None, top_logprobs: int = 1) -> Dict[str, Any]:
+    """Chiede `samples` risposte in una sola richiesta e ne calcola l'accordo per segmento.
+
+    Il risultato (vedi logprob.consensus.analyze_samples) contiene nella
+    chiave 'analyses' le analisi della risposta di riferimento e in 'usage'
+    i token consumati dalla richiesta.
+    """
+    if not api_key:
+        return {"error": "Inserisci una API key valida"}
+
+    if not prompt:
+        return {"error": "Inserisci un prompt"}
+
+    timer = timer or StageTimer()
+    try:
+        completions = request_samples(api_key, build_payload(model, prompt, top_logprobs=top_logprobs, n=samples),
+                                      use_cache, timer)
+        with timer.stage("consensus"):
+            result = analyze_samples([(completion.text, completion.tokens) for completion in completions])
+        # usage è quello dell'intera richiesta, uguale in tutte le risposte
+        return dict(result, usage=completions[0].consumed) if "error" not in result else result
+    except APIError as e:
+        return {"error": str(e)}
+    except Exception as e:
+        return {"error": f"Errore: {str(e)}"}
+
+
+def analyze_confidence_stream(api_key: str, model: str, prompt: str, granularity: str,
+                              use_cache: bool = True, timer: Optional[StageTimer] = None,
+                              top_logprobs: int = 1) -> Iterator[Dict[str, Any]]:
+    """Analizza la confidenza in streaming, restituendo risultati parziali.
+
+    Un nuovo risultato viene prodotto ogni volta che un segmento diventa
+    definitivo (o, a livello di parola, ogni volta che si conclude una
+    parola). I primi `final_segments` segmenti di ogni risultato parziale
+    non cambiano più. L'ultimo risultato, come in analyze_confidence,
+    contiene le analisi a tutte le granularità nella chiave 'analyses' e in
+    'usage' i token consumati: quelli della risposta contati (un logprob
+    per token), quelli del prompt stimati, perché lo stream non riporta
+    l'usage dell'API; nessuno se lo stream viene dalla cache o è condiviso
+    con una richiesta identica in corso. Anche i risultati di errore
+    successivi alla richiesta riportano in 'usage' i token ricevuti fino a
+    quel momento. Il tempo di attesa dei token viene misurato come fase "network".
+    """
+    if not api_key:
+        yield {"error": "Inserisci una API key valida"}
+        return
+
+    if not prompt:
+        yield {"error": "Inserisci un prompt"}
+        return
+
+    timer = timer or StageTimer()
+    stream = None
+    index = AlignmentIndex()
+
+    def usage() -> Dict[str, int]:
+        if stream is None or stream.shared or not len(index):
+            return dict(NO_USAGE)
+        prompt_tokens = estimate_tokens(prompt, 0)
+        return {'prompt_tokens': prompt_tokens, 'completion_tokens': len(index),
+                'total_tokens': prompt_tokens + len(index)}
+
+    try:
+        payload = build_payload(model, prompt, top_logprobs=top_logprobs)
+        stream = stream_completion(api_key, payload, use_cache)
+        tokens = timer.iterate(stream, "network")
+
+        segmenter = IncrementalSegmenter(segment_spans)
+        segments = []
+        token_offset = 0
+        shown = (0, 0)
+
+        def consume(finalized):
+            nonlocal token_offset
+            for span in finalized:
+                with timer.stage("analysis"):
+                    data = analyze_segment(index, span, granularity, token_offset)
+                if data is not None:
+                    segments.append(data)
+                token_offset = max(token_offset, index.token_range(span[0], span[1])[1])
+
+        for token in tokens:
+            with timer.stage("alignment"):
+                piece = index.append(token)
+            with timer.stage("segment"):
+                finalized = segmenter.feed(piece)
+            consume(finalized)
+
+            # Segmento ancora aperto: in modalità parola si mostrano solo le
+            # parole concluse, in modalità token tutti i token già ricevuti;
+            # le parole si cercano nel solo testo non consolidato
+            pending = segmenter.pending
+            base = segmenter.base
+            open_span = segmenter.open
+            open_segment = None
+            cut = 0
+            with timer.stage("analysis"):
+                if granularity == "word" and open_span:
+                    start, end, kind = open_span
+                    for match in WORD_PATTERN.finditer(pending, start - base, end - base):
+                        if match.end() < len(pending) - 1 or (match.end() == len(pending) - 1 and pending[-1] != '-'):
+                            cut = base + match.end()
+                    if cut:
+                        open_segment = analyze_segment(index, (start, cut, kind), granularity)
+                elif granularity == "token" and open_span:
+                    open_segment = analyze_segment(index, open_span, granularity, token_offset)
+
+            if (len(segments), cut) == shown:
+                continue
+            shown = (len(segments), cut)
+
+            yield {
+                'text': None,
+                'segments': segments + ([open_segment] if open_segment else []),
+                'final_segments': len(segments),
+                'granularity': granularity,
+                'table': index.table
+            }
+
+        with timer.stage("segment"):
+            finalized = segmenter.finish()
+        consume(finalized)
+
+        if not len(index):
+            yield {"error": "Logprobs non disponibili. Potrebbe essere dovuto alle limitazioni dell'API.",
+                   "usage": usage()}
+            return
+
+        analyses = analyze_table(index.table, timer=timer)
+        yield dict(analyses.get(granularity, analyses['sentence']), analyses=analyses, usage=usage())
+
+    except APIError as e:
+        yield {"error": str(e), "usage": usage()}
+    except Exception as e:
+        yield {"error": f"Errore: {str(e)}", "usage": usage()}
+
+
+def analyze_response(body: bytes, granularity: str = "sentence",
+                     timer: Optional[StageTimer] = None) -> Dict[str, Any]:
+    """Analizza una risposta di chat completion già salvata (il JSON restituito dall'API).
+
+    Come analyze_confidence, ma senza richieste: il risultato contiene le
+    analisi a tutte le granularità nella chiave 'analyses'. Le alternative
+    top-k, se presenti, vengono lette.
+    """
+    timer = timer or StageTimer()
+    try:
+        with timer.stage("decode"):
+            decoded = decode_completion(body, top_logprobs=True)
+    except ValueError as e:
+        return {"error": str(e)}
+    if decoded.table is None:
+        return {"error": "Logprobs non disponibili nella risposta."}
+
+    analyses = analyze_table(decoded.table, timer=timer)
+    return dict(analyses.get(granularity, analyses['sentence']), analyses=analyses, usage=decoded.usage)
@@ -0,0 +1,185 @@
+"""Decodifica delle risposte dell'API direttamente nella tabella dei token.
+
+Della risposta servono solo il testo, il consumo di token e, per ogni
+token, testo e logprob; delle alternative `top_logprobs` solo le logprob, e
+solo se richieste (decode_choices(..., top_logprobs=True)). I `bytes` dei
+token servono solo quando un carattere multibyte è diviso tra più token e
+i testi dei token non lo rappresentano: in quel caso il testo viene
+ricostruito dai byte (TokenTable.from_token_bytes). Invece di costruire
+un dizionario per ogni token e per ogni alternativa, il corpo della
+risposta viene decodificato con il backend JSON più veloce disponibile:
+
+- msgspec: decodifica tipizzata in strutture che contengono solo i campi
+  usati; gli altri vengono saltati senza creare oggetti Python e `bytes`
+  resta JSON grezzo finché non serve
+- orjson: decodifica completa, ma molto più veloce di json
+- json della libreria standard, sempre disponibile
+
+La variabile d'ambiente LOGPROB_JSON_BACKEND forza un backend ("msgspec",
+"orjson" o "json"), ad esempio per confrontarli nei benchmark.
+"""
+import json
+import os
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from logprob.tokens import TokenTable, alternatives_matrix
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover - dipende dall'ambiente
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dipende dall'ambiente
+    orjson = None
+
+
+class DecodedCompletion(NamedTuple):
+    """Testo, tabella dei token (None se la risposta non ha logprobs) e usage."""
+    text: str
+    table: Optional[TokenTable]
+    usage: Dict[str, int]
+
+
+if msgspec is not None:
+    class _Token(msgspec.Struct):
+        token: str
+        logprob: float
+        bytes: msgspec.Raw = msgspec.Raw()
+
+    class _Alternative(msgspec.Struct):
+        logprob: float
+
+    class _TopToken(msgspec.Struct):
+        token: str
+        logprob: float
+        bytes: msgspec.Raw = msgspec.Raw()
+        top_logprobs: List[_Alternative] = []
+
+    def _response_decoder(token_type: type) -> Any:
+        # Stessa struttura della risposta, con o senza le alternative dei token
+        class _Logprobs(msgspec.Struct):
+            content: Optional[List[token_type]] = None
+
+        class _Message(msgspec.Struct):
+            content: Optional[str] = None
+
+        class _Choice(msgspec.Struct):
+            message: _Message
+            logprobs: Optional[_Logprobs] = None
+
+        class _Response(msgspec.Struct):
+            choices: List[_Choice]
+            usage: Optional[Dict[str, Any]] = None
+
+        return msgspec.json.Decoder(_Response)
+
+    _decoders = {False: _response_decoder(_Token), True: _response_decoder(_TopToken)}
+
+
+def _msgspec_table(content: List[Any], top: Optional[Any]) -> TokenTable:
+    # `bytes` resta JSON grezzo: viene decodificato solo se il numero di
+    # byte (le virgole, più uno) non corrisponde al testo dei token in UTF-8
+    texts = [token.token for token in content]
+    logprobs = (token.logprob for token in content)
+    raws = [token.bytes for token in content]
+    if raws and all(raws):
+        joined = b",".join(raws)
+        size = joined.count(b",") + 1 - joined.count(b"[]")
+        if size != len("".join(texts).encode('utf-8', errors='surrogatepass')):
+            byte_lists = msgspec.json.decode(b"[" + joined + b"]", type=List[Optional[List[int]]])
+            return TokenTable.from_token_bytes(texts, byte_lists, logprobs, top)
+    return TokenTable.from_texts(texts, logprobs, top)
+
+
+def _decode_msgspec(body: bytes, top_logprobs: bool = False) -> List[DecodedCompletion]:
+    try:
+        response = _decoders[top_logprobs].decode(body)
+    except msgspec.DecodeError as e:
+        raise ValueError(f"Risposta non valida: {e}") from e
+    decoded = []
+    for choice in response.choices:
+        content = choice.logprobs.content if choice.logprobs is not None else None
+        table = None
+        if content is not None:
+            top = None
+            if top_logprobs:
+                top = alternatives_matrix([len(token.top_logprobs) for token in content],
+                                          (item.logprob for token in content for item in token.top_logprobs))
+            table = _msgspec_table(content, top)
+        decoded.append(DecodedCompletion(choice.message.content or "", table, response.usage or {}))
+    return decoded
+
+
+def _msgspec_loads(data: Any) -> Any:
+    # Come json e orjson, gli errori di decodifica sono ValueError
+    try:
+        return msgspec.json.decode(data)
+    except msgspec.DecodeError as e:
+        raise ValueError(str(e)) from e
+
+
+def _decode_generic(body: bytes, top_logprobs: bool = False) -> List[DecodedCompletion]:
+    # Stessi errori del backend msgspec, anche per documenti con struttura inattesa
+    try:
+        return _decode_data(loads(body), top_logprobs)
+    except (KeyError, TypeError, AttributeError, ValueError) as e:
+        raise ValueError(f"Risposta non valida: {e!r}") from e
+
+
+def _decode_data(data: Dict[str, Any], top_logprobs: bool) -> List[DecodedCompletion]:
+    decoded = []
+    for choice in data['choices']:
+        content = (choice.get('logprobs') or {}).get('content')
+        table = None
+        if content is not None:
+            table = (TokenTable.from_tokens(content) if top_logprobs
+                     else TokenTable.from_token_bytes([token['token'] for token in content],
+                                                      [token.get('bytes') for token in content],
+                                                      (token['logprob'] for token in content)))
+        decoded.append(DecodedCompletion(choice['message'].get('content') or "", table, data.get('usage') or {}))
+    return decoded
+
+
+def _select_backend() -> str:
+    available = [name for name, module in (("msgspec", msgspec), ("orjson", orjson)) if module is not None]
+    available.append("json")
+    forced = os.environ.get("LOGPROB_JSON_BACKEND")
+    if forced:
+        if forced not in available:
+            raise ImportError(f"Backend JSON non disponibile: {forced}")
+        return forced
+    return available[0]
+
+
+BACKEND = _select_backend()
+
+
+def _select_loads() -> Callable[[Any], Any]:
+    # Per i documenti piccoli e senza schema (eventi SSE) orjson è il più veloce
+    if BACKEND != "json" and orjson is not None:
+        return orjson.loads
+    if BACKEND == "msgspec":
+        return _msgspec_loads
+    return json.loads
+
+
+loads = _select_loads()
+
+
+def decode_choices(body: bytes, top_logprobs: bool = False) -> List[DecodedCompletion]:
+    """Decodifica tutte le scelte (richieste con n > 1) di una risposta di chat completion.
+
+    Le scelte sono nell'ordine della risposta; usage è quello complessivo
+    della richiesta. Con `top_logprobs` le tabelle dei token contengono
+    anche la matrice delle logprob delle alternative.
+    """
+    if BACKEND == "msgspec":
+        return _decode_msgspec(body, top_logprobs)
+    return _decode_generic(body, top_logprobs)
+
+
+def decode_completion(body: bytes, top_logprobs: bool = False) -> DecodedCompletion:
+    """Decodifica il corpo di una risposta di chat completion (prima scelta)."""
+    return decode_choices(body, top_logprobs)[0]
@@ -0,0 +1,272 @@
+"""Esportazione colonnare delle analisi in Arrow/Parquet e rilettura memory-mapped.
+
+Ogni analisi (un "run") viene salvata come due file in una directory di
+archivio:
+
+    <directory>/tokens/<run_id>.arrow     un record per token
+    <directory>/segments/<run_id>.arrow   un record per segmento (frase)
+
+con estensione .parquet se si sceglie il formato Parquet. Ogni record
+riporta i metadati del run (run_id, modello, hash SHA-256 del prompt,
+timestamp UTC), codificati a dizionario così da costare pochi byte per
+riga; gli stessi metadati sono anche nei metadati dello schema del file.
+
+Il formato Arrow IPC non compresso può essere mappato in memoria senza
+copie: open_dataset() legge tutti i run come un unico dataset pyarrow, e
+filtri e aggregazioni (ad esempio run_summary) lavorano sulle colonne senza
+creare oggetti Python per token, anche con milioni di token e migliaia di
+run. Parquet occupa meno spazio ma va decompresso in lettura.
+
+Richiede pyarrow (`pip install pyarrow`), che resta una dipendenza
+facoltativa: il modulo si importa anche senza, e le funzioni sollevano
+ImportError solo quando vengono usate.
+
+Esempio:
+
+    export_analysis("archivio", result, model="gpt-4o", prompt=prompt)
+    tokens = read_table("archivio", "tokens", filter=pc.field("model") == "gpt-4o")
+"""
+import datetime
+import glob
+import os
+import tempfile
+import uuid
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from logprob.analysis import create_confidence_analyses
+from logprob.cache import prompt_hash
+from logprob.uncertainty import UNCERTAINTY_FIELDS
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.fs
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - dipende dall'ambiente
+    pa = None
+
+KINDS = ("tokens", "segments")
+FORMATS = {'arrow': ".arrow", 'parquet': ".parquet"}
+
+# Prefisso delle chiavi dei metadati dello schema
+METADATA_PREFIX = "logprob."
+
+
+def _require_pyarrow() -> None:
+    if pa is None:
+        raise ImportError("L'esportazione Arrow/Parquet richiede pyarrow: pip install pyarrow")
+
+
+def run_metadata(model: str, prompt: str, run_id: Optional[str] = None,
+                 timestamp: Optional[datetime.datetime] = None) -> Dict[str, Any]:
+    """Metadati di un run: run_id (generato se manca), modello, hash del prompt e timestamp UTC."""
+    return {
+        'run_id': run_id or uuid.uuid4().hex,
+        'model': model,
+        'prompt_hash': prompt_hash(prompt),
+        'timestamp': (timestamp or datetime.datetime.now(datetime.timezone.utc)).astimezone(datetime.timezone.utc),
+    }
+
+
+def _metadata_columns(run: Dict[str, Any], rows: int) -> Dict[str, "pa.Array"]:
+    # Un solo valore per colonna, ripetuto con indici a zero: nessuna stringa per riga
+    indices = pa.array(np.zeros(rows, dtype=np.int32))
+    columns = {
+        name: pa.DictionaryArray.from_arrays(indices, pa.array([run[name]], type=pa.string()))
+        for name in ('run_id', 'model', 'prompt_hash')
+    }
+    columns['timestamp'] = pa.array(np.full(rows, int(run['timestamp'].timestamp() * 1_000_000), dtype=np.int64),
+                                    type=pa.timestamp('us', tz="UTC"))
+    return columns
+
+
+def _schema_metadata(run: Dict[str, Any], kind: str) -> Dict[str, str]:
+    return {
+        METADATA_PREFIX + 'kind': kind,
+        METADATA_PREFIX + 'run_id': run['run_id'],
+        METADATA_PREFIX + 'model': run['model'],
+        METADATA_PREFIX + 'prompt_hash': run['prompt_hash'],
+        METADATA_PREFIX + 'timestamp': run['timestamp'].isoformat(),
+    }
+
+
+def _float_column(values: np.ndarray) -> "pa.Array":
+    # I NaN (misure non disponibili) diventano null
+    values = np.asarray(values, dtype=np.float64)
+    return pa.array(values, mask=np.isnan(values))
+
+
+def token_table(result: Dict[str, Any], run: Dict[str, Any]) -> "pa.Table":
+    """Tabella Arrow con un record per token dell'analisi.
+
+    Colonne: metadati del run, position, token, logprob, confidence e, se la
+    risposta contiene le alternative top-k, entropy, margin e mass (null
+    altrimenti). Il testo dei token viene copiato in blocco nel buffer
+    della colonna, senza creare una stringa Python per token.
+    """
+    _require_pyarrow()
+    table = result['table']
+    rows = len(table)
+    data, offsets = table.utf8()
+    columns = _metadata_columns(run, rows)
+    columns['position'] = pa.array(np.arange(rows, dtype=np.int32))
+    columns['token'] = pa.StringArray.from_buffers(rows, pa.py_buffer(offsets), pa.py_buffer(data))
+    columns['logprob'] = pa.array(table.logprobs)
+    columns['confidence'] = pa.array(table.confidences)
+    uncertainty = table.uncertainty
+    for i, name in enumerate(UNCERTAINTY_FIELDS):
+        columns[name] = _float_column(uncertainty[:, i] if uncertainty is not None else np.full(rows, np.nan))
+    return pa.table(columns).replace_schema_metadata(_schema_metadata(run, "tokens"))
+
+
+def segment_table(result: Dict[str, Any], run: Dict[str, Any]) -> "pa.Table":
+    """Tabella Arrow con un record per segmento (frase, titolo o elemento di elenco).
+
+    Se il risultato non è a livello di frase, i segmenti vengono ricalcolati
+    dalla tabella dei token. Colonne: metadati del run, segment, kind, text,
+    confidence, min_confidence, mean_logprob, entropy, margin, mass.
+    """
+    _require_pyarrow()
+    if result.get('granularity') == "sentence":
+        segments = result['segments']
+    else:
+        segments = create_confidence_analyses(result['text'], result['table'], ("sentence",))['sentence']['segments']
+
+    rows = len(segments)
+    columns = _metadata_columns(run, rows)
+    columns['segment'] = pa.array(np.arange(rows, dtype=np.int32))
+    columns['kind'] = pa.array([segment['kind'] for segment in segments], type=pa.string()).dictionary_encode()
+    columns['text'] = pa.array([segment['text'] for segment in segments], type=pa.string())
+    for name in ('confidence', 'min_confidence', 'mean_logprob') + UNCERTAINTY_FIELDS:
+        columns[name] = _float_column(
+            np.fromiter((segment.get(name, np.nan) for segment in segments), dtype=np.float64, count=rows))
+    return pa.table(columns).replace_schema_metadata(_schema_metadata(run, "segments"))
+
+
+def write_table(table: "pa.Table", path: str) -> None:
+    """Scrive la tabella in Arrow IPC o Parquet (secondo l'estensione) in modo atomico.
+
+    Il file viene scritto accanto alla destinazione e poi rinominato, così
+    chi legge l'archivio non vede mai file incompleti.
+    """
+    _require_pyarrow()
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    os.close(fd)
+    try:
+        if path.endswith(FORMATS['parquet']):
+            pq.write_table(table, temp_path)
+        else:
+            with pa.OSFile(temp_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def export_analysis(directory: str, result: Dict[str, Any], model: str, prompt: str,
+                    format: str = "arrow", run_id: Optional[str] = None,
+                    timestamp: Optional[datetime.datetime] = None) -> Dict[str, str]:
+    """Salva token e segmenti di un'analisi nell'archivio.
+
+    `result` è il risultato di create_confidence_analysis (o una delle
+    analisi di create_confidence_analyses), con la tabella dei token.
+    Restituisce {'run_id', 'tokens', 'segments'} con l'identificativo del
+    run e i percorsi dei due file.
+    """
+    _require_pyarrow()
+    if format not in FORMATS:
+        raise ValueError(f"Formato non supportato: {format} (attesi: {', '.join(FORMATS)})")
+    run = run_metadata(model, prompt, run_id, timestamp)
+    paths = {'run_id': run['run_id']}
+    for kind, table in (("tokens", token_table(result, run)), ("segments", segment_table(result, run))):
+        path = os.path.join(directory, kind, run['run_id'] + FORMATS[format])
+        write_table(table, path)
+        paths[kind] = path
+    return paths
+
+
+def open_dataset(directory: str, kind: str = "tokens") -> "ds.Dataset":
+    """Dataset pyarrow di tutti i run dell'archivio per il tipo indicato ("tokens" o "segments").
+
+    I file vengono aperti con memory mapping: leggere colonne o applicare
+    filtri non copia in memoria i dati dei file Arrow. File Arrow e Parquet
+    possono convivere nella stessa directory.
+    """
+    _require_pyarrow()
+    if kind not in KINDS:
+        raise ValueError(f"Tipo non supportato: {kind} (attesi: {', '.join(KINDS)})")
+    filesystem = pyarrow.fs.LocalFileSystem(use_mmap=True)
+    children = []
+    for format, extension in FORMATS.items():
+        paths = sorted(glob.glob(os.path.join(os.path.abspath(directory), kind, "*" + extension)))
+        if paths:
+            children.append(ds.dataset(paths, format="ipc" if format == "arrow" else format, filesystem=filesystem))
+    if not children:
+        raise FileNotFoundError(f"Nessun file {kind} in {directory}")
+    return children[0] if len(children) == 1 else ds.dataset(children)
+
+
+def read_table(directory: str, kind: str = "tokens", columns: Optional[Sequence[str]] = None,
+               filter: Optional["pc.Expression"] = None) -> "pa.Table":
+    """Legge dall'archivio le colonne e le righe richieste come tabella Arrow."""
+    return open_dataset(directory, kind).to_table(columns=list(columns) if columns else None, filter=filter)
+
+
+def read_run(path: str) -> "pa.Table":
+    """Legge un singolo file dell'archivio; i file Arrow vengono mappati in memoria senza copie."""
+    _require_pyarrow()
+    if path.endswith(FORMATS['parquet']):
+        return pq.read_table(path, memory_map=True)
+    with pa.memory_map(path, 'r') as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def file_metadata(path: str) -> Dict[str, str]:
+    """Metadati del run salvati nello schema di un file dell'archivio."""
+    _require_pyarrow()
+    if path.endswith(FORMATS['parquet']):
+        schema = pq.read_schema(path)
+    else:
+        with pa.memory_map(path, 'r') as source:
+            schema = pa.ipc.open_file(source).schema
+    metadata = schema.metadata or {}
+    return {
+        key.decode('utf-8')[len(METADATA_PREFIX):]: value.decode('utf-8')
+        for key, value in metadata.items()
+        if key.decode('utf-8').startswith(METADATA_PREFIX)
+    }
+
+
+def run_summary(directory: str, filter: Optional["pc.Expression"] = None) -> "pa.Table":
+    """Statistiche per run calcolate sulle colonne dei token.
+
+    Per ogni run: modello, hash del prompt, timestamp, numero di token,
+    confidenza media e minima, logprob media ed entropia media (null senza
+    alternative). L'aggregazione avviene in pyarrow, senza oggetti Python
+    per token.
+    """
+    columns = ['run_id', 'model', 'prompt_hash', 'timestamp', 'confidence', 'logprob', 'entropy']
+    table = read_table(directory, "tokens", columns, filter)
+    # Le chiavi codificate a dizionario vengono decodificate per il raggruppamento
+    table = table.set_column(0, 'run_id', pc.cast(table['run_id'], pa.string()))
+    table = table.set_column(1, 'model', pc.cast(table['model'], pa.string()))
+    table = table.set_column(2, 'prompt_hash', pc.cast(table['prompt_hash'], pa.string()))
+    summary = table.group_by(['run_id', 'model', 'prompt_hash', 'timestamp']).aggregate([
+        ('confidence', 'count'),
+        ('confidence', 'mean'),
+        ('confidence', 'min'),
+        ('logprob', 'mean'),
+        ('entropy', 'mean'),
+    ])
+    names: List[str] = [
+        {'confidence_count': 'tokens', 'confidence_mean': 'mean_confidence', 'confidence_min': 'min_confidence',
+         'logprob_mean': 'mean_logprob', 'entropy_mean': 'mean_entropy'}.get(name, name)
+        for name in summary.column_names
+    ]
+    return summary.rename_columns(names).sort_by('timestamp')
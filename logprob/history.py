@@ -0,0 +1,305 @@
+"""Storico persistente delle analisi in SQLite.
+
+Ogni analisi completata (un "run") viene salvata in tre tabelle:
+
+- runs: proprietario (hash SHA-256 della API key usata), modello, prompt
+  e suo hash SHA-256, testo della risposta, numero di token, confidenza
+  complessiva e istante (secondi Unix, UTC)
+- segments: un record per segmento a livello di frase (titolo, elemento
+  di elenco o frase) con confidenza media e minima, logprob media ed
+  eventuali entropia, margine e massa delle alternative
+- tokens: le colonne della TokenTable del run (offset, logprob ed
+  eventuale matrice delle alternative) come BLOB, un record per run, così
+  l'analisi si ricostruisce a tutte le granularità senza nuove richieste
+
+Ogni run appartiene alla API key che l'ha eseguito: tutte le
+interrogazioni e load_run richiedono il proprietario e vedono solo i suoi
+run, così chi usa l'interfaccia (anche condivisa con share=True) non può
+leggere prompt e risposte degli altri utenti. I run salvati prima
+dell'introduzione del proprietario non sono visibili a nessuno.
+
+Proprietario, modello, hash del prompt e istante sono ripetuti nei
+segmenti e gli indici (proprietario, modello, confidenza), (proprietario,
+hash del prompt, confidenza) e (proprietario, confidenza) permettono di
+rispondere a domande come "tutte le mie frasi sotto il 50% per gpt-4o
+nell'ultima settimana" leggendo solo i segmenti interessati, senza join e
+senza scorrere la tabella. Le pagine si ottengono con paginazione
+a chiave (keyset): la pagina successiva parte dall'ultimo record della
+precedente, quindi il costo non cresce con il numero di pagine.
+
+Il database usa il journal WAL: più processi (ad esempio più worker
+Gradio) possono scrivere e leggere contemporaneamente.
+
+Configurazione tramite variabili d'ambiente:
+
+- LOGPROB_HISTORY: "0" per disattivare lo storico
+- LOGPROB_HISTORY_PATH: file del database (default ~/.cache/logprob/history.sqlite3)
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from logprob.analysis import create_confidence_analyses
+from logprob.cache import api_key_hash, prompt_hash
+from logprob.tokens import TokenTable
+from logprob.uncertainty import UNCERTAINTY_FIELDS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    owner TEXT,
+    created REAL NOT NULL,
+    model TEXT NOT NULL,
+    prompt_hash TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    text TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    confidence REAL
+);
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    text TEXT NOT NULL,
+    confidence REAL NOT NULL,
+    min_confidence REAL NOT NULL,
+    mean_logprob REAL NOT NULL,
+    entropy REAL,
+    margin REAL,
+    mass REAL,
+    model TEXT NOT NULL,
+    prompt_hash TEXT NOT NULL,
+    created REAL NOT NULL,
+    owner TEXT
+);
+
+CREATE TABLE IF NOT EXISTS tokens (
+    run_id INTEGER PRIMARY KEY REFERENCES runs (id) ON DELETE CASCADE,
+    offsets BLOB NOT NULL,
+    logprobs BLOB NOT NULL,
+    top_k INTEGER,
+    top_logprobs BLOB
+);
+"""
+
+# Indici, creati dopo l'eventuale aggiunta della colonna owner ai database esistenti
+INDEXES = """
+DROP INDEX IF EXISTS runs_model;
+DROP INDEX IF EXISTS runs_prompt_hash;
+DROP INDEX IF EXISTS segments_model_confidence;
+DROP INDEX IF EXISTS segments_prompt_confidence;
+DROP INDEX IF EXISTS segments_confidence;
+CREATE INDEX IF NOT EXISTS runs_owner ON runs (owner, id);
+CREATE INDEX IF NOT EXISTS runs_owner_model ON runs (owner, model, id);
+CREATE INDEX IF NOT EXISTS runs_owner_prompt_hash ON runs (owner, prompt_hash, id);
+CREATE INDEX IF NOT EXISTS segments_run ON segments (run_id, position);
+CREATE INDEX IF NOT EXISTS segments_owner_model_confidence ON segments (owner, model, confidence);
+CREATE INDEX IF NOT EXISTS segments_owner_prompt_confidence ON segments (owner, prompt_hash, confidence);
+CREATE INDEX IF NOT EXISTS segments_owner_confidence ON segments (owner, confidence);
+"""
+
+# Colonne dei segmenti restituite dalle interrogazioni
+SEGMENT_COLUMNS = ("id", "run_id", "position", "kind", "text", "confidence", "min_confidence",
+                   "mean_logprob") + UNCERTAINTY_FIELDS + ("model", "prompt_hash", "created")
+
+# Colonne dei run restituite da runs() (il testo completo solo con load_run)
+RUN_COLUMNS = ("id", "created", "model", "prompt_hash", "prompt", "tokens", "confidence")
+
+
+def _nullable(value: Optional[float]) -> Optional[float]:
+    # NaN (segmenti senza alternative) diventa NULL
+    return None if value is None or math.isnan(value) else value
+
+
+class HistoryStore:
+    """Storico delle analisi in un database SQLite (vedi la documentazione del modulo).
+
+    Una sola connessione, protetta da un lock, viene condivisa dai thread
+    del processo.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute("PRAGMA foreign_keys=ON")
+            self._connection.executescript(SCHEMA)
+            for table in ("runs", "segments"):
+                columns = [row[1] for row in self._connection.execute(f"PRAGMA table_info({table})")]
+                if "owner" not in columns:
+                    self._connection.execute(f"ALTER TABLE {table} ADD COLUMN owner TEXT")
+            self._connection.executescript(INDEXES)
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def record(self, result: Dict[str, Any], model: str, prompt: str, owner: str,
+               created: Optional[float] = None) -> int:
+        """Salva un'analisi di `owner` (hash della API key, vedi logprob.cache.api_key_hash) e ne restituisce l'id.
+
+        `result` è il risultato di logprob.core.analyze_confidence (o di una
+        delle altre analisi con la chiave 'analyses'). I segmenti salvati
+        sono quelli a livello di frase, ricalcolati dalla tabella dei token
+        se il risultato non li contiene.
+        """
+        analyses = result.get('analyses') or {result['granularity']: result}
+        if 'sentence' in analyses:
+            sentence = analyses['sentence']
+        else:
+            analysis = next(iter(analyses.values()))
+            sentence = create_confidence_analyses(analysis['text'], analysis['table'], ("sentence",))['sentence']
+        table: TokenTable = sentence['table']
+        created = time.time() if created is None else created
+        digest = prompt_hash(prompt)
+        confidence = float(np.exp(table.logprobs.mean()) * 100) if len(table) else None
+
+        segments = [
+            (i, segment['kind'], segment['text'], segment['confidence'], segment['min_confidence'],
+             segment['mean_logprob'], *(_nullable(segment.get(name)) for name in UNCERTAINTY_FIELDS),
+             model, digest, created, owner)
+            for i, segment in enumerate(sentence['segments'])
+        ]
+        top = table.top_logprobs
+
+        with self._lock, self._connection:
+            run_id = self._connection.execute(
+                "INSERT INTO runs (owner, created, model, prompt_hash, prompt, text, tokens, confidence)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (owner, created, model, digest, prompt, table.text, len(table), confidence)
+            ).lastrowid
+            self._connection.executemany(
+                "INSERT INTO segments (run_id, position, kind, text, confidence, min_confidence, mean_logprob,"
+                " entropy, margin, mass, model, prompt_hash, created, owner)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(run_id, *segment) for segment in segments]
+            )
+            self._connection.execute(
+                "INSERT INTO tokens (run_id, offsets, logprobs, top_k, top_logprobs) VALUES (?, ?, ?, ?, ?)",
+                (run_id, table.offsets.tobytes(), table.logprobs.tobytes(),
+                 top.shape[1] if top is not None else None,
+                 np.ascontiguousarray(top).tobytes() if top is not None else None)
+            )
+        return run_id
+
+    def _select(self, sql: str, parameters: List[Any], columns: Tuple[str, ...]) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._connection.execute(sql, parameters).fetchall()
+        return [dict(zip(columns, row)) for row in rows]
+
+    def runs(self, owner: str, model: Optional[str] = None, prompt: Optional[str] = None,
+             before: Optional[int] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """Run più recenti di `owner`, dal più nuovo, eventualmente di un solo modello o prompt.
+
+        Per la pagina successiva si passa come `before` l'id dell'ultimo run
+        della pagina precedente.
+        """
+        where, parameters = ["owner = ?"], [owner]
+        if model:
+            where.append("model = ?")
+            parameters.append(model)
+        if prompt is not None:
+            where.append("prompt_hash = ?")
+            parameters.append(prompt_hash(prompt))
+        if before is not None:
+            where.append("id < ?")
+            parameters.append(before)
+        sql = f"SELECT {', '.join(RUN_COLUMNS)} FROM runs WHERE {' AND '.join(where)} ORDER BY id DESC LIMIT ?"
+        return self._select(sql, parameters + [limit], RUN_COLUMNS)
+
+    def low_confidence_segments(self, owner: str, threshold: float = 50.0, model: Optional[str] = None,
+                                prompt: Optional[str] = None, since: Optional[float] = None,
+                                after: Optional[Tuple[float, int]] = None,
+                                limit: int = 50) -> List[Dict[str, Any]]:
+        """Segmenti dei run di `owner` con confidenza sotto `threshold` (percentuale), dal meno sicuro.
+
+        I filtri facoltativi sono il modello, il prompt e l'istante minimo
+        (`since`, secondi Unix). Per la pagina successiva si passa come
+        `after` la coppia (confidence, id) dell'ultimo segmento della
+        pagina precedente.
+        """
+        where, parameters = ["owner = ?", "confidence < ?"], [owner, threshold]
+        if model:
+            where.append("model = ?")
+            parameters.append(model)
+        if prompt is not None:
+            where.append("prompt_hash = ?")
+            parameters.append(prompt_hash(prompt))
+        if since is not None:
+            where.append("created >= ?")
+            parameters.append(since)
+        if after is not None:
+            where.append("(confidence, id) > (?, ?)")
+            parameters.extend(after)
+        sql = (f"SELECT {', '.join(SEGMENT_COLUMNS)} FROM segments WHERE {' AND '.join(where)}"
+               " ORDER BY confidence, id LIMIT ?")
+        return self._select(sql, parameters + [limit], SEGMENT_COLUMNS)
+
+    def load_run(self, run_id: int, owner: str) -> Optional[Dict[str, Any]]:
+        """Run salvato con le analisi a tutte le granularità ('analyses'), o None se non esiste o non è di `owner`.
+
+        Le analisi vengono ricalcolate dalla tabella dei token salvata.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                f"SELECT {', '.join(RUN_COLUMNS)}, runs.text, offsets, logprobs, top_k, top_logprobs"
+                " FROM runs JOIN tokens ON tokens.run_id = runs.id WHERE runs.id = ? AND runs.owner = ?",
+                (run_id, owner)
+            ).fetchone()
+        if row is None:
+            return None
+        run = dict(zip(RUN_COLUMNS, row))
+        text, offsets, logprobs, top_k, top = row[len(RUN_COLUMNS):]
+        if top is not None:
+            top = np.frombuffer(top, dtype=np.float64).reshape(-1, top_k)
+        table = TokenTable.from_arrays(text, np.frombuffer(offsets, dtype=np.int32),
+                                       np.frombuffer(logprobs, dtype=np.float64), top)
+        run['analyses'] = create_confidence_analyses(text, table)
+        return run
+
+    def delete_run(self, run_id: int, owner: str) -> None:
+        """Elimina un run di `owner` con i suoi segmenti e token."""
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM runs WHERE id = ? AND owner = ?", (run_id, owner))
+
+
+_default_history: Optional[HistoryStore] = None
+_default_lock = threading.Lock()
+
+
+def get_history() -> Optional[HistoryStore]:
+    """Restituisce lo storico condiviso, o None se disattivato da LOGPROB_HISTORY=0."""
+    global _default_history
+    if os.environ.get("LOGPROB_HISTORY", "1") == "0":
+        return None
+    with _default_lock:
+        if _default_history is None:
+            _default_history = HistoryStore(
+                os.environ.get("LOGPROB_HISTORY_PATH")
+                or os.path.join(os.path.expanduser("~"), ".cache", "logprob", "history.sqlite3")
+            )
+        return _default_history
+
+
+def record_analysis(result: Dict[str, Any], model: str, prompt: str, api_key: str) -> Optional[int]:
+    """Salva l'analisi nello storico condiviso, se attivo, come run della API key; restituisce l'id del run.
+
+    Gli errori del database (disco pieno, file non scrivibile...) non
+    interrompono l'analisi: il run semplicemente non viene salvato.
+    """
+    try:
+        history = get_history()
+        return history.record(result, model, prompt, api_key_hash(api_key)) if history is not None else None
+    except (sqlite3.Error, OSError):
+        return None
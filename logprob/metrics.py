@@ -0,0 +1,291 @@
+"""Contatori, istogrammi di latenza e tempi per fase delle analisi.
+
+Le metriche vengono esposte in formato testo Prometheus su `/metrics` da un
+piccolo server HTTP separato, avviato accanto all'app Gradio se è impostata
+la variabile d'ambiente LOGPROB_METRICS_PORT (LOGPROB_METRICS_HOST, default
+127.0.0.1, sceglie l'interfaccia). Non servono dipendenze esterne.
+
+Ogni analisi usa uno StageTimer che accumula il tempo di ogni fase (rete,
+decodifica del JSON, allineamento, segmentazione, analisi, rendering): a
+fine richiesta i totali vanno negli istogrammi e possono essere mostrati
+nell'interfaccia.
+
+Esempio:
+
+    timer = StageTimer()
+    with timer.stage("network"):
+        response = transport.request(...)
+    timer.finish("full")
+"""
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+if TYPE_CHECKING:  # pragma: no cover
+    from http.server import ThreadingHTTPServer
+
+T = TypeVar("T")
+
+# Limiti superiori dei bucket degli istogrammi, in secondi
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """Metrica con nome, descrizione ed etichette."""
+    kind = ""
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name}: etichette attese {self.labels}, ricevute {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """Contatore monotono."""
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        super().__init__(name, description, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(Metric):
+    """Istogramma cumulativo con bucket fissi."""
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per etichette: conteggi per bucket (l'ultimo è +Inf) e somma
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+                self._sums[key] = 0.0
+            counts[position] += 1
+            self._sums[key] += value
+
+    def count(self, **labels: Any) -> int:
+        return sum(self._counts.get(self._key(labels), ()))
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            items = sorted((key, list(counts), self._sums[key]) for key, counts in self._counts.items())
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(self.labels + ("le",), key + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Insieme delle metriche esposte su /metrics."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metrica già registrata: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Tutte le metriche nel formato testo di Prometheus."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+TOKENS_PROCESSED = REGISTRY.register(Counter(
+    "logprob_tokens_processed_total", "Token analizzati"))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "logprob_cache_lookups_total", "Ricerche nella cache delle risposte", ("result",)))
+API_RETRIES = REGISTRY.register(Counter(
+    "logprob_api_retries_total", "Richieste all'API ritentate, per causa", ("reason",)))
+API_ERRORS = REGISTRY.register(Counter(
+    "logprob_api_errors_total", "Errori restituiti dall'API, per stato HTTP", ("status",)))
+COALESCED_REQUESTS = REGISTRY.register(Counter(
+    "logprob_coalesced_requests_total",
+    "Richieste all'API eseguite (leader) o unite a una identica in corso (merged)", ("mode", "role")))
+REJECTED_REQUESTS = REGISTRY.register(Counter(
+    "logprob_rejected_requests_total", "Analisi rifiutate prima di chiamare l'API, per causa", ("reason",)))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "logprob_stage_seconds", "Tempo per fase di un'analisi", ("stage",)))
+ANALYSIS_SECONDS = REGISTRY.register(Histogram(
+    "logprob_analysis_seconds", "Durata complessiva di un'analisi", ("mode",)))
+
+
+class StageTimer:
+    """Tempi per fase di una singola analisi.
+
+    La stessa fase può essere misurata più volte (ad esempio a ogni token
+    durante lo streaming): i tempi vengono sommati. Gli istogrammi ricevono
+    i totali una sola volta, con finish().
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.started = time.perf_counter()
+        self.elapsed: Optional[float] = None
+
+    def add(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Misura il blocco come parte della fase `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def iterate(self, iterable: Iterable[T], name: str) -> Iterator[T]:
+        """Restituisce gli elementi di `iterable` misurando l'attesa di ognuno come fase `name`."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(name, time.perf_counter() - start)
+                return
+            self.add(name, time.perf_counter() - start)
+            yield item
+
+    @property
+    def total(self) -> float:
+        """Durata dall'inizio dell'analisi (fino a finish(), se già chiamato)."""
+        return self.elapsed if self.elapsed is not None else time.perf_counter() - self.started
+
+    def breakdown(self) -> List[Tuple[str, float, float]]:
+        """Fasi in ordine di misura come (nome, secondi, percentuale del totale)."""
+        total = self.total or 1.0
+        return [(name, seconds, seconds / total * 100) for name, seconds in self.stages.items()]
+
+    def finish(self, mode: str) -> None:
+        """Chiude la misura e registra i totali negli istogrammi."""
+        if self.elapsed is not None:
+            return
+        self.elapsed = time.perf_counter() - self.started
+        for name, seconds in self.stages.items():
+            STAGE_SECONDS.observe(seconds, stage=name)
+        ANALYSIS_SECONDS.observe(self.elapsed, mode=mode)
+
+
+def _metrics_handler() -> type:
+    # http.server viene importato solo se il server delle metriche viene avviato
+    from http.server import BaseHTTPRequestHandler
+
+    class _MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+        def do_GET(self) -> None:
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = REGISTRY.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return _MetricsHandler
+
+
+_server: Optional["ThreadingHTTPServer"] = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: Optional[int] = None, host: Optional[str] = None) -> Optional["ThreadingHTTPServer"]:
+    """Avvia in background il server di /metrics.
+
+    Senza `port` viene usata LOGPROB_METRICS_PORT; se non è impostata il
+    server non viene avviato e si restituisce None. Chiamate successive
+    restituiscono il server già avviato.
+    """
+    global _server
+    if port is None:
+        value = os.environ.get("LOGPROB_METRICS_PORT")
+        if not value:
+            return None
+        port = int(value)
+    host = host or os.environ.get("LOGPROB_METRICS_HOST") or "127.0.0.1"
+
+    with _server_lock:
+        if _server is None:
+            from http.server import ThreadingHTTPServer
+
+            server = ThreadingHTTPServer((host, port), _metrics_handler())
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name="logprob-metrics", daemon=True).start()
+            _server = server
+        return _server
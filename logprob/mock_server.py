@@ -0,0 +1,389 @@
+"""Server locale che imita l'API OpenAI per test di carico e di latenza.
+
+Implementa `GET /v1/models` e `POST /v1/chat/completions`, sia normale
+sia in streaming SSE, con logprobs e top_logprobs generati da
+logprob.synthetic. Le richieste normali con n > 1 ricevono n scelte che
+condividono un prefisso e poi divergono, come campioni indipendenti
+dello stesso modello; in streaming viene generata una sola scelta. La
+risposta dipende solo dal contenuto della richiesta (modello, messaggi,
+numero di token e top_logprobs), quindi lo stesso prompt produce sempre
+lo stesso testo con lo stesso modello. Latenza, velocità di generazione,
+errori 429/5xx e dimensione delle risposte sono configurabili, così si
+può misurare il throughput dell'app Gradio e del batch senza rete né
+costi.
+
+Esempio:
+
+    python -m logprob.mock_server --port 8001 --latency 0.3 --tokens-per-second 80 --error-rate-429 0.05
+    LOGPROB_API_BASE=http://127.0.0.1:8001/v1 python gradio2.py
+
+Da codice (test e benchmark):
+
+    server = start_server(MockSettings(latency=0))
+    transport.configure(api_base=server.url)
+    ...
+    server.stop()
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from logprob.synthetic import generate_tokens
+
+MODELS = (
+    "gpt-4o-2024-08-06",
+    "gpt-4o-mini-2024-07-18",
+    "gpt-4-turbo-2024-04-09",
+    "gpt-3.5-turbo-0125",
+)
+
+SERVER_ERRORS = (500, 502, 503)
+
+
+@dataclass
+class MockSettings:
+    """Comportamento del server di prova."""
+    # Secondi prima del primo byte della risposta, più un ritardo casuale fino a latency_jitter
+    latency: float = 0.2
+    latency_jitter: float = 0.0
+    # Velocità di generazione; 0 = senza limite
+    tokens_per_second: float = 0.0
+    # Token di risposta quando la richiesta non indica max_tokens
+    # (scelti in modo deterministico dal prompt nell'intervallo)
+    min_tokens: int = 200
+    max_tokens: int = 800
+    # Frazione di richieste che falliscono con 429 (con Retry-After) o con un errore 5xx
+    error_rate_429: float = 0.0
+    error_rate_5xx: float = 0.0
+    retry_after: float = 1.0
+    # Token per evento SSE
+    chunk_tokens: int = 1
+    seed: int = 0
+
+
+@lru_cache(maxsize=64)
+def _cached_tokens(n_tokens: int, seed: int, top_logprobs: int) -> Tuple[Dict[str, Any], ...]:
+    # Generare risposte grandi costa più che servirle: le ultime vengono riusate
+    return tuple(generate_tokens(n_tokens, seed, top_logprobs))
+
+
+class MockServer(ThreadingHTTPServer):
+    """Server HTTP con le impostazioni e i conteggi delle richieste."""
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], settings: MockSettings):
+        super().__init__(address, MockHandler)
+        self.settings = settings
+        self.counts: Dict[str, int] = {}
+        self._random = random.Random(settings.seed)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """URL base da usare come LOGPROB_API_BASE."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def roll(self) -> float:
+        """Numero casuale condiviso tra i thread per l'iniezione degli errori."""
+        with self._lock:
+            return self._random.random()
+
+    def start(self) -> "MockServer":
+        """Avvia il server in un thread in background."""
+        self._thread = threading.Thread(target=self.serve_forever, name="logprob-mock-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Ferma il server e chiude il socket."""
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def start_server(settings: Optional[MockSettings] = None, host: str = "127.0.0.1", port: int = 0) -> MockServer:
+    """Avvia un server di prova in background (porta 0 = porta libera qualsiasi)."""
+    return MockServer((host, port), settings or MockSettings()).start()
+
+
+def sample_tokens(n_tokens: int, seed: int, top_logprobs: int, sample: int) -> List[Dict[str, Any]]:
+    """Token della scelta `sample`: uguali alla prima fino a un punto, poi diversi."""
+    base = _cached_tokens(n_tokens, seed, top_logprobs)
+    if not sample:
+        return list(base)
+    other = _cached_tokens(n_tokens, seed + sample, top_logprobs)
+    cut = (seed * 31 + sample * 7919) % (n_tokens + 1)
+    return list(base[:cut] + other[cut:])
+
+
+def response_tokens(payload: Dict[str, Any], settings: MockSettings) -> Tuple[int, int]:
+    """Numero di token e seed della risposta a una richiesta."""
+    request = json.dumps([payload.get('model'), payload.get('messages', [])], sort_keys=True).encode('utf-8')
+    seed = settings.seed + zlib.crc32(request)
+    limit = payload.get('max_completion_tokens') or payload.get('max_tokens')
+    if limit:
+        return int(limit), seed
+    low, high = settings.min_tokens, max(settings.min_tokens, settings.max_tokens)
+    return low + seed % (high - low + 1), seed
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """Gestisce le richieste con il formato di risposta dell'API OpenAI."""
+    protocol_version = "HTTP/1.1"
+    server: MockServer
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _send_json(self, status: int, data: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count(str(status))
+
+    def _send_error(self, status: int, message: str, error_type: str,
+                    headers: Optional[Dict[str, str]] = None) -> None:
+        self._send_json(status, {'error': {'message': message, 'type': error_type, 'code': None}}, headers)
+
+    def _authorized(self) -> bool:
+        # Qualsiasi chiave è valida, ma deve esserci come per l'API vera
+        if self.headers.get("Authorization", "").startswith("Bearer "):
+            return True
+        self._send_error(401, "You didn't provide an API key.", "invalid_request_error")
+        return False
+
+    def do_OPTIONS(self) -> None:
+        # Preflight CORS per logprob.html
+        self.send_response(204)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "Authorization, Content-Type")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/") != "/v1/models":
+            self._send_error(404, f"Unknown request URL: GET {self.path}", "invalid_request_error")
+            return
+        if not self._authorized():
+            return
+        self._send_json(200, {
+            'object': "list",
+            'data': [{'id': model, 'object': "model", 'created': 0, 'owned_by': "system"} for model in MODELS],
+        })
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self._send_error(404, f"Unknown request URL: POST {self.path}", "invalid_request_error")
+            return
+        if not self._authorized():
+            return
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            self._send_error(400, "We could not parse the JSON body of your request.", "invalid_request_error")
+            return
+
+        settings = self.server.settings
+        time.sleep(settings.latency + random.uniform(0, settings.latency_jitter))
+
+        roll = self.server.roll()
+        if roll < settings.error_rate_429:
+            self._send_error(429, "Rate limit reached for requests (mock server).", "requests",
+                             {"Retry-After": f"{settings.retry_after:g}"})
+            return
+        if roll < settings.error_rate_429 + settings.error_rate_5xx:
+            status = SERVER_ERRORS[int(roll * 1000) % len(SERVER_ERRORS)]
+            self._send_error(status, "The server had an error while processing your request (mock server).",
+                             "server_error")
+            return
+
+        n_tokens, seed = response_tokens(payload, settings)
+        top_logprobs = int(payload.get('top_logprobs') or 0)
+        samples = 1 if payload.get('stream') else max(1, int(payload.get('n') or 1))
+        choices = [sample_tokens(n_tokens, seed, top_logprobs, i) for i in range(samples)]
+        if not payload.get('logprobs'):
+            choices = [[{'token': token['token']} for token in tokens] for tokens in choices]
+
+        completion_id = f"chatcmpl-mock-{seed:x}-{n_tokens}"
+        model = payload.get('model', MODELS[0])
+        if payload.get('stream'):
+            self._stream(completion_id, model, choices[0], payload)
+        else:
+            self._complete(completion_id, model, choices, bool(payload.get('logprobs')))
+
+    def _usage(self, completion_tokens: int) -> Dict[str, int]:
+        prompt_tokens = 32
+        return {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+        }
+
+    def _complete(self, completion_id: str, model: str, choices: List[List[Dict[str, Any]]], logprobs: bool) -> None:
+        settings = self.server.settings
+        if settings.tokens_per_second > 0:
+            # Le scelte vengono generate in parallelo
+            time.sleep(max(map(len, choices)) / settings.tokens_per_second)
+        self._send_json(200, {
+            'id': completion_id,
+            'object': "chat.completion",
+            'created': int(time.time()),
+            'model': model,
+            'choices': [
+                {
+                    'index': i,
+                    'message': {'role': "assistant", 'content': "".join(token['token'] for token in tokens)},
+                    'logprobs': {'content': tokens} if logprobs else None,
+                    'finish_reason': "stop",
+                }
+                for i, tokens in enumerate(choices)
+            ],
+            'usage': self._usage(sum(map(len, choices))),
+        })
+
+    def _write_chunk(self, data: bytes) -> None:
+        # Transfer-Encoding: chunked, così la connessione resta riutilizzabile
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _stream(self, completion_id: str, model: str, tokens: List[Dict[str, Any]],
+                payload: Dict[str, Any]) -> None:
+        settings = self.server.settings
+        logprobs = bool(payload.get('logprobs'))
+        include_usage = bool((payload.get('stream_options') or {}).get('include_usage'))
+        created = int(time.time())
+
+        def event(delta: Dict[str, Any], content: Optional[List[Dict[str, Any]]] = None,
+                  finish_reason: Optional[str] = None) -> bytes:
+            chunk = {
+                'id': completion_id,
+                'object': "chat.completion.chunk",
+                'created': created,
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'delta': delta,
+                    'logprobs': {'content': content} if content is not None and logprobs else None,
+                    'finish_reason': finish_reason,
+                }],
+            }
+            return b"data: " + json.dumps(chunk).encode('utf-8') + b"\n\n"
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+
+        try:
+            self._write_chunk(event({'role': "assistant", 'content': ""}))
+            step = max(1, settings.chunk_tokens)
+            start = time.monotonic()
+            for i in range(0, len(tokens), step):
+                if settings.tokens_per_second > 0:
+                    # Ritardo calcolato dall'inizio, così gli errori di sleep non si accumulano
+                    delay = start + i / settings.tokens_per_second - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                chunk = tokens[i:i + step]
+                self._write_chunk(event({'content': "".join(token['token'] for token in chunk)}, chunk))
+            self._write_chunk(event({}, finish_reason="stop"))
+            if include_usage:
+                usage = {
+                    'id': completion_id,
+                    'object': "chat.completion.chunk",
+                    'created': created,
+                    'model': model,
+                    'choices': [],
+                    'usage': self._usage(len(tokens)),
+                }
+                self._write_chunk(b"data: " + json.dumps(usage).encode('utf-8') + b"\n\n")
+            self._write_chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # Il client ha chiuso lo stream (ad esempio un utente che ha interrotto)
+            self.close_connection = True
+            self.server.count("disconnected")
+            return
+        self.server.count("200")
+
+
+def main(argv: Optional[list] = None) -> int:
+    defaults = MockSettings()
+    parser = argparse.ArgumentParser(
+        prog="python -m logprob.mock_server",
+        description="Server locale che imita l'API OpenAI (chat completions con logprobs)."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=defaults.latency,
+                        help="secondi prima del primo byte della risposta")
+    parser.add_argument("--latency-jitter", type=float, default=defaults.latency_jitter,
+                        help="ritardo casuale aggiuntivo massimo, in secondi")
+    parser.add_argument("--tokens-per-second", type=float, default=defaults.tokens_per_second,
+                        help="velocità di generazione (0 = senza limite)")
+    parser.add_argument("--min-tokens", type=int, default=defaults.min_tokens,
+                        help="token minimi per risposta se la richiesta non indica max_tokens")
+    parser.add_argument("--max-tokens", type=int, default=defaults.max_tokens,
+                        help="token massimi per risposta se la richiesta non indica max_tokens")
+    parser.add_argument("--error-rate-429", type=float, default=defaults.error_rate_429,
+                        help="frazione di richieste rifiutate con 429")
+    parser.add_argument("--error-rate-5xx", type=float, default=defaults.error_rate_5xx,
+                        help="frazione di richieste che falliscono con 500/502/503")
+    parser.add_argument("--retry-after", type=float, default=defaults.retry_after,
+                        help="valore di Retry-After delle risposte 429, in secondi")
+    parser.add_argument("--chunk-tokens", type=int, default=defaults.chunk_tokens,
+                        help="token per evento in streaming")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    args = parser.parse_args(argv)
+
+    settings = MockSettings(
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        tokens_per_second=args.tokens_per_second,
+        min_tokens=args.min_tokens,
+        max_tokens=args.max_tokens,
+        error_rate_429=args.error_rate_429,
+        error_rate_5xx=args.error_rate_5xx,
+        retry_after=args.retry_after,
+        chunk_tokens=args.chunk_tokens,
+        seed=args.seed,
+    )
+    server = MockServer((args.host, args.port), settings)
+    print(f"Server di prova su {server.url} (LOGPROB_API_BASE={server.url})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""Analisi in un pool di processi, fuori dal GIL del processo dell'interfaccia.
+
+Segmentazione, allineamento e calcolo della confidenza di una risposta
+lunga occupano la CPU per decine di millisecondi: eseguiti nel thread di un
+worker Gradio bloccano anche l'I/O delle altre sessioni. Con il pool
+attivo create_confidence_analyses viene eseguita in un processo separato,
+così il throughput delle analisi cresce con il numero di core.
+
+La tabella dei token viaggia verso il processo nella forma binaria di
+TokenTable.to_bytes() (colonne numeriche e testo, nessun oggetto per
+token); tornano solo i segmenti, a cui viene riattaccata la tabella già
+presente nel processo chiamante. I tempi delle fasi misurati nel processo
+del pool vengono sommati allo StageTimer del chiamante; il tempo di
+trasferimento compare come fase "offload".
+
+Configurazione con `configure()` oppure con le variabili d'ambiente:
+
+- LOGPROB_WORKERS: processi del pool (default 0 = analisi nel thread chiamante)
+- LOGPROB_WORKER_WARMUP: "0" per non avviare e preparare i processi alla
+  creazione del pool (default: ogni processo importa i moduli ed esegue una
+  piccola analisi prima di ricevere richieste)
+- LOGPROB_OFFLOAD_MIN_TOKENS: sotto questa soglia l'analisi resta nel thread
+  chiamante, dove costa meno del trasferimento (default 1000)
+
+I processi vengono creati con il metodo "spawn": il processo dell'app ha
+già molti thread e fork non sarebbe sicuro.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from logprob.analysis import GRANULARITIES, create_confidence_analyses
+from logprob.metrics import TOKENS_PROCESSED, StageTimer
+from logprob.tokens import TokenTable
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+@dataclass(frozen=True)
+class OffloadSettings:
+    """Dimensione del pool, preparazione dei processi e soglia minima."""
+    workers: int = field(default_factory=lambda: _env_int("LOGPROB_WORKERS", 0))
+    warmup: bool = field(default_factory=lambda: os.environ.get("LOGPROB_WORKER_WARMUP", "1") != "0")
+    min_tokens: int = field(default_factory=lambda: _env_int("LOGPROB_OFFLOAD_MIN_TOKENS", 1000))
+
+
+_lock = threading.Lock()
+_settings = OffloadSettings()
+_pool: Optional[ProcessPoolExecutor] = None
+
+# Risposta usata per preparare i processi: abbastanza per compilare le
+# espressioni regolari ed eseguire tutti i percorsi dell'analisi
+_WARMUP_TOKENS = ["# Titolo", "\n\n", "Una", " frase", ".", " Un'altra", "!", "\n", "- elemento"]
+
+
+def _warm_up() -> None:
+    # Eseguita in ogni processo all'avvio: import e prima analisi
+    table = TokenTable.from_texts(_WARMUP_TOKENS, [-0.1] * len(_WARMUP_TOKENS))
+    create_confidence_analyses(table.text, table)
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _analyze(data: bytes, granularities: Tuple[str, ...]) -> Tuple[Dict[str, List[Dict[str, Any]]], Dict[str, float]]:
+    # Eseguita nel processo del pool: restituisce i segmenti e i tempi delle fasi
+    timer = StageTimer()
+    table = TokenTable.from_bytes(data)
+    analyses = create_confidence_analyses(table.text, table, granularities, timer)
+    return {granularity: analysis['segments'] for granularity, analysis in analyses.items()}, timer.stages
+
+
+def configure(**overrides: Any) -> OffloadSettings:
+    """Aggiorna i parametri; il pool esistente viene chiuso e ricreato al prossimo uso."""
+    global _settings
+    with _lock:
+        _settings = replace(_settings, **overrides)
+    shutdown()
+    return _settings
+
+
+def get_settings() -> OffloadSettings:
+    """Restituisce i parametri correnti."""
+    return _settings
+
+
+def get_pool() -> Optional[ProcessPoolExecutor]:
+    """Restituisce il pool condiviso, creandolo al primo utilizzo, o None se disattivato."""
+    global _pool
+    with _lock:
+        if _pool is None and _settings.workers > 0:
+            _pool = ProcessPoolExecutor(
+                max_workers=_settings.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_warm_up if _settings.warmup else None,
+            )
+            if _settings.warmup:
+                # Un compito per processo li avvia subito tutti, invece che alla prima richiesta
+                for future in [_pool.submit(_ping) for _ in range(_settings.workers)]:
+                    future.result()
+        return _pool
+
+
+def start() -> Optional[ProcessPoolExecutor]:
+    """Crea (e prepara, se previsto) il pool all'avvio dell'app invece che alla prima analisi."""
+    return get_pool()
+
+
+def shutdown() -> None:
+    """Chiude il pool, attendendo le analisi in corso."""
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
+
+
+def analyze_table(table: TokenTable, granularities: Sequence[str] = GRANULARITIES,
+                  timer: Optional[StageTimer] = None) -> Dict[str, Dict[str, Any]]:
+    """Come create_confidence_analyses, eseguita nel pool se attivo e se la risposta è abbastanza lunga.
+
+    Se un processo del pool termina in modo anomalo il pool viene ricreato
+    e l'analisi eseguita nel thread chiamante.
+    """
+    timer = timer or StageTimer()
+    pool = get_pool() if len(table) >= _settings.min_tokens else None
+    if pool is None:
+        return create_confidence_analyses(table.text, table, granularities, timer)
+
+    started = time.perf_counter()
+    try:
+        segment_data, stages = pool.submit(_analyze, table.to_bytes(), tuple(granularities)).result()
+    except BrokenProcessPool:
+        shutdown()
+        return create_confidence_analyses(table.text, table, granularities, timer)
+    elapsed = time.perf_counter() - started
+    for name, seconds in stages.items():
+        timer.add(name, seconds)
+    timer.add("offload", max(0.0, elapsed - sum(stages.values())))
+    TOKENS_PROCESSED.inc(len(table))
+
+    text = table.text
+    return {
+        granularity: {
+            'text': text,
+            'segments': segments,
+            'granularity': granularity,
+            'table': table
+        }
+        for granularity, segments in segment_data.items()
+    }
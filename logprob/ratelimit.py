@@ -0,0 +1,164 @@
+"""Limitatori di frequenza a token bucket (richieste e token al minuto)."""
+import asyncio
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+
+class RateLimitExceeded(Exception):
+    """Richiesta rifiutata perché supera il limite; `retry_after` sono i secondi da attendere."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def estimate_tokens(prompt: str, completion_tokens: int) -> int:
+    """Stima grossolana dei token di una richiesta (circa 4 caratteri per token)."""
+    return len(prompt) // 4 + completion_tokens
+
+
+class TokenBucket:
+    """Token bucket con prenotazione anticipata.
+
+    `reserve` scala subito le unità richieste, anche se il saldo diventa
+    negativo, e restituisce il tempo da attendere prima di poterle usare:
+    così più chiamanti concorrenti si mettono in fila senza superare il
+    ritmo configurato.
+    """
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute if capacity is None else capacity
+        self.level = self.capacity
+        self.clock = clock
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Prenota `amount` unità e restituisce i secondi di attesa necessari."""
+        with self._lock:
+            self._refill()
+            self.level -= amount
+            return max(0.0, -self.level / self.rate)
+
+    def try_acquire(self, amount: float) -> float:
+        """Preleva `amount` unità solo se disponibili subito.
+
+        Restituisce 0 se il prelievo è riuscito, altrimenti i secondi dopo
+        i quali le unità saranno disponibili (senza prelevare nulla). Una
+        richiesta più grande della capacità passa con il bucket pieno e ne
+        rende negativo il saldo, come con reserve.
+        """
+        with self._lock:
+            self._refill()
+            needed = min(amount, self.capacity)
+            if self.level >= needed:
+                self.level -= amount
+                return 0.0
+            return (needed - self.level) / self.rate
+
+    def adjust(self, delta: float) -> None:
+        """Corregge una prenotazione quando il consumo reale è noto."""
+        with self._lock:
+            self._refill()
+            self.level = min(self.capacity, self.level - delta)
+
+
+class RateLimiter:
+    """Limite combinato di richieste e token al minuto (None = nessun limite)."""
+
+    def __init__(self, requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def reserve(self, tokens: int) -> float:
+        """Prenota una richiesta da `tokens` token stimati; restituisce l'attesa."""
+        delay = 0.0
+        if self.requests is not None:
+            delay = max(delay, self.requests.reserve(1))
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.reserve(tokens))
+        return delay
+
+    def try_acquire(self, tokens: int, requests: int = 1) -> float:
+        """Come TokenBucket.try_acquire, per `requests` richieste da `tokens` token stimati in tutto.
+
+        Se uno dei due limiti non lo consente non viene prelevato nulla.
+        """
+        if self.requests is not None:
+            delay = self.requests.try_acquire(requests)
+            if delay > 0:
+                return delay
+        if self.tokens is not None:
+            delay = self.tokens.try_acquire(tokens)
+            if delay > 0:
+                if self.requests is not None:
+                    self.requests.adjust(-requests)
+                return delay
+        return 0.0
+
+    async def acquire(self, tokens: int) -> None:
+        """Attende (senza bloccare l'event loop) che la richiesta rientri nei limiti."""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def record_usage(self, estimated: int, actual: Optional[int]) -> None:
+        """Riallinea il bucket dei token al consumo effettivo della richiesta (None se non noto)."""
+        if self.tokens is not None and actual is not None:
+            self.tokens.adjust(actual - estimated)
+
+
+class KeyedRateLimiter:
+    """Un RateLimiter per chiave (ad esempio per API key), creato al primo uso.
+
+    Le chiavi vengono conservate solo come hash SHA-256; oltre `max_keys`
+    chiavi quelle usate meno di recente vengono dimenticate (e ripartono
+    dal bucket pieno).
+    """
+
+    def __init__(self, requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None, max_keys: int = 1024):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_keys = max_keys
+        self._limiters: "OrderedDict[str, RateLimiter]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def limiter(self, key: str) -> RateLimiter:
+        """Limitatore della chiave."""
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        with self._lock:
+            limiter = self._limiters.get(digest)
+            if limiter is None:
+                limiter = self._limiters[digest] = RateLimiter(self.requests_per_minute, self.tokens_per_minute)
+                while len(self._limiters) > self.max_keys:
+                    self._limiters.popitem(last=False)
+            self._limiters.move_to_end(digest)
+            return limiter
+
+    def admit(self, key: str, tokens: int, requests: int = 1) -> None:
+        """Preleva richieste e token stimati dal limitatore della chiave.
+
+        Solleva RateLimitExceeded, senza prelevare nulla, se la chiave ha
+        esaurito uno dei due limiti.
+        """
+        delay = self.limiter(key).try_acquire(tokens, requests)
+        if delay > 0:
+            raise RateLimitExceeded(
+                f"Limite di richieste per questa API key raggiunto: riprova tra {math.ceil(delay)} s", delay)
+
+    def record_usage(self, key: str, estimated: int, actual: Optional[int]) -> None:
+        """Riallinea il bucket dei token della chiave al consumo effettivo."""
+        self.limiter(key).record_usage(estimated, actual)
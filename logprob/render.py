@@ -0,0 +1,370 @@
+"""Visualizzazione in HTML dei risultati dell'analisi.
+
+Le confidenze vengono divise in cinque fasce, le stesse delle etichette e
+della legenda, ognuna con una classe CSS (c0 ... c4) definita una sola
+volta nel foglio di stile del risultato: ogni token o parola porta solo la
+classe e la percentuale nel title invece di uno stile inline completo.
+L'HTML viene assemblato con join su template precompilati e tutto il testo
+prodotto dal modello viene sottoposto a escape.
+
+Obiettivo: a livello di token una risposta di 4000 token produce meno di
+250 KB di HTML in meno di 20 ms.
+"""
+import html
+import math
+import time
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from logprob.tokens import TokenTable
+
+# Soglie delle fasce di confidenza: la fascia è il numero di soglie superate
+CONFIDENCE_THRESHOLDS = (50, 70, 85, 95)
+
+CONFIDENCE_LABELS = (
+    "Molto bassa confidenza",
+    "Bassa confidenza",
+    "Media confidenza",
+    "Alta confidenza",
+    "Altissima confidenza",
+)
+
+# Stesse fasce, applicate alla percentuale di campioni concordi
+AGREEMENT_LABELS = (
+    "Accordo molto basso",
+    "Accordo basso",
+    "Accordo medio",
+    "Accordo alto",
+    "Accordo altissimo",
+)
+
+CONFIDENCE_COLORS = (
+    (255, 0, 0),
+    (210, 45, 0),
+    (170, 85, 0),
+    (85, 170, 0),
+    (0, 255, 0),
+)
+
+GRANULARITY_TITLES = {
+    'token': "Analisi a livello di token",
+    'word': "Analisi a livello di parola",
+    'sentence': "Analisi a livello di frase",
+    'consensus': "Analisi di consenso tra campioni",
+}
+
+# Classe del blocco per ogni tipo di segmento
+BLOCK_CLASSES = {
+    'heading': "lp-heading",
+    'list_item': "lp-item",
+    'sentence': "lp-segment",
+}
+
+
+def confidence_level(confidence: float) -> int:
+    """Fascia (0-4) di una confidenza percentuale."""
+    return bisect_left(CONFIDENCE_THRESHOLDS, confidence)
+
+
+def confidence_levels(confidences: Sequence[float]) -> np.ndarray:
+    """Fasce di un array di confidenze, calcolate in forma vettoriale."""
+    return np.searchsorted(CONFIDENCE_THRESHOLDS, confidences, side='left')
+
+
+def get_confidence_label(confidence: float) -> str:
+    """Restituisce l'etichetta del livello di confidenza."""
+    return CONFIDENCE_LABELS[confidence_level(confidence)]
+
+
+def _build_stylesheet() -> str:
+    rules = [
+        ".lp-result .lp-segment { margin: 15px 0; padding: 10px; border-radius: 5px; "
+        "background-color: #f8f9fa; border-left: 4px solid #6c757d; }",
+        ".lp-result .lp-heading { margin: 20px 0 10px 0; padding: 10px; background-color: #e9ecef; "
+        "border-radius: 5px; font-weight: bold; }",
+        ".lp-result .lp-item { margin: 5px 0 5px 20px; padding: 5px 10px; background-color: #f8f9fa; "
+        "border-left: 3px solid #6c757d; }",
+        ".lp-result .lp-tokens span { font-weight: 600; }",
+        ".lp-result .lp-score { margin-left: 10px; font-size: 0.9em; }",
+        ".lp-result .lp-more { color: #777; font-style: italic; }",
+        ".lp-result .lp-error { color: red; padding: 10px; border-left: 4px solid red; background-color: #ffeeee; }",
+        ".lp-result .lp-legend { margin-top: 20px; padding: 15px; background-color: #f0f0f0; "
+        "border-radius: 8px; border: 1px solid #ddd; }",
+        ".lp-result .lp-legend h4 { margin-top: 0; margin-bottom: 10px; }",
+        ".lp-result .lp-legend div { display: flex; align-items: center; margin-bottom: 8px; font-weight: bold; }",
+        ".lp-result .lp-swatch { display: inline-block; width: 25px; height: 25px; margin-right: 10px; "
+        "border: 1px solid #333; }",
+        ".lp-result .lp-columns { display: grid; grid-template-columns: repeat(auto-fit, minmax(260px, 1fr)); gap: 12px; }",
+        ".lp-result .lp-column h4 { margin: 0 0 8px 0; }",
+        ".lp-result .lp-stats { border-collapse: collapse; margin-bottom: 12px; }",
+        ".lp-result .lp-stats th, .lp-result .lp-stats td { padding: 4px 10px; border-bottom: 1px solid #ddd; text-align: right; }",
+        ".lp-result .lp-stats th:first-child, .lp-result .lp-stats td:first-child { text-align: left; }",
+        ".lp-result .lp-stats td.lp-text { text-align: left; }",
+    ]
+    for level, (r, g, b) in enumerate(CONFIDENCE_COLORS):
+        rules.append(f".lp-result .c{level} {{ color: rgb({r}, {g}, {b}); }}")
+        rules.append(f".lp-result .lp-scored.c{level} {{ border-left: 4px solid rgb({r}, {g}, {b}); }}")
+        rules.append(f".lp-result .lp-segment.lp-scored.c{level} {{ background-color: rgba({r}, {g}, {b}, 0.08); }}")
+        rules.append(f".lp-result .lp-swatch.c{level} {{ background-color: rgb({r}, {g}, {b}); }}")
+    return "<style>\n" + "\n".join(rules) + "\n</style>"
+
+
+def _build_legend(title: str, labels: Sequence[str]) -> str:
+    ranges = ("0-50%", "50-70%", "70-85%", "85-95%", "95-100%")
+    items = [
+        f"<div><span class='lp-swatch c{level}'></span>{labels[level]} ({ranges[level]})</div>"
+        for level in reversed(range(len(labels)))
+    ]
+    return f"<div class='lp-legend'><h4>{title}</h4>" + "".join(items) + "</div>"
+
+
+STYLESHEET = _build_stylesheet()
+LEGEND_HTML = _build_legend("Legenda Confidenza:", CONFIDENCE_LABELS)
+AGREEMENT_LEGEND_HTML = _build_legend("Legenda Accordo tra campioni:", AGREEMENT_LABELS)
+
+# Un token o una parola: fascia, percentuale e testo già sottoposto a escape
+_MARK = '<span class="c%d" title="%.1f%%">%s</span>'
+# Come _MARK, con l'entropia delle alternative nel title
+_MARK_ENTROPY = '<span class="c%d" title="%.1f%% · H %.2f bit">%s</span>'
+
+
+def _escape(text: str) -> str:
+    return html.escape(text, quote=False)
+
+
+def format_uncertainty(data: Dict[str, Any]) -> str:
+    """Entropia, margine e massa medi di un segmento, o stringa vuota se mancano le alternative."""
+    entropy = data.get('entropy')
+    if entropy is None or math.isnan(entropy):
+        return ""
+    return f" · entropia {entropy:.2f} bit · margine {data['margin']:.2f} · massa {data['mass']:.2f}"
+
+
+def _mark(level: int, confidence: float, text: str, entropy: Optional[float]) -> str:
+    if entropy is None or math.isnan(entropy):
+        return _MARK % (level, confidence, text)
+    return _MARK_ENTROPY % (level, confidence, entropy, text)
+
+
+def format_segment(segment: Dict[str, Any], i: int, granularity: str, table: Optional[TokenTable] = None) -> str:
+    """Formatta in HTML un singolo segmento dell'analisi.
+
+    A livello di token il segmento contiene solo l'intervallo di token:
+    testi e confidenze vengono letti dalla tabella dei token. Se ci sono le
+    alternative top-k, il title di token e parole riporta anche l'entropia.
+    """
+    kind = segment.get('kind', "sentence")
+    block = BLOCK_CLASSES.get(kind, "lp-segment")
+    prefix = f"<strong>Segmento {i + 1}:</strong> " if kind == "sentence" else ""
+
+    if granularity == 'token':
+        first, last = segment['token_start'], segment['token_end']
+        confidences = table.confidences[first:last]
+        uncertainty = table.uncertainty
+        if uncertainty is None:
+            body = "".join([
+                _MARK % (level, confidence, _escape(token))
+                for token, level, confidence in zip(
+                    table.token_texts(first, last), confidence_levels(confidences).tolist(), confidences.tolist())
+            ])
+        else:
+            body = "".join([
+                _mark(level, confidence, _escape(token), entropy)
+                for token, level, confidence, entropy in zip(
+                    table.token_texts(first, last), confidence_levels(confidences).tolist(), confidences.tolist(),
+                    uncertainty[first:last, 0].tolist())
+            ])
+        return f'<div class="{block} lp-tokens">{prefix}{body}</div>'
+
+    if granularity == 'word':
+        # Il testo tra una parola e l'altra resta invariato
+        text = segment['text']
+        start = segment['start']
+        parts = []
+        cursor = 0
+        for word in segment.get('words', []):
+            word_start = word['start'] - start
+            word_end = word['end'] - start
+            parts.append(_escape(text[cursor:word_start]))
+            parts.append(_mark(confidence_level(word['confidence']), word['confidence'],
+                               _escape(text[word_start:word_end]), word.get('entropy')))
+            cursor = word_end
+        parts.append(_escape(text[cursor:]))
+        return f'<div class="{block} lp-tokens">{prefix}{"".join(parts)}</div>'
+
+    # sentence
+    confidence = segment['confidence']
+    level = confidence_level(confidence)
+    return (
+        f'<div class="{block} lp-scored c{level}">{prefix}{_escape(segment["text"])}'
+        f'<span class="lp-score">({confidence:.2f}% - {CONFIDENCE_LABELS[level]}{format_uncertainty(segment)})</span></div>'
+    )
+
+
+def format_results(result: Dict[str, Any], rendered: Optional[List[str]] = None,
+                   window: Optional[int] = None) -> str:
+    """Formatta i risultati dell'analisi in HTML.
+
+    `rendered` contiene l'HTML già prodotto per i primi segmenti, che non
+    viene ricalcolato (usato durante lo streaming). Con `window` vengono
+    mostrati solo gli ultimi `window` segmenti, così la dimensione di ogni
+    aggiornamento non cresce con la risposta.
+    """
+    if "error" in result:
+        return (f"{STYLESHEET}<div class='lp-result'><div class='lp-error'>"
+                f"<strong>Errore:</strong> {_escape(str(result['error']))}</div></div>")
+
+    granularity = result['granularity']
+    table = result.get('table')
+    rendered = rendered or []
+    segments = result.get('segments', [])
+    first = max(0, len(segments) - window) if window else 0
+
+    parts = [
+        STYLESHEET,
+        "<div class='lp-result'><h2>Risultati dell'analisi</h2>",
+        f"<h3>{GRANULARITY_TITLES[granularity]}</h3>",
+    ]
+    if first:
+        parts.append(f"<p class='lp-more'>… {first} segmenti precedenti</p>")
+    parts.extend(rendered[first:])
+    for i in range(max(first, len(rendered)), len(segments)):
+        parts.append(format_segment(segments[i], i, granularity, table))
+    parts.append(LEGEND_HTML)
+    parts.append("</div>")
+    return "".join(parts)
+
+
+def format_consensus(result: Dict[str, Any]) -> str:
+    """Formatta in HTML l'analisi di consenso (vedi logprob.consensus).
+
+    Il colore di ogni segmento indica l'accordo tra i campioni, con le
+    stesse fasce della confidenza; accanto sono riportati confidenza del
+    campione di riferimento e confidenza media dei segmenti equivalenti.
+    """
+    if "error" in result:
+        return format_results(result)
+
+    others = result['samples'] - 1
+    parts = [
+        STYLESHEET,
+        "<div class='lp-result'><h2>Risultati dell'analisi</h2>",
+        f"<h3>{GRANULARITY_TITLES['consensus']}</h3>",
+        f"<p>{result['samples']} campioni in una sola richiesta; riferimento: campione "
+        f"{result['reference'] + 1} (logprob media più alta). Accordo medio: {result['agreement'] * 100:.0f}%. "
+        "Confidenza media per campione: "
+        + ", ".join(f"{confidence:.1f}%" for confidence in result['sample_confidences'])
+        + ".</p>",
+    ]
+    for i, segment in enumerate(result['segments']):
+        kind = segment.get('kind', "sentence")
+        block = BLOCK_CLASSES.get(kind, "lp-segment")
+        prefix = f"<strong>Segmento {i + 1}:</strong> " if kind == "sentence" else ""
+        level = confidence_level(segment['agreement'] * 100)
+        parts.append(
+            f'<div class="{block} lp-scored c{level}">{prefix}{_escape(segment["text"])}'
+            f'<span class="lp-score">(accordo {segment["matches"]}/{others} · similarità {segment["similarity"]:.2f}'
+            f' · confidenza {segment["confidence"]:.1f}% · consenso {segment["consensus_confidence"]:.1f}%)</span></div>'
+        )
+    parts.append(AGREEMENT_LEGEND_HTML)
+    parts.append("</div>")
+    return "".join(parts)
+
+
+def _format_stats_row(model: str, entry: Optional[Dict[str, Any]]) -> str:
+    name = _escape(model)
+    if entry is None:
+        return f"<tr><td>{name}</td><td colspan='6' class='lp-more'>in attesa…</td></tr>"
+    if "error" in entry:
+        return f"<tr><td>{name}</td><td colspan='6' class='lp-error'>{_escape(entry['error'])}</td></tr>"
+    stats = entry['stats']
+    level = confidence_level(stats['mean_confidence'])
+    return (
+        f"<tr><td>{name}</td><td>{stats['latency']:.2f} s</td><td>{stats['tokens']}</td><td>{stats['segments']}</td>"
+        f"<td class='c{level}'>{stats['mean_confidence']:.1f}%</td><td>{stats['min_confidence']:.1f}%</td>"
+        f"<td>{stats['uncertain'] * 100:.0f}%</td></tr>"
+    )
+
+
+def format_comparison(models: Sequence[str], results: Dict[str, Dict[str, Any]]) -> str:
+    """Formatta in HTML il confronto tra modelli (vedi logprob.comparison).
+
+    `results` contiene i risultati già arrivati, per modello: i modelli
+    ancora in attesa hanno una colonna vuota, così la vista può essere
+    aggiornata a ogni risposta.
+    """
+    parts = [
+        STYLESHEET,
+        "<div class='lp-result'><h2>Confronto tra modelli</h2>",
+        "<table class='lp-stats'><tr><th>Modello</th><th>Tempo</th><th>Token</th><th>Segmenti</th>"
+        "<th>Confidenza media</th><th>Minima</th><th>Segmenti incerti</th></tr>",
+    ]
+    parts.extend(_format_stats_row(model, results.get(model)) for model in models)
+    parts.append("</table><div class='lp-columns'>")
+    for model in models:
+        entry = results.get(model)
+        parts.append(f"<div class='lp-column'><h4>{_escape(model)}</h4>")
+        if entry is None:
+            parts.append("<p class='lp-more'>In attesa della risposta…</p>")
+        elif "error" in entry:
+            parts.append(f"<div class='lp-error'><strong>Errore:</strong> {_escape(entry['error'])}</div>")
+        else:
+            parts.extend(
+                format_segment(segment, i, "sentence")
+                for i, segment in enumerate(entry['analysis']['segments'])
+            )
+        parts.append("</div>")
+    parts.append("</div>")
+    parts.append(LEGEND_HTML)
+    parts.append("</div>")
+    return "".join(parts)
+
+
+def _format_time(created: float) -> str:
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(created))
+
+
+def format_history_segments(rows: List[Dict[str, Any]], page: int) -> str:
+    """Formatta in HTML una pagina di segmenti dello storico (vedi HistoryStore.low_confidence_segments)."""
+    parts = [STYLESHEET, f"<div class='lp-result'><h3>Segmenti poco sicuri · pagina {page}</h3>"]
+    if not rows:
+        parts.append("<p class='lp-more'>Nessun segmento trovato.</p></div>")
+        return "".join(parts)
+    parts.append(
+        "<table class='lp-stats'><tr><th>Run</th><th>Data</th><th>Modello</th><th>Confidenza</th>"
+        "<th>Minima</th><th>Entropia</th><th>Testo</th></tr>"
+    )
+    for row in rows:
+        level = confidence_level(row['confidence'])
+        entropy = f"{row['entropy']:.2f} bit" if row['entropy'] is not None else "-"
+        parts.append(
+            f"<tr><td>{row['run_id']}</td><td>{_format_time(row['created'])}</td><td>{_escape(row['model'])}</td>"
+            f"<td class='c{level}'>{row['confidence']:.1f}%</td><td>{row['min_confidence']:.1f}%</td>"
+            f"<td>{entropy}</td><td class='lp-text'>{_escape(row['text'])}</td></tr>"
+        )
+    parts.append("</table></div>")
+    return "".join(parts)
+
+
+def format_history_runs(rows: List[Dict[str, Any]], page: int) -> str:
+    """Formatta in HTML una pagina di run dello storico (vedi HistoryStore.runs)."""
+    parts = [STYLESHEET, f"<div class='lp-result'><h3>Analisi salvate · pagina {page}</h3>"]
+    if not rows:
+        parts.append("<p class='lp-more'>Nessuna analisi salvata.</p></div>")
+        return "".join(parts)
+    parts.append(
+        "<table class='lp-stats'><tr><th>Run</th><th>Data</th><th>Modello</th><th>Token</th>"
+        "<th>Confidenza</th><th>Prompt</th></tr>"
+    )
+    for row in rows:
+        confidence = row['confidence'] if row['confidence'] is not None else 0.0
+        prompt = row['prompt'] if len(row['prompt']) <= 120 else row['prompt'][:120] + "…"
+        parts.append(
+            f"<tr><td>{row['id']}</td><td>{_format_time(row['created'])}</td><td>{_escape(row['model'])}</td>"
+            f"<td>{row['tokens']}</td><td class='c{confidence_level(confidence)}'>{confidence:.1f}%</td>"
+            f"<td class='lp-text'>{_escape(prompt)}</td></tr>"
+        )
+    parts.append("</table></div>")
+    return "".join(parts)
@@ -0,0 +1,108 @@
+"""Limiti per servire l'app Gradio a più utenti contemporaneamente.
+
+Due livelli di protezione:
+
+- la coda di Gradio: al più `concurrency` analisi (richieste all'API) in
+  esecuzione insieme e al più `queue_size` in attesa; oltre, le nuove
+  richieste vengono rifiutate subito invece di scadere dopo minuti di
+  attesa. Chi è in coda vede posizione e tempo stimato.
+- un limitatore per API key (logprob.ratelimit.KeyedRateLimiter) su
+  richieste e token stimati al minuto: un utente con molte analisi pesanti
+  non consuma da solo il limite dell'organizzazione. Le richieste oltre il
+  limite vengono rifiutate prima di chiamare l'API, con il tempo dopo cui
+  riprovare.
+
+Configurazione con `configure()` oppure con le variabili d'ambiente:
+
+- LOGPROB_CONCURRENCY: analisi eseguite contemporaneamente (default 4)
+- LOGPROB_QUEUE_SIZE: analisi in attesa oltre le quali si rifiuta (default 32)
+- LOGPROB_KEY_RPM / LOGPROB_KEY_TPM: richieste e token al minuto per API
+  key (default nessun limite)
+- LOGPROB_COMPLETION_TOKENS: token di risposta stimati per richiesta, usati
+  dal limitatore finché l'API non restituisce il consumo reale (default 800)
+"""
+import os
+import threading
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, Optional
+
+from logprob.metrics import REJECTED_REQUESTS
+from logprob.ratelimit import KeyedRateLimiter, RateLimitExceeded, estimate_tokens
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _env_rate(name: str) -> Optional[float]:
+    value = os.environ.get(name)
+    return float(value) if value else None
+
+
+@dataclass(frozen=True)
+class ServingSettings:
+    """Limiti della coda Gradio e dei limitatori per API key."""
+    concurrency: int = field(default_factory=lambda: _env_int("LOGPROB_CONCURRENCY", 4))
+    queue_size: int = field(default_factory=lambda: _env_int("LOGPROB_QUEUE_SIZE", 32))
+    requests_per_minute: Optional[float] = field(default_factory=lambda: _env_rate("LOGPROB_KEY_RPM"))
+    tokens_per_minute: Optional[float] = field(default_factory=lambda: _env_rate("LOGPROB_KEY_TPM"))
+    completion_tokens: int = field(default_factory=lambda: _env_int("LOGPROB_COMPLETION_TOKENS", 800))
+
+
+_lock = threading.Lock()
+_settings = ServingSettings()
+_limiter = KeyedRateLimiter(_settings.requests_per_minute, _settings.tokens_per_minute)
+
+
+def configure(**overrides: Any) -> ServingSettings:
+    """Aggiorna i limiti; i limitatori per API key ripartono da zero."""
+    global _settings, _limiter
+    with _lock:
+        _settings = replace(_settings, **overrides)
+        _limiter = KeyedRateLimiter(_settings.requests_per_minute, _settings.tokens_per_minute)
+        return _settings
+
+
+def get_settings() -> ServingSettings:
+    """Restituisce i limiti correnti."""
+    return _settings
+
+
+# Gli eventi che chiamano l'API condividono lo stesso limite di concorrenza
+ANALYSIS_CONCURRENCY_ID = "analysis"
+
+
+def queue_options() -> Dict[str, Any]:
+    """Parametri di Blocks.queue(): gli eventi che non chiamano l'API (cambi di pagina, storico) non hanno limite."""
+    return {'default_concurrency_limit': None, 'max_size': _settings.queue_size}
+
+
+def analysis_options() -> Dict[str, Any]:
+    """Parametri degli eventi che chiamano l'API: un unico limite di concorrenza condiviso."""
+    return {'concurrency_limit': _settings.concurrency, 'concurrency_id': ANALYSIS_CONCURRENCY_ID}
+
+
+def admit(api_key: str, prompt: str, requests: int = 1, completions: int = 1) -> int:
+    """Preleva dal limitatore dell'API key `requests` richieste con `completions` risposte in tutto.
+
+    Restituisce i token stimati, da passare a record_usage a richiesta
+    conclusa; solleva RateLimitExceeded se la chiave ha superato i limiti.
+    """
+    estimated = requests * estimate_tokens(prompt, 0) + completions * _settings.completion_tokens
+    try:
+        _limiter.admit(api_key, estimated, requests)
+    except RateLimitExceeded:
+        REJECTED_REQUESTS.inc(reason="rate_limit")
+        raise
+    return estimated
+
+
+def record_usage(api_key: str, estimated: int, usage: Optional[Dict[str, int]]) -> None:
+    """Riallinea il limitatore dell'API key ai token effettivamente usati, se noti.
+
+    Un usage con zero token (risposta in cache o condivisa) restituisce
+    l'intera stima.
+    """
+    if usage:
+        _limiter.record_usage(api_key, estimated, usage.get('total_tokens'))
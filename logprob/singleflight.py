@@ -0,0 +1,146 @@
+"""Unione delle richieste identiche in corso (single-flight).
+
+Quando più sessioni chiedono nello stesso momento la stessa analisi (ad
+esempio un prompt di esempio condiviso durante una demo), solo la prima
+richiesta parte davvero verso l'API: le altre, con la stessa chiave, si
+agganciano alla chiamata in corso e ne ricevono lo stesso risultato o la
+stessa eccezione. A chiamata conclusa la chiave viene liberata: le
+richieste successive trovano la risposta in cache. logprob.api usa come
+chiave l'hash della API key insieme all'hash del payload
+(logprob.cache.cache_key): richieste di API key diverse non vengono mai
+unite, così un 401 o un 429 di una chiave non arriva agli altri utenti e
+nessuno riceve una risposta pagata con la chiave di un altro.
+
+Per lo streaming i token della chiamata condivisa vengono letti da un
+thread dedicato e distribuiti a tutti gli iscritti; chi arriva a stream già
+iniziato riceve prima i token già arrivati e poi quelli nuovi. Se un
+iscritto smette di leggere (ad esempio chiude la pagina) lo stream
+prosegue per gli altri e, alla fine, viene salvato in cache.
+
+I contatori `logprob_coalesced_requests_total{mode, role}` (role "leader"
+per le chiamate effettive, "merged" per quelle unite) misurano quante
+richieste all'API sono state risparmiate.
+"""
+import threading
+from typing import Callable, Dict, Generic, Iterator, List, Optional, TypeVar
+
+from logprob.metrics import COALESCED_REQUESTS, StageTimer
+
+T = TypeVar("T")
+
+
+class _Call(Generic[T]):
+    """Chiamata in corso: risultato o eccezione, disponibili quando `done` è impostato."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[T] = None
+        self.error: Optional[BaseException] = None
+
+
+class _Broadcast(Generic[T]):
+    """Elementi di uno stream condiviso, conservati per gli iscritti arrivati in ritardo."""
+
+    def __init__(self):
+        self.items: List[T] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.changed = threading.Condition()
+
+    def publish(self, item: T) -> None:
+        with self.changed:
+            self.items.append(item)
+            self.changed.notify_all()
+
+    def close(self, error: Optional[BaseException] = None) -> None:
+        with self.changed:
+            self.finished = True
+            self.error = error
+            self.changed.notify_all()
+
+    def subscribe(self) -> Iterator[T]:
+        """Tutti gli elementi dello stream dall'inizio, poi quelli nuovi man mano che arrivano."""
+        position = 0
+        while True:
+            with self.changed:
+                while position == len(self.items) and not self.finished:
+                    self.changed.wait()
+                items = self.items[position:]
+                finished, error = self.finished, self.error
+            position += len(items)
+            yield from items
+            if finished:
+                if error is not None:
+                    raise error
+                return
+
+
+class SingleFlight:
+    """Esegue una sola volta le chiamate con la stessa chiave in corso nello stesso momento."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._streams: Dict[str, _Broadcast] = {}
+
+    def do(self, key: str, fn: Callable[[], T], timer: Optional[StageTimer] = None) -> T:
+        """Restituisce fn(), oppure il risultato della chiamata con la stessa chiave già in corso.
+
+        Chi si aggancia a una chiamata in corso non esegue `fn`; se indicato,
+        `timer` misura la sua attesa come fase "coalesced".
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            COALESCED_REQUESTS.inc(mode="full", role="merged")
+            timer = timer or StageTimer()
+            with timer.stage("coalesced"):
+                call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        COALESCED_REQUESTS.inc(mode="full", role="leader")
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stream(self, key: str, fn: Callable[[], Iterator[T]]) -> Iterator[T]:
+        """Restituisce gli elementi di fn(), condividendo lo stream con le richieste con la stessa chiave.
+
+        Lo stream viene letto da un thread dedicato, avviato dalla prima
+        richiesta; gli errori vengono rilanciati a tutti gli iscritti.
+        """
+        with self._lock:
+            broadcast = self._streams.get(key)
+            leader = broadcast is None
+            if leader:
+                broadcast = self._streams[key] = _Broadcast()
+
+        COALESCED_REQUESTS.inc(mode="stream", role="leader" if leader else "merged")
+        if leader:
+            threading.Thread(target=self._pump, args=(key, broadcast, fn), daemon=True).start()
+        return broadcast.subscribe()
+
+    def _pump(self, key: str, broadcast: _Broadcast, fn: Callable[[], Iterator[T]]) -> None:
+        error = None
+        try:
+            for item in fn():
+                broadcast.publish(item)
+        except BaseException as e:
+            error = e
+        finally:
+            with self._lock:
+                del self._streams[key]
+            broadcast.close(error)
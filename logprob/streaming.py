@@ -0,0 +1,114 @@
+"""Supporto allo streaming SSE delle chat completions con logprobs."""
+from bisect import bisect_left, bisect_right
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from logprob.alignment import Segment
+from logprob.decoding import loads
+
+
+class StreamError(Exception):
+    """Errore restituito dall'API all'interno dello stream."""
+
+
+def iter_sse_events(lines: Iterable[bytes]) -> Iterator[Dict[str, Any]]:
+    """Decodifica gli eventi `data:` di uno stream SSE fino a `[DONE]`."""
+    for line in lines:
+        if not line or not line.startswith(b"data:"):
+            continue
+
+        data = line[5:].strip()
+        if data == b"[DONE]":
+            return
+
+        event = loads(data)
+        if 'error' in event:
+            raise StreamError(event['error'].get('message', 'Errore sconosciuto'))
+        yield event
+
+
+def iter_stream_tokens(response: Any) -> Iterator[Dict[str, Any]]:
+    """Restituisce i token con logprob man mano che arrivano dalla risposta in streaming."""
+    # chunk_size=None legge i dati appena disponibili invece di attendere un buffer pieno
+    for event in iter_sse_events(response.iter_lines(chunk_size=None)):
+        for choice in event.get('choices', []):
+            logprobs = choice.get('logprobs') or {}
+            for token in logprobs.get('content') or []:
+                yield token
+
+
+class IncrementalSegmenter:
+    """Segmenta il testo man mano che arriva, restituendo solo i segmenti definitivi.
+
+    Il segmentatore, una funzione (testo, inizio) -> span (inizio, fine,
+    tipo), viene rieseguito solo sul testo non ancora consolidato, preceduto
+    dall'ultimo carattere consolidato (il segmentatore può guardare un
+    carattere prima dell'inizio, ad esempio per riconoscere un inizio riga):
+    tutti i segmenti tranne l'ultimo sono definitivi, perché l'ultimo può
+    ancora crescere con i token successivi. Gli span sono posizioni nel
+    testo completo ricevuto finora.
+
+    Il testo consolidato viene conservato a pezzi e non viene più toccato,
+    così ogni token costa quanto il segmento aperto e non quanto il testo
+    ricevuto; `span_text` ne estrae un intervallo senza ricostruirlo tutto.
+    """
+
+    def __init__(self, segmenter: Callable[[str, int], List[Segment]]):
+        self.segmenter = segmenter
+        self.base = 0
+        # Ultimo segmento, ancora aperto
+        self.open: Optional[Segment] = None
+        # Pezzi di testo consolidato e loro posizioni iniziali
+        self._chunks: List[str] = []
+        self._offsets: List[int] = []
+        self._pending = ""
+
+    @property
+    def pending(self) -> str:
+        """Testo non ancora consolidato."""
+        return self._pending
+
+    @property
+    def text(self) -> str:
+        """Testo completo ricevuto finora (ricostruito a ogni accesso)."""
+        return "".join(self._chunks) + self._pending
+
+    def span_text(self, start: int, end: int) -> str:
+        """Testo nell'intervallo [start, end) del testo completo."""
+        if start >= self.base:
+            return self._pending[start - self.base:end - self.base]
+
+        first = bisect_right(self._offsets, start) - 1
+        last = bisect_left(self._offsets, end)
+        text = "".join(self._chunks[first:last])
+        if end > self.base:
+            text += self._pending
+        offset = self._offsets[first]
+        return text[start - offset:end - offset]
+
+    def feed(self, piece: str) -> List[Segment]:
+        """Aggiunge testo e restituisce i nuovi segmenti definitivi."""
+        self._pending += piece
+        segments = self._segment()
+        self.open = segments[-1] if segments else None
+        return self._consume(segments[:-1])
+
+    def finish(self) -> List[Segment]:
+        """Consolida tutto il testo rimanente alla fine dello stream."""
+        self.open = None
+        return self._consume(self._segment())
+
+    def _segment(self) -> List[Segment]:
+        before = self._chunks[-1][-1:] if self._chunks else ""
+        shift = self.base - len(before)
+        spans = self.segmenter(before + self._pending, len(before))
+        return [(start + shift, end + shift, kind) for start, end, kind in spans]
+
+    def _consume(self, segments: List[Segment]) -> List[Segment]:
+        if segments:
+            cut = segments[-1][1] - self.base
+            if cut:
+                self._chunks.append(self._pending[:cut])
+                self._offsets.append(self.base)
+                self._pending = self._pending[cut:]
+                self.base += cut
+        return segments
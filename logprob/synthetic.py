@@ -0,0 +1,190 @@
+"""Generatore deterministico di risposte sintetiche con logprobs.
+
+Produce risposte nello stesso formato delle chat completions dell'API
+OpenAI (testo, token con logprob, bytes e top_logprobs, usage), con testo
+markdown realistico: titoli, paragrafi, elenchi puntati e numerati,
+grassetti e testo multibyte (accenti, CJK, emoji). A parità di seed e di
+numero di token il risultato è sempre identico, quindi può essere usato
+per benchmark confrontabili tra commit e per il server di prova.
+
+Esempio:
+
+    from logprob.synthetic import generate_completion
+    data = generate_completion(10000, seed=1)
+    tokens = data['choices'][0]['logprobs']['content']
+"""
+import math
+import random
+import re
+from typing import Any, Dict, List
+
+VOCABULARY = (
+    "il", "la", "di", "che", "e", "un", "una", "per", "con", "non", "sono", "del", "della", "nel",
+    "sito", "scavi", "pilastri", "recinti", "neolitico", "archeologi", "datazione", "radiocarbonio",
+    "struttura", "calcare", "monumentale", "cacciatori", "raccoglitori", "rituale", "società",
+    "città", "perché", "più", "già", "così", "attività", "età", "verità", "qualità", "può",
+    "Göbekli", "Tepe", "Gunung", "Padang", "Şanlıurfa", "Anatolia", "Indonesia", "Giava",
+    "model", "token", "confidence", "naïve", "façade", "Zürich", "São", "Paulo",
+    "東京", "遺跡", "考古学", "🙂", "🏛️", "→", "≈", "±", "°C", "10.000", "1995", "2014",
+)
+
+CAPITALIZED = ("Il", "La", "Gli", "Le", "Questo", "Secondo", "Durante", "Inoltre", "Tuttavia", "Nel")
+
+# Token: spazi iniziali più un pezzo di parola, oppure solo spazi o a capo
+_TOKEN_PIECE = re.compile(r'[ ]?[^\s]{1,4}|\n+|[ \t]+')
+
+# Dimensione media di un token in caratteri, usata per stimare la lunghezza del testo
+_CHARS_PER_TOKEN = 3.2
+
+
+def _sentence(rnd: random.Random) -> str:
+    words = [rnd.choice(CAPITALIZED)]
+    words.extend(rnd.choice(VOCABULARY) for _ in range(rnd.randint(5, 18)))
+    if rnd.random() < 0.15:
+        i = rnd.randrange(1, len(words))
+        words[i] = f"**{words[i]}**"
+    if rnd.random() < 0.2:
+        words[rnd.randrange(1, len(words))] += ","
+    return " ".join(words) + rnd.choice(".......!?")
+
+
+def _section(rnd: random.Random, number: int) -> str:
+    lines = [f"{'#' * rnd.randint(2, 3)} Sezione {number}: {rnd.choice(VOCABULARY)} {rnd.choice(VOCABULARY)}", ""]
+    lines.append(" ".join(_sentence(rnd) for _ in range(rnd.randint(2, 5))))
+    lines.append("")
+
+    if rnd.random() < 0.7:
+        numbered = rnd.random() < 0.3
+        for i in range(rnd.randint(2, 6)):
+            marker = f"{i + 1}." if numbered else "-"
+            lines.append(f"{marker} {_sentence(rnd)}")
+        lines.append("")
+
+    if rnd.random() < 0.5:
+        lines.append(" ".join(_sentence(rnd) for _ in range(rnd.randint(1, 4))))
+        lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+def generate_text(n_chars: int, seed: int = 0) -> str:
+    """Testo markdown di almeno n_chars caratteri."""
+    rnd = random.Random(seed)
+    sections = []
+    length = 0
+    while length < n_chars:
+        section = _section(rnd, len(sections) + 1)
+        sections.append(section)
+        length += len(section)
+    return "".join(sections)
+
+
+def _logprob(rnd: random.Random) -> float:
+    # Distribuzione tipica: quasi tutti i token sono molto probabili,
+    # alcuni incerti e pochi molto improbabili
+    roll = rnd.random()
+    if roll < 0.8:
+        return -rnd.expovariate(60)
+    if roll < 0.95:
+        return -rnd.expovariate(2.5)
+    return -rnd.uniform(1.5, 7.0)
+
+
+def _alternative_logprobs(rnd: random.Random, logprob: float, count: int) -> List[float]:
+    """Logprob di `count` alternative al token scelto, dalla più probabile.
+
+    Le alternative si dividono una parte casuale della probabilità lasciata
+    dal token scelto (il resto va al resto del vocabolario) e nessuna lo
+    supera: la massa delle top-k, token scelto compreso, resta al più 1.
+    """
+    chosen = math.exp(logprob)
+    remaining = (1.0 - chosen) * rnd.uniform(0.5, 1.0)
+    weights = [rnd.random() + 0.001 for _ in range(count)]
+    total = sum(weights)
+    shares = sorted((min(chosen, remaining * weight / total) for weight in weights), reverse=True)
+    return [math.log(max(share, 1e-300)) for share in shares]
+
+
+def _split_character(piece: str) -> List[bytes]:
+    """Byte del pezzo divisi dopo il primo byte del suo primo carattere multibyte."""
+    for i, char in enumerate(piece):
+        if ord(char) >= 0x80:
+            data = piece.encode('utf-8')
+            cut = len(piece[:i].encode('utf-8')) + 1
+            return [data[:cut], data[cut:]]
+    return [piece.encode('utf-8')]
+
+
+def generate_tokens(n_tokens: int, seed: int = 0, top_logprobs: int = 1,
+                    split_characters: bool = False) -> List[Dict[str, Any]]:
+    """Restituisce esattamente n_tokens token nel formato dell'API.
+
+    Con split_characters i pezzi che contengono caratteri multibyte
+    vengono divisi in due token a metà di un carattere, come fa il
+    tokenizzatore con i caratteri rari: il campo `bytes` resta esatto,
+    mentre il testo dei token riporta i byte incompleti come sequenze di
+    escape (\\xNN).
+    """
+    rnd = random.Random(seed + 1)
+    text = generate_text(int(n_tokens * _CHARS_PER_TOKEN) + 200, seed)
+    while True:
+        pieces = _TOKEN_PIECE.findall(text)
+        if len(pieces) >= n_tokens:
+            break
+        text += generate_text(int((n_tokens - len(pieces)) * _CHARS_PER_TOKEN) + 200, seed + len(text))
+
+    chunks: List[bytes] = []
+    for piece in pieces:
+        if len(chunks) == n_tokens:
+            break
+        parts = _split_character(piece) if split_characters else [piece.encode('utf-8')]
+        if len(chunks) + len(parts) > n_tokens:
+            # L'ultimo token non lascia caratteri incompleti
+            parts = [piece.encode('utf-8')]
+        chunks.extend(parts)
+
+    tokens = []
+    for chunk in chunks:
+        piece = chunk.decode('utf-8', errors='backslashreplace')
+        logprob = _logprob(rnd)
+        token = {'token': piece, 'logprob': logprob, 'bytes': list(chunk)}
+        alternatives = [{'token': piece, 'logprob': logprob, 'bytes': token['bytes']}]
+        if top_logprobs > 1:
+            for alternative_logprob in _alternative_logprobs(rnd, logprob, top_logprobs - 1):
+                alternative = " " + rnd.choice(VOCABULARY)
+                alternatives.append({
+                    'token': alternative,
+                    'logprob': alternative_logprob,
+                    'bytes': list(alternative.encode('utf-8')),
+                })
+        token['top_logprobs'] = alternatives[:top_logprobs]
+        tokens.append(token)
+    return tokens
+
+
+def completion_text(tokens: List[Dict[str, Any]]) -> str:
+    """Testo della risposta, ricostruito dai byte dei token."""
+    return b"".join(bytes(token['bytes']) for token in tokens).decode('utf-8')
+
+
+def generate_completion(n_tokens: int, seed: int = 0, top_logprobs: int = 1,
+                        model: str = "gpt-4o-synthetic", split_characters: bool = False) -> Dict[str, Any]:
+    """Risposta completa di chat completion con n_tokens token di output."""
+    tokens = generate_tokens(n_tokens, seed, top_logprobs, split_characters)
+    prompt_tokens = 32
+    return {
+        'id': f"chatcmpl-synthetic-{seed}-{n_tokens}",
+        'object': "chat.completion",
+        'created': 0,
+        'model': model,
+        'choices': [{
+            'index': 0,
+            'message': {'role': "assistant", 'content': completion_text(tokens)},
+            'logprobs': {'content': tokens},
+            'finish_reason': "stop",
+        }],
+        'usage': {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': n_tokens,
+            'total_tokens': prompt_tokens + n_tokens,
+        },
+    }
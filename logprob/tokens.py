@@ -0,0 +1,372 @@
+"""Rappresentazione colonnare dei token di una risposta."""
+import codecs
+import itertools
+import struct
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from logprob.uncertainty import UNCERTAINTY_FIELDS, token_uncertainty
+
+# Intestazione di to_bytes(): numero di token, alternative per token, byte del testo
+_BYTES_HEADER = struct.Struct("<QQQ")
+
+
+def alternatives_matrix(counts: Sequence[int], logprobs: Iterable[float]) -> Optional[np.ndarray]:
+    """Matrice densa (token x k) delle logprob delle alternative top-k.
+
+    `counts[i]` è il numero di alternative del token i e `logprobs` contiene
+    le logprob di tutte le alternative, token dopo token. Le righe più corte
+    vengono completate con NaN. Restituisce None se nessun token ha almeno
+    due alternative (con k = 1 l'unica alternativa è il token scelto).
+    """
+    counts = np.asarray(counts, dtype=np.intp)
+    width = int(counts.max()) if len(counts) else 0
+    if width < 2:
+        return None
+    total = int(counts.sum())
+    values = np.fromiter(logprobs, dtype=np.float64, count=total)
+    rows = np.repeat(np.arange(len(counts)), counts)
+    starts = np.cumsum(counts) - counts
+    matrix = np.full((len(counts), width), np.nan)
+    matrix[rows, np.arange(total) - starts[rows]] = values
+    return matrix
+
+
+def utf8_char_offsets(data: bytes, byte_offsets: np.ndarray) -> np.ndarray:
+    """Offset in caratteri corrispondenti agli offset in byte di un testo UTF-8 valido.
+
+    Ogni byte che non è di continuazione (10xxxxxx) inizia un carattere: la
+    somma cumulativa di questi byte dà il numero di caratteri prima di ogni
+    posizione. Un offset a metà di un carattere viene portato alla fine del
+    carattere, che resta così al token che ne contiene il primo byte.
+    """
+    leads = np.zeros(len(data) + 1, dtype=np.int64)
+    np.cumsum((np.frombuffer(data, dtype=np.uint8) & 0xC0) != 0x80, out=leads[1:])
+    return leads[byte_offsets]
+
+
+def _grow(column: np.ndarray, capacity: int) -> np.ndarray:
+    """Colonna con almeno `capacity` righe che conserva quelle già presenti."""
+    if len(column) >= capacity:
+        return column
+    grown = np.empty((capacity,) + column.shape[1:])
+    grown[:len(column)] = column
+    return grown
+
+
+def _lead_bytes(data: bytes) -> int:
+    # Caratteri che iniziano in `data` (byte che non sono di continuazione)
+    return sum(1 for byte in data if byte & 0xC0 != 0x80)
+
+
+def token_alternatives(token: Dict[str, Any]) -> Optional[List[float]]:
+    """Logprob delle alternative di un token nel formato dell'API, se più di una."""
+    alternatives = token.get('top_logprobs')
+    if not alternatives or len(alternatives) < 2:
+        return None
+    return [alternative['logprob'] for alternative in alternatives]
+
+
+class TokenTable:
+    """Tabella dei token in forma struct-of-arrays.
+
+    Invece di un dizionario per token conserva tre colonne: il testo di
+    tutti i token concatenato, gli offset di inizio di ogni token nel testo
+    (int32, con un elemento finale pari alla lunghezza del testo) e le
+    logprob (float64). Il token i è `text[offsets[i]:offsets[i + 1]]`.
+    Se la risposta contiene le alternative top-k, una matrice (token x k)
+    ne conserva le logprob (vedi logprob.uncertainty).
+
+    La tabella può crescere un token alla volta (streaming): le colonne
+    raddoppiano di capacità quando serve, quindi l'aggiunta è O(1) ammortizzato.
+    Anche confidenze e incertezza, derivate dalle logprob, vengono calcolate
+    solo per i token aggiunti dall'ultima lettura.
+    """
+
+    def __init__(self, capacity: int = 64):
+        self._logprobs = np.empty(capacity, dtype=np.float64)
+        self._offsets = np.zeros(capacity + 1, dtype=np.int32)
+        self._parts: List[str] = []
+        self._size = 0
+        self._top: Optional[np.ndarray] = None
+        # Colonne derivate e numero di righe già calcolate
+        self._confidences = np.empty(0)
+        self._confidences_size = 0
+        self._uncertainty = np.empty((0, len(UNCERTAINTY_FIELDS)))
+        self._uncertainty_size = 0
+        # Decodificatore dei token aggiunti come byte: conserva i caratteri incompleti
+        self._decoder = None
+
+    @classmethod
+    def from_arrays(cls, text: str, offsets: Sequence[int], logprobs: Sequence[float],
+                    top_logprobs: Optional[np.ndarray] = None) -> "TokenTable":
+        """Costruisce la tabella da colonne già pronte."""
+        table = cls(0)
+        table._offsets = np.ascontiguousarray(offsets, dtype=np.int32)
+        table._logprobs = np.ascontiguousarray(logprobs, dtype=np.float64)
+        if top_logprobs is not None:
+            table._top = np.ascontiguousarray(top_logprobs, dtype=np.float64)
+        table._parts = [text]
+        table._size = len(table._logprobs)
+        return table
+
+    @classmethod
+    def from_texts(cls, texts: Sequence[str], logprobs: Iterable[float],
+                   top_logprobs: Optional[np.ndarray] = None) -> "TokenTable":
+        """Costruisce la tabella dai testi dei token e dalle logprob, nello stesso ordine."""
+        count = len(texts)
+        offsets = np.zeros(count + 1, dtype=np.int32)
+        np.cumsum(np.fromiter(map(len, texts), dtype=np.int32, count=count), out=offsets[1:])
+        return cls.from_arrays("".join(texts), offsets, np.fromiter(logprobs, dtype=np.float64, count=count),
+                               top_logprobs)
+
+    @classmethod
+    def from_token_bytes(cls, texts: Sequence[str], byte_lists: Sequence[Optional[Sequence[int]]],
+                         logprobs: Iterable[float], top_logprobs: Optional[np.ndarray] = None) -> "TokenTable":
+        """Costruisce la tabella dai byte UTF-8 dei token (il campo `bytes` dell'API).
+
+        I testi dei token non bastano quando un carattere multibyte è diviso
+        tra più token: l'API li riporta come sequenze di escape o caratteri
+        di sostituzione. Il testo viene invece ricostruito decodificando
+        tutti i byte insieme e gli offset dei token convertiti da byte a
+        caratteri (utf8_char_offsets): ogni carattere appartiene al token che
+        ne contiene il primo byte, quelli con soli byte di continuazione
+        restano vuoti. Se manca qualche `bytes` o i byte non sono UTF-8
+        valido si usano i testi dei token, come in from_texts.
+        """
+        count = len(byte_lists)
+        if any(data is None for data in byte_lists):
+            return cls.from_texts(texts, logprobs, top_logprobs)
+        byte_offsets = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum(np.fromiter(map(len, byte_lists), dtype=np.int64, count=count), out=byte_offsets[1:])
+        # Le rappresentazioni dei byte incompleti sono sempre più lunghe dei
+        # byte stessi: se le lunghezze coincidono i testi sono già esatti
+        if len("".join(texts).encode('utf-8', errors='surrogatepass')) == byte_offsets[-1]:
+            return cls.from_texts(texts, logprobs, top_logprobs)
+        data = np.fromiter(itertools.chain.from_iterable(byte_lists), dtype=np.uint8,
+                           count=int(byte_offsets[-1])).tobytes()
+        try:
+            text = data.decode('utf-8')
+        except UnicodeDecodeError:
+            return cls.from_texts(texts, logprobs, top_logprobs)
+        return cls.from_arrays(text, utf8_char_offsets(data, byte_offsets),
+                               np.fromiter(logprobs, dtype=np.float64, count=count), top_logprobs)
+
+    @classmethod
+    def from_tokens(cls, tokens: Sequence[Dict[str, Any]]) -> "TokenTable":
+        """Converte la lista di token restituita dall'API ({'token', 'logprob', 'bytes', 'top_logprobs', ...})."""
+        alternatives = [token.get('top_logprobs') or () for token in tokens]
+        top = alternatives_matrix([len(items) for items in alternatives],
+                                  (item['logprob'] for items in alternatives for item in items))
+        return cls.from_token_bytes([token['token'] for token in tokens], [token.get('bytes') for token in tokens],
+                                    (token['logprob'] for token in tokens), top)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "TokenTable":
+        """Inverso di to_dict()."""
+        top = data.get('top_logprobs')
+        return cls.from_texts(data['tokens'], data['logprobs'],
+                              np.array(top, dtype=np.float64) if top is not None else None)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "TokenTable":
+        """Inverso di to_bytes(); le colonne numeriche sono viste sul buffer, senza copie."""
+        count, width, size = _BYTES_HEADER.unpack_from(data)
+        position = _BYTES_HEADER.size
+        logprobs = np.frombuffer(data, dtype=np.float64, count=count, offset=position)
+        position += 8 * count
+        top = None
+        if width:
+            top = np.frombuffer(data, dtype=np.float64, count=count * width, offset=position).reshape(count, width)
+            position += 8 * count * width
+        offsets = np.frombuffer(data, dtype=np.int32, count=count + 1, offset=position)
+        position += 4 * (count + 1)
+        text = data[position:position + size].decode('utf-8', errors='surrogatepass')
+        return cls.from_arrays(text, offsets, logprobs, top)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, token: str, logprob: float, alternatives: Optional[Sequence[float]] = None) -> None:
+        """Aggiunge un token in coda, con le logprob delle eventuali alternative top-k.
+
+        La larghezza della matrice delle alternative è fissata dal primo
+        token che le contiene: le righe più lunghe vengono troncate, quelle
+        più corte (e i token senza alternative) completate con NaN.
+        """
+        if self._decoder is not None:
+            # Un carattere rimasto incompleto dai token precedenti diventa U+FFFD
+            self._parts.append(self._decoder.decode(b"", final=True))
+        self._append(token, len(token), logprob, alternatives)
+
+    def append_bytes(self, data: bytes, logprob: float, alternatives: Optional[Sequence[float]] = None) -> str:
+        """Aggiunge un token dai suoi byte UTF-8 e restituisce il testo aggiunto.
+
+        Come in from_token_bytes, il token occupa i caratteri che iniziano
+        nei suoi byte; il testo di un carattere diviso tra più token compare
+        però solo quando arriva il suo ultimo byte, quindi il testo
+        restituito (quello da accodare in streaming) può differire dal
+        token.
+        """
+        if self._decoder is None:
+            self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        piece = self._decoder.decode(data)
+        self._append(piece, _lead_bytes(data), logprob, alternatives)
+        return piece
+
+    def append_token(self, token: Dict[str, Any]) -> str:
+        """Aggiunge un token nel formato dell'API, dai byte se presenti; restituisce il testo aggiunto."""
+        data = token.get('bytes')
+        if data is not None:
+            return self.append_bytes(bytes(data), token['logprob'], token_alternatives(token))
+        self.append(token['token'], token['logprob'], token_alternatives(token))
+        return token['token']
+
+    def _append(self, piece: str, length: int, logprob: float, alternatives: Optional[Sequence[float]]) -> None:
+        if self._size == len(self._logprobs):
+            capacity = max(64, 2 * self._size)
+            self._logprobs = np.resize(self._logprobs, capacity)
+            self._offsets = np.resize(self._offsets, capacity + 1)
+            if self._top is not None:
+                top = np.full((capacity, self._top.shape[1]), np.nan)
+                top[:self._size] = self._top[:self._size]
+                self._top = top
+        if alternatives is not None and self._top is None:
+            self._top = np.full((len(self._logprobs), len(alternatives)), np.nan)
+        if self._top is not None:
+            row = self._top[self._size]
+            row[:] = np.nan
+            if alternatives is not None:
+                width = min(len(alternatives), len(row))
+                row[:width] = alternatives[:width]
+        self._logprobs[self._size] = logprob
+        self._offsets[self._size + 1] = self._offsets[self._size] + length
+        self._parts.append(piece)
+        self._size += 1
+
+    def extend(self, tokens: Iterable[Dict[str, Any]]) -> None:
+        """Aggiunge in coda token nel formato dell'API."""
+        for token in tokens:
+            self.append_token(token)
+
+    @property
+    def text(self) -> str:
+        """Testo completo ricostruito dai token."""
+        # I pezzi vengono uniti solo quando il testo serve davvero
+        if len(self._parts) != 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0]
+
+    @property
+    def offsets(self) -> np.ndarray:
+        """Offset di inizio dei token (n + 1 elementi)."""
+        return self._offsets[:self._size + 1]
+
+    @property
+    def logprobs(self) -> np.ndarray:
+        """Logprob dei token."""
+        return self._logprobs[:self._size]
+
+    @property
+    def confidences(self) -> np.ndarray:
+        """Confidenza percentuale dei token, calcolata in forma vettoriale solo per i token nuovi."""
+        done = self._confidences_size
+        if done < self._size:
+            self._confidences = _grow(self._confidences, len(self._logprobs))
+            self._confidences[done:self._size] = np.exp(self._logprobs[done:self._size]) * 100
+            self._confidences_size = self._size
+        return self._confidences[:self._size]
+
+    @property
+    def top_logprobs(self) -> Optional[np.ndarray]:
+        """Matrice (token x k) delle logprob delle alternative, o None se la risposta non le contiene."""
+        return self._top[:self._size] if self._top is not None else None
+
+    @property
+    def uncertainty(self) -> Optional[np.ndarray]:
+        """Entropia, margine e massa delle alternative per token (vedi logprob.uncertainty).
+
+        Calcolate in forma vettoriale solo per i token nuovi, così lo streaming
+        resta lineare; None senza alternative.
+        """
+        if self._top is None:
+            return None
+        done = self._uncertainty_size
+        if done < self._size:
+            self._uncertainty = _grow(self._uncertainty, len(self._logprobs))
+            self._uncertainty[done:self._size] = token_uncertainty(self._top[done:self._size])
+            self._uncertainty_size = self._size
+        return self._uncertainty[:self._size]
+
+    def utf8(self) -> Tuple[bytes, np.ndarray]:
+        """Testo in UTF-8 e offset in byte di inizio dei token (n + 1 elementi, int32).
+
+        La lunghezza in byte di ogni carattere si ricava dal code point in
+        forma vettoriale; eventuali surrogati isolati diventano "?".
+        """
+        text = self.text
+        code_points = np.frombuffer(text.encode('utf-32-le', errors='replace'), dtype=np.uint32)
+        char_bytes = 1 + (code_points >= 0x80) + (code_points >= 0x800) + (code_points >= 0x10000)
+        char_offsets = np.zeros(len(code_points) + 1, dtype=np.int64)
+        np.cumsum(char_bytes, out=char_offsets[1:])
+        return text.encode('utf-8', errors='replace'), char_offsets[self.offsets].astype(np.int32)
+
+    def token(self, i: int) -> str:
+        """Testo del token i."""
+        return self.text[self._offsets[i]:self._offsets[i + 1]]
+
+    def token_texts(self, first: int = 0, last: int = None) -> List[str]:
+        """Testi dei token nell'intervallo [first, last)."""
+        last = self._size if last is None else last
+        text = self.text
+        bounds = self._offsets[first:last + 1].tolist()
+        return [text[bounds[i]:bounds[i + 1]] for i in range(len(bounds) - 1)]
+
+    def iter_tokens(self) -> Iterator[Dict[str, Any]]:
+        """Token nel formato dell'API ({'token', 'logprob'}).
+
+        Se la tabella ha le alternative top-k, 'top_logprobs' ne riporta le
+        sole logprob: i testi delle alternative non vengono conservati.
+        """
+        top = self._top_lists()
+        for i, (token, logprob) in enumerate(zip(self.token_texts(), self.logprobs.tolist())):
+            if top is None:
+                yield {'token': token, 'logprob': logprob}
+            else:
+                yield {'token': token, 'logprob': logprob,
+                       'top_logprobs': [{'logprob': value} for value in top[i] if value is not None]}
+
+    def _top_lists(self) -> Optional[List[List[Optional[float]]]]:
+        # Righe della matrice delle alternative con None al posto di NaN (non valido in JSON)
+        top = self.top_logprobs
+        if top is None:
+            return None
+        values = top.astype(object)
+        values[np.isnan(top)] = None
+        return values.tolist()
+
+    def to_bytes(self) -> bytes:
+        """Forma binaria compatta: le colonne così come sono in memoria, più il testo in UTF-8.
+
+        Serve per passare la tabella ad altri processi (vedi logprob.offload)
+        senza serializzare un oggetto per token: logprob, eventuale matrice
+        delle alternative e offset (allineati a 8 e 4 byte) seguiti dal testo.
+        """
+        top = self.top_logprobs
+        text = self.text.encode('utf-8', errors='surrogatepass')
+        parts = [_BYTES_HEADER.pack(self._size, top.shape[1] if top is not None else 0, len(text)),
+                 self.logprobs.tobytes()]
+        if top is not None:
+            parts.append(top.tobytes())
+        parts.append(self.offsets.tobytes())
+        parts.append(text)
+        return b"".join(parts)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Forma serializzabile in JSON (testi dei token, logprob ed eventuali alternative)."""
+        data = {'tokens': self.token_texts(), 'logprobs': self.logprobs.tolist()}
+        top = self._top_lists()
+        if top is not None:
+            data['top_logprobs'] = top
+        return data
@@ -0,0 +1,225 @@
+"""Livello di trasporto HTTP condiviso verso l'API OpenAI.
+
+Tutte le chiamate passano da un'unica `requests.Session` con pool di
+connessioni keep-alive, timeout espliciti di connessione e lettura e
+retry con backoff esponenziale (con jitter) che rispetta `Retry-After`.
+Le POST non sono idempotenti (una completion già generata verrebbe pagata
+due volte): vengono ritentate solo se la connessione non si è stabilita o
+per gli stati 429 e 5xx, mai dopo un timeout di lettura. Tutti i tentativi
+devono stare entro un tempo complessivo massimo.
+
+Il dimensionamento si configura con `configure()` oppure con le variabili
+d'ambiente:
+
+- LOGPROB_API_BASE: URL base dell'API, ad esempio quello del server di prova
+  locale di logprob.mock_server (default https://api.openai.com/v1)
+- LOGPROB_POOL_CONNECTIONS: numero di host distinti tenuti nel pool (default 4)
+- LOGPROB_POOL_MAXSIZE: connessioni aperte per host, da allineare al numero
+  di utenti concorrenti (default 16)
+- LOGPROB_CONNECT_TIMEOUT / LOGPROB_READ_TIMEOUT: secondi (default 5 / 120)
+- LOGPROB_MAX_RETRIES: tentativi aggiuntivi dopo il primo (default 3)
+- LOGPROB_BACKOFF_BASE / LOGPROB_BACKOFF_MAX: secondi (default 0.5 / 30)
+- LOGPROB_RETRY_DEADLINE: secondi complessivi oltre i quali non si ritenta
+  più e la lettura viene interrotta (default 180)
+
+`requests` viene importato alla prima richiesta, non all'import del modulo:
+chi analizza risposte già salvate non ne paga il tempo di avvio.
+"""
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass, field, replace
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+from logprob.metrics import API_RETRIES
+
+if TYPE_CHECKING:  # pragma: no cover
+    import requests
+
+API_BASE = "https://api.openai.com/v1"
+
+# Stati per cui ha senso ripetere la richiesta
+RETRY_STATUSES = frozenset({408, 409, 429, 500, 502, 503, 504})
+
+# Stati per cui si ripete anche una richiesta non idempotente
+POST_RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# Metodi che si possono ripetere senza effetti collaterali
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+@dataclass(frozen=True)
+class TransportSettings:
+    """URL base dell'API e parametri del pool di connessioni, dei timeout e dei retry."""
+    api_base: str = field(default_factory=lambda: os.environ.get("LOGPROB_API_BASE") or API_BASE)
+    pool_connections: int = field(default_factory=lambda: _env_int("LOGPROB_POOL_CONNECTIONS", 4))
+    pool_maxsize: int = field(default_factory=lambda: _env_int("LOGPROB_POOL_MAXSIZE", 16))
+    connect_timeout: float = field(default_factory=lambda: _env_float("LOGPROB_CONNECT_TIMEOUT", 5.0))
+    read_timeout: float = field(default_factory=lambda: _env_float("LOGPROB_READ_TIMEOUT", 120.0))
+    max_retries: int = field(default_factory=lambda: _env_int("LOGPROB_MAX_RETRIES", 3))
+    backoff_base: float = field(default_factory=lambda: _env_float("LOGPROB_BACKOFF_BASE", 0.5))
+    backoff_max: float = field(default_factory=lambda: _env_float("LOGPROB_BACKOFF_MAX", 30.0))
+    retry_deadline: float = field(default_factory=lambda: _env_float("LOGPROB_RETRY_DEADLINE", 180.0))
+
+
+_lock = threading.Lock()
+_settings = TransportSettings()
+_session: Optional["requests.Session"] = None
+
+
+def configure(**overrides: Any) -> TransportSettings:
+    """Aggiorna i parametri del trasporto; la sessione viene ricreata al prossimo uso."""
+    global _settings, _session
+    with _lock:
+        _settings = replace(_settings, **overrides)
+        if _session is not None:
+            _session.close()
+            _session = None
+        return _settings
+
+
+def get_settings() -> TransportSettings:
+    """Restituisce i parametri correnti del trasporto."""
+    return _settings
+
+
+def get_session() -> "requests.Session":
+    """Restituisce la sessione condivisa, creandola al primo utilizzo."""
+    global _session
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            # I retry sono gestiti da request(), non dall'adapter
+            adapter = HTTPAdapter(
+                pool_connections=_settings.pool_connections,
+                pool_maxsize=_settings.pool_maxsize,
+                max_retries=0,
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def retry_after_seconds(response: "requests.Response") -> Optional[float]:
+    """Legge il ritardo suggerito dal server (`retry-after-ms` o `Retry-After`)."""
+    value = response.headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    # Retry-After può anche essere una data HTTP
+    import email.utils
+
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if parsed is None:
+        return None
+    return max(0.0, parsed.timestamp() - time.time())
+
+
+def backoff_delay(attempt: int, settings: TransportSettings) -> float:
+    """Backoff esponenziale con full jitter per il tentativo indicato (da 0)."""
+    return random.uniform(0, min(settings.backoff_max, settings.backoff_base * (2 ** attempt)))
+
+
+def connect_failed(error: Exception) -> bool:
+    """Vero se l'errore è avvenuto prima che la richiesta arrivasse al server."""
+    import requests
+    from urllib3.exceptions import NewConnectionError
+
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.ConnectionError) or not error.args:
+        return False
+    # Con i retry dell'adapter disattivati urllib3 incapsula l'errore in MaxRetryError
+    return isinstance(getattr(error.args[0], "reason", error.args[0]), NewConnectionError)
+
+
+def request(method: str, path: str, api_key: str, json: Optional[Dict[str, Any]] = None,
+            stream: bool = False) -> "requests.Response":
+    """Esegue una richiesta all'API con timeout e retry.
+
+    Per i metodi idempotenti vengono ritentati gli errori di rete e gli stati
+    in RETRY_STATUSES; per gli altri solo le connessioni non riuscite e gli
+    stati in POST_RETRY_STATUSES. I retry si fermano dopo `max_retries`
+    tentativi aggiuntivi o quando l'attesa sforerebbe `retry_deadline`;
+    a quel punto viene restituita l'ultima risposta (o sollevata l'ultima
+    eccezione) al chiamante.
+    """
+    import requests
+
+    settings = _settings
+    session = get_session()
+    headers = {"Authorization": f"Bearer {api_key}"}
+    url = settings.api_base.rstrip("/") + path
+    idempotent = method.upper() in IDEMPOTENT_METHODS
+    statuses = RETRY_STATUSES if idempotent else POST_RETRY_STATUSES
+    deadline = time.monotonic() + settings.retry_deadline
+
+    attempt = 0
+    while True:
+        # La lettura non deve superare il tempo complessivo rimasto
+        remaining = max(deadline - time.monotonic(), 0.001)
+        try:
+            response = session.request(
+                method,
+                url,
+                headers=headers,
+                json=json,
+                stream=stream,
+                timeout=(min(settings.connect_timeout, remaining), min(settings.read_timeout, remaining)),
+            )
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt >= settings.max_retries or not (idempotent or connect_failed(e)):
+                raise
+            delay = backoff_delay(attempt, settings)
+            if time.monotonic() + delay >= deadline:
+                raise
+            API_RETRIES.inc(reason="timeout" if isinstance(e, requests.Timeout) else "connection")
+            time.sleep(delay)
+            attempt += 1
+            continue
+
+        if response.status_code not in statuses or attempt >= settings.max_retries:
+            return response
+
+        delay = retry_after_seconds(response)
+        if delay is None:
+            delay = backoff_delay(attempt, settings)
+        else:
+            delay = min(delay, settings.backoff_max)
+        if time.monotonic() + delay >= deadline:
+            return response
+
+        API_RETRIES.inc(reason=str(response.status_code))
+        # Restituisce la connessione al pool prima di attendere
+        response.close()
+        time.sleep(delay)
+        attempt += 1
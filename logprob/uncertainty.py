@@ -0,0 +1,44 @@
+"""Misure di incertezza per token calcolate dalle alternative top-k.
+
+Con `top_logprobs` = k l'API restituisce, per ogni token generato, le
+logprob delle k alternative più probabili. Conservate in una matrice densa
+(token x k, con NaN dove mancano alternative) permettono di calcolare con
+poche operazioni vettoriali, senza cicli sui token:
+
+- entropy: entropia in bit della distribuzione delle k alternative
+  rinormalizzata sulla loro massa (0 = una sola alternativa plausibile,
+  log2(k) = alternative equiprobabili)
+- margin: differenza di probabilità tra la prima e la seconda alternativa
+- mass: probabilità complessiva delle k alternative (quanto della
+  distribuzione è visibile)
+"""
+import numpy as np
+
+# Colonne della matrice restituita da token_uncertainty, nell'ordine
+UNCERTAINTY_FIELDS = ("entropy", "margin", "mass")
+
+
+def token_uncertainty(top_logprobs: np.ndarray) -> np.ndarray:
+    """Matrice (token x 3) di entropia, margine e massa delle alternative.
+
+    `top_logprobs` è la matrice (token x k) delle logprob delle alternative,
+    in qualsiasi ordine, con NaN per le alternative mancanti. I token senza
+    alternative danno NaN in tutte le colonne.
+    """
+    # Ordinamento decrescente: i NaN restano in fondo a ogni riga
+    logprobs = -np.sort(-np.asarray(top_logprobs, dtype=np.float64), axis=1)
+    probs = np.nan_to_num(np.exp(logprobs), nan=0.0)
+    mass = probs.sum(axis=1)
+
+    result = np.full((len(probs), len(UNCERTAINTY_FIELDS)), np.nan)
+    valid = mass > 0
+    normalized = probs[valid] / mass[valid, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        plogp = normalized * np.log2(normalized)
+    result[valid, 0] = -np.where(normalized > 0, plogp, 0.0).sum(axis=1)
+    if probs.shape[1] > 1:
+        result[valid, 1] = probs[valid, 0] - probs[valid, 1]
+    else:
+        result[valid, 1] = probs[valid, 0]
+    result[valid, 2] = mass[valid]
+    return result
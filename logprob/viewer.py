@@ -0,0 +1,270 @@
+"""Vista paginata dei risultati per risposte molto lunghe.
+
+Invece di inviare al browser l'HTML dell'intera risposta, il server divide
+i segmenti in pagine di dimensione limitata (in caratteri di testo) e
+invia solo la pagina richiesta come JSON compatto; il browser la disegna
+con VIEWER_JS, comprimendo le sequenze di token, parole o frasi ad
+altissima confidenza in un pulsante che le espande al clic. Dimensione dei
+trasferimenti e memoria del browser restano così costanti al crescere
+della risposta.
+
+Formato di una pagina:
+
+    {"granularity": "token", "page": 1, "pages": 12, "total": 340,
+     "segments": [{"n": 1, "k": "h", "t": [...], "c": [...]}, ...]}
+
+dove "n" è il numero del segmento, "k" il tipo (h = titolo, l = elemento
+di elenco, s = frase) e "c" le confidenze. A livello di token "t" sono i
+testi dei token; a livello di parola alterna testo tra le parole e parole
+(len(t) == 2 * len(c) + 1); a livello di frase contiene il solo testo.
+Se la risposta ha le alternative top-k c'è anche "u": l'entropia in bit di
+ogni token o parola (null dove manca) oppure, per le frasi, entropia,
+margine e massa medi.
+"""
+import json
+from typing import Any, Dict, List
+
+import numpy as np
+
+from logprob.render import (
+    CONFIDENCE_LABELS,
+    CONFIDENCE_THRESHOLDS,
+    GRANULARITY_TITLES,
+    LEGEND_HTML,
+    STYLESHEET,
+)
+
+# Caratteri di testo per pagina
+PAGE_CHARS = 6000
+
+# Lunghezza minima delle sequenze ad altissima confidenza da comprimere:
+# token o parole consecutivi, oppure frasi consecutive
+COLLAPSE_ITEMS = 12
+COLLAPSE_SEGMENTS = 3
+
+KIND_CODES = {'heading': "h", 'list_item': "l", 'sentence': "s"}
+
+
+def page_bounds(segments: List[Dict[str, Any]], max_chars: int = PAGE_CHARS) -> List[int]:
+    """Indici di inizio di ogni pagina, più la fine (len(segments)).
+
+    Le pagine vengono riempite in ordine fino a max_chars caratteri; un
+    segmento più lungo del limite occupa da solo una pagina.
+    """
+    lengths = np.fromiter((len(segment['text']) for segment in segments), dtype=np.int64, count=len(segments))
+    cumulative = np.cumsum(lengths)
+    bounds = [0]
+    while bounds[-1] < len(segments):
+        start = bounds[-1]
+        before = int(cumulative[start - 1]) if start else 0
+        end = int(np.searchsorted(cumulative, before + max_chars, side='right'))
+        bounds.append(max(end, start + 1))
+    return bounds
+
+
+def _rounded(values: Any, digits: int) -> List[Any]:
+    # NaN non è valido in JSON: diventa null
+    values = np.round(np.asarray(values, dtype=np.float64), digits)
+    return [None if value != value else value for value in values.tolist()]
+
+
+def _compact_segment(segment: Dict[str, Any], n: int, granularity: str, table: Any) -> Dict[str, Any]:
+    data = {'n': n, 'k': KIND_CODES.get(segment.get('kind'), "s")}
+
+    if granularity == "token":
+        first, last = segment['token_start'], segment['token_end']
+        data['t'] = table.token_texts(first, last)
+        data['c'] = np.round(table.confidences[first:last], 1).tolist()
+        if table.uncertainty is not None:
+            data['u'] = _rounded(table.uncertainty[first:last, 0], 2)
+    elif granularity == "word":
+        text = segment['text']
+        start = segment['start']
+        pieces = []
+        cursor = 0
+        for word in segment['words']:
+            pieces.append(text[cursor:word['start'] - start])
+            pieces.append(text[word['start'] - start:word['end'] - start])
+            cursor = word['end'] - start
+        pieces.append(text[cursor:])
+        data['t'] = pieces
+        data['c'] = [round(word['confidence'], 1) for word in segment['words']]
+        if 'entropy' in segment['words'][0]:
+            data['u'] = _rounded([word['entropy'] for word in segment['words']], 2)
+    else:
+        data['t'] = [segment['text']]
+        data['c'] = [round(segment['confidence'], 2)]
+        if 'entropy' in segment:
+            data['u'] = _rounded([segment['entropy'], segment['margin'], segment['mass']], 2)
+    return data
+
+
+def build_page(result: Dict[str, Any], page: int = 1, max_chars: int = PAGE_CHARS) -> Dict[str, Any]:
+    """Restituisce la pagina richiesta (numerata da 1) nel formato compatto.
+
+    Il numero di pagina viene riportato nell'intervallo valido.
+    """
+    segments = result['segments']
+    bounds = page_bounds(segments, max_chars)
+    pages = max(1, len(bounds) - 1)
+    page = min(max(1, int(page)), pages)
+    start, end = (bounds[page - 1], bounds[page]) if segments else (0, 0)
+
+    granularity = result['granularity']
+    table = result.get('table')
+    return {
+        'granularity': granularity,
+        'page': page,
+        'pages': pages,
+        'total': len(segments),
+        'segments': [
+            _compact_segment(segments[i], i + 1, granularity, table)
+            for i in range(start, end)
+        ],
+    }
+
+
+VIEWER_STYLE = """<style>
+.lp-result .lp-collapsed { margin: 0 2px; padding: 0 6px; border: 1px dashed #28a745; border-radius: 4px;
+    background: #eafbea; color: #1e7e34; cursor: pointer; font-size: 0.85em; }
+.lp-result .lp-pager { margin: 8px 0; color: #555; font-size: 0.9em; }
+</style>"""
+
+
+def viewer_html(granularity: str) -> str:
+    """Contenitore vuoto in cui VIEWER_JS disegna la pagina corrente."""
+    return (
+        f"{STYLESHEET}{VIEWER_STYLE}"
+        "<div class='lp-result'><h2>Risultati dell'analisi</h2>"
+        f"<h3>{GRANULARITY_TITLES[granularity]}</h3>"
+        "<div class='lp-pager' id='lp-page-info'></div>"
+        "<div id='lp-page'></div>"
+        f"{LEGEND_HTML}</div>"
+    )
+
+
+# Disegna una pagina nel contenitore di viewer_html. Funzione JavaScript da
+# usare come `js=` di un evento Gradio con la pagina come unico input.
+VIEWER_JS = """
+(data) => {
+    const THRESHOLDS = %(thresholds)s;
+    const LABELS = %(labels)s;
+    const COLLAPSE_ITEMS = %(collapse_items)d;
+    const COLLAPSE_SEGMENTS = %(collapse_segments)d;
+    const BLOCKS = {h: 'lp-heading', l: 'lp-item', s: 'lp-segment'};
+    const TOP = THRESHOLDS.length;
+
+    const draw = () => {
+        const root = document.getElementById('lp-page');
+        if (!root) {
+            return false;
+        }
+        const level = (c) => {
+            let l = 0;
+            while (l < TOP && c > THRESHOLDS[l]) l++;
+            return l;
+        };
+        const mark = (text, c, u) => {
+            const span = document.createElement('span');
+            span.className = 'c' + level(c);
+            span.title = c.toFixed(1) + '%%' + (u == null ? '' : ' · H ' + u.toFixed(2) + ' bit');
+            span.textContent = text;
+            return span;
+        };
+        const entropy = (segment, i) => segment.u ? segment.u[i] : null;
+        // Pulsante che al clic viene sostituito dagli elementi che nasconde
+        const collapsed = (count, unit, fill) => {
+            const button = document.createElement('button');
+            button.className = 'lp-collapsed';
+            button.textContent = '⋯ ' + count + ' ' + unit + ' ad altissima confidenza';
+            button.onclick = () => {
+                const fragment = document.createDocumentFragment();
+                fill(fragment);
+                button.replaceWith(fragment);
+            };
+            return button;
+        };
+        // Aggiunge gli elementi 0..count-1, comprimendo le sequenze di almeno
+        // minRun elementi ad altissima confidenza
+        const appendRuns = (parent, count, conf, minRun, unit, add) => {
+            let i = 0;
+            while (i < count) {
+                let j = i;
+                while (j < count && level(conf(j)) === TOP) j++;
+                if (j - i >= minRun) {
+                    const first = i, last = j;
+                    parent.append(collapsed(last - first, unit, (f) => {
+                        for (let k = first; k < last; k++) add(f, k);
+                    }));
+                    i = j;
+                } else {
+                    add(parent, i);
+                    i++;
+                }
+            }
+        };
+        const block = (segment, extra) => {
+            const div = document.createElement('div');
+            div.className = BLOCKS[segment.k] + extra;
+            if (segment.k === 's') {
+                const strong = document.createElement('strong');
+                strong.textContent = 'Segmento ' + segment.n + ':';
+                div.append(strong, ' ');
+            }
+            return div;
+        };
+        const sentence = (segment) => {
+            const c = segment.c[0];
+            const div = block(segment, ' lp-scored c' + level(c));
+            const score = document.createElement('span');
+            score.className = 'lp-score';
+            const u = segment.u;
+            const extra = u && u[0] != null
+                ? ' · entropia ' + u[0].toFixed(2) + ' bit · margine ' + u[1].toFixed(2) + ' · massa ' + u[2].toFixed(2)
+                : '';
+            score.textContent = '(' + c.toFixed(2) + '%% - ' + LABELS[level(c)] + extra + ')';
+            div.append(segment.t[0], score);
+            return div;
+        };
+
+        const fragment = document.createDocumentFragment();
+        const segments = data.segments;
+        if (data.granularity === 'sentence') {
+            appendRuns(fragment, segments.length, (i) => segments[i].c[0], COLLAPSE_SEGMENTS, 'segmenti',
+                       (parent, i) => parent.append(sentence(segments[i])));
+        } else {
+            for (const segment of segments) {
+                const div = block(segment, ' lp-tokens');
+                if (data.granularity === 'token') {
+                    appendRuns(div, segment.c.length, (i) => segment.c[i], COLLAPSE_ITEMS, 'token',
+                               (parent, i) => parent.append(mark(segment.t[i], segment.c[i], entropy(segment, i))));
+                } else {
+                    div.append(segment.t[0]);
+                    appendRuns(div, segment.c.length, (i) => segment.c[i], COLLAPSE_ITEMS, 'parole',
+                               (parent, i) => parent.append(mark(segment.t[2 * i + 1], segment.c[i], entropy(segment, i)),
+                                                            segment.t[2 * i + 2]));
+                }
+                fragment.append(div);
+            }
+        }
+        root.replaceChildren(fragment);
+
+        const info = document.getElementById('lp-page-info');
+        if (info) {
+            info.textContent = 'Pagina ' + data.page + ' di ' + data.pages + ' · ' + data.total + ' segmenti';
+        }
+        return true;
+    };
+
+    // Il contenitore può non essere ancora nel DOM subito dopo l'aggiornamento
+    if (data && data.segments && !draw()) {
+        requestAnimationFrame(draw);
+    }
+    return [];
+}
+""" % {
+    'thresholds': json.dumps(CONFIDENCE_THRESHOLDS),
+    'labels': json.dumps(CONFIDENCE_LABELS),
+    'collapse_items': COLLAPSE_ITEMS,
+    'collapse_segments': COLLAPSE_SEGMENTS,
+}
@@ -1,26 +1,23 @@
-import gradio as gr
-import requests
-import re
-import math
-from typing import List, Dict, Any, Union
+"""Sentence Confidence Analyzer: interfaccia Gradio essenziale sopra il pacchetto logprob.
 
-# Funzioni di utilità
-def logprob_to_confidence(logprob: float) -> float:
-    """Converte logprob in percentuale di confidenza."""
-    return math.exp(logprob) * 100
+gradio viene importato solo da create_interface, così le funzioni di
+analisi restano utilizzabili senza interfaccia.
+"""
+from html import escape
+
+import numpy as np
+from typing import List, Dict, Any, Iterator, Optional, Tuple, Union
 
-def get_confidence_label(confidence: float) -> str:
-    """Restituisce l'etichetta del livello di confidenza."""
-    if confidence > 95:
-        return "Altissima confidenza"
-    if confidence > 85:
-        return "Alta confidenza"
-    if confidence > 70:
-        return "Media confidenza"
-    if confidence > 50:
-        return "Bassa confidenza"
-    return "Molto bassa confidenza"
+from logprob.alignment import SENTENCE_BREAK, AlignmentIndex, split_spans
+from logprob.analysis import logprob_to_confidence
+from logprob.api import APIError, build_payload, request_completion, stream_completion
+from logprob.core import test_api_connection
+from logprob.metrics import StageTimer, start_metrics_server
+from logprob.render import get_confidence_label
+from logprob.streaming import IncrementalSegmenter
+from logprob.tokens import TokenTable
 
+# Funzioni di utilità
 def get_confidence_color(confidence: float) -> str:
     """Restituisce il colore basato sulla confidenza (da rosso a verde)."""
     r = max(0, min(255, round(255 * (1 - confidence / 100))))
@@ -30,66 +27,37 @@ def get_confidence_color(confidence: float) -> str:
 
 def split_into_sentences(text: str) -> List[str]:
     """Divide il testo in frasi."""
-    sentences = re.split(r'(?<=[.!?])\s+', text)
-    return [s for s in sentences if s.strip()]
+    return [text[start:end] for start, end in split_spans(text, SENTENCE_BREAK)]
 
-def group_tokens_into_sentences(text: str, tokens: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def sentence_spans(text: str, start: int = 0) -> List[Tuple[int, int, str]]:
+    """Span (inizio, fine, "sentence") delle frasi a partire dalla posizione start."""
+    return [(span_start, span_end, "sentence") for span_start, span_end in split_spans(text, SENTENCE_BREAK, start)]
+
+def group_tokens_into_sentences(text: str, tokens: Union[TokenTable, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
     """Raggruppa i token in frasi e calcola la confidenza media per ogni frase."""
-    sentences = split_into_sentences(text)
-    sentence_data = []
-    current_token_index = 0
-    
-    for sentence in sentences:
-        if not sentence.strip():
-            continue
-        
-        sentence_tokens = []
-        current_sentence_text = ''
-        found_full_sentence = False
-        
-        while current_token_index < len(tokens) and not found_full_sentence:
-            token = tokens[current_token_index]
-            current_sentence_text += token['token']
-            sentence_tokens.append(token)
-            current_token_index += 1
-            
-            if (sentence in current_sentence_text) or sentence.strip().endswith(current_sentence_text.strip()):
-                found_full_sentence = True
-        
-        if sentence_tokens:
-            avg_logprob = sum(token['logprob'] for token in sentence_tokens) / len(sentence_tokens)
-            confidence = logprob_to_confidence(avg_logprob)
-            
-            sentence_data.append({
-                'text': sentence,
-                'confidence': confidence
-            })
+    # Le frasi vengono cercate nel testo ricostruito dai token, così ogni
+    # span corrisponde esattamente a un intervallo di token
+    index = AlignmentIndex(tokens)
+    spans = split_spans(index.text, SENTENCE_BREAK)
     
-    return sentence_data
-
-# Funzioni principali
-def test_api_connection(api_key: str) -> str:
-    """Testa la connessione all'API OpenAI."""
-    if not api_key:
-        return "❌ Inserisci una API key prima di testare"
+    # Intervalli di token e logprob medie di tutte le frasi in forma vettoriale
+    firsts, lasts = index.token_ranges([start for start, _ in spans], [end for _, end in spans])
+    confidences = np.exp(index.segment_stats(firsts, lasts)[0]) * 100
     
-    try:
-        headers = {
-            "Authorization": f"Bearer {api_key}"
+    return [
+        {
+            'text': index.text[start:end],
+            'confidence': confidence
         }
-        response = requests.get("https://api.openai.com/v1/models", headers=headers)
-        
-        if response.status_code == 200:
-            return "✅ Connessione riuscita! API key valida."
-        else:
-            error_data = response.json()
-            error_message = error_data.get('error', {}).get('message', response.reason)
-            return f"❌ Errore API: {error_message}"
-    except Exception as e:
-        return f"❌ Errore di connessione: {str(e)}"
+        for (start, end), confidence, valid in zip(spans, confidences.tolist(), (firsts < lasts).tolist())
+        if valid
+    ]
 
-def analyze_confidence(api_key: str, model: str, prompt: str) -> Union[List[Dict[str, Any]], Dict[str, str]]:
+# Funzioni principali
+def analyze_confidence(api_key: str, model: str, prompt: str,
+                       timer: Optional[StageTimer] = None) -> Union[List[Dict[str, Any]], Dict[str, str]]:
     """Analizza la confidenza delle frasi generate dal modello."""
+    timer = timer or StageTimer()
     if not api_key:
         return {"error": "Inserisci una API key valida"}
     
@@ -97,85 +65,111 @@ def analyze_confidence(api_key: str, model: str, prompt: str) -> Union[List[Dict
         return {"error": "Inserisci un prompt"}
     
     try:
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}"
-        }
-        
-        payload = {
-            "model": model,
-            "messages": [
-                {
-                    "role": "system",
-                    "content": "You are a helpful assistant providing accurate and detailed information."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            "temperature": 0.7,
-            "logprobs": True,
-            "top_logprobs": 1
-        }
-        
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers=headers,
-            json=payload
-        )
-        
-        if response.status_code != 200:
-            error_data = response.json()
-            error_message = error_data.get('error', {}).get('message', response.reason)
-            return {"error": f"Errore API: {error_message}"}
-        
-        data = response.json()
-        
-        text = data['choices'][0]['message']['content']
-        
-        # Verifica se logprobs sono disponibili
-        if 'logprobs' not in data['choices'][0] or 'content' not in data['choices'][0]['logprobs']:
-            return {"error": "Logprobs non disponibili. Potrebbe essere dovuto alle limitazioni dell'API."}
-        
-        logprobs = data['choices'][0]['logprobs']['content']
+        completion = request_completion(api_key, build_payload(model, prompt), timer=timer)
         
         # Raggruppa i token in frasi
-        sentences = group_tokens_into_sentences(text, logprobs)
-        
-        return sentences
+        with timer.stage("analysis"):
+            return group_tokens_into_sentences(completion.text, completion.tokens)
+    except APIError as e:
+        return {"error": str(e)}
     except Exception as e:
         return {"error": f"Errore: {str(e)}"}
 
+def analyze_confidence_stream(api_key: str, model: str, prompt: str,
+                              timer: Optional[StageTimer] = None) -> Iterator[Union[List[Dict[str, Any]], Dict[str, str]]]:
+    """Analizza la confidenza in streaming, restituendo le frasi concluse man mano che arrivano."""
+    timer = timer or StageTimer()
+    if not api_key:
+        yield {"error": "Inserisci una API key valida"}
+        return
+    
+    if not prompt:
+        yield {"error": "Inserisci un prompt"}
+        return
+    
+    try:
+        tokens = timer.iterate(stream_completion(api_key, build_payload(model, prompt)), "network")
+        
+        index = AlignmentIndex()
+        segmenter = IncrementalSegmenter(sentence_spans)
+        sentences = []
+        
+        def consume(finalized):
+            for start, end, _ in finalized:
+                first, last = index.token_range(start, end)
+                if first < last:
+                    sentences.append({
+                        'text': segmenter.span_text(start, end),
+                        'confidence': logprob_to_confidence(index.mean_logprob(first, last))
+                    })
+            return bool(finalized)
+        
+        for token in tokens:
+            with timer.stage("analysis"):
+                piece = index.append(token)
+                finalized = consume(segmenter.feed(piece))
+            if finalized:
+                yield list(sentences)
+        
+        consume(segmenter.finish())
+        
+        if not len(index):
+            yield {"error": "Logprobs non disponibili. Potrebbe essere dovuto alle limitazioni dell'API."}
+            return
+        
+        yield sentences
+    except APIError as e:
+        yield {"error": str(e)}
+    except Exception as e:
+        yield {"error": f"Errore: {str(e)}"}
+
 def format_results(result: Union[List[Dict[str, Any]], Dict[str, str]]) -> str:
-    """Formatta i risultati dell'analisi in HTML."""
-    if isinstance(result, dict) and "error" in result:
-        return f"<div style='color: red; padding: 10px; border-left: 4px solid red; background-color: #ffeeee;'><strong>Errore:</strong> {result['error']}</div>"
+    """Formatta i risultati dell'analisi in HTML.
     
-    sentences = result
-    html = "<h2>Risultati dell'analisi</h2>"
+    Il testo generato dal modello e i messaggi di errore vengono sottoposti a
+    escape, così non possono inserire markup nella pagina; i pezzi vengono
+    uniti una sola volta alla fine.
+    """
+    if isinstance(result, dict) and "error" in result:
+        return ("<div style='color: red; padding: 10px; border-left: 4px solid red; background-color: #ffeeee;'>"
+                f"<strong>Errore:</strong> {escape(str(result['error']), quote=False)}</div>")
     
-    for i, sentence in enumerate(sentences):
+    parts = ["<h2>Risultati dell'analisi</h2>"]
+    for i, sentence in enumerate(result):
         color = get_confidence_color(sentence['confidence'])
         label = get_confidence_label(sentence['confidence'])
         
-        html += f"""
+        parts.append(f"""
         <div style='margin: 10px 0; padding: 10px; border-radius: 4px; color: {color}; background-color: {color}15; border-left: 4px solid {color};'>
-            <strong>Frase {i + 1}:</strong> {sentence['text']}
+            <strong>Frase {i + 1}:</strong> {escape(sentence['text'], quote=False)}
             <span style='margin-left: 10px; font-size: 0.9em;'>({sentence['confidence']:.2f}% - {label})</span>
         </div>
-        """
+        """)
     
-    return html
+    return "".join(parts)
 
 # Funzioni per Gradio
-def run_analysis(api_key: str, model: str, prompt: str) -> str:
-    """Funzione principale per l'analisi."""
-    result = analyze_confidence(api_key, model, prompt)
-    return format_results(result)
+def run_analysis(api_key: str, model: str, prompt: str, stream: bool = True) -> Iterator[str]:
+    """Funzione principale per l'analisi (aggiorna i risultati durante lo streaming)."""
+    timer = StageTimer()
+    if not stream:
+        result = analyze_confidence(api_key, model, prompt, timer)
+        with timer.stage("render"):
+            html = format_results(result)
+        timer.finish("full")
+        yield html
+        return
+    
+    for result in analyze_confidence_stream(api_key, model, prompt, timer):
+        with timer.stage("render"):
+            html = format_results(result)
+        yield html
+    timer.finish("stream")
 
 # Interfaccia Gradio
 def create_interface():
+    import gradio as gr
+    
     with gr.Blocks(title="Sentence Confidence Analyzer") as app:
         gr.Markdown("# Sentence Confidence Analyzer")
         
@@ -220,13 +214,18 @@ def create_interface():
                 lines=5
             )
         
+        stream_checkbox = gr.Checkbox(
+            value=True,
+            label="Streaming",
+            info="Mostra le frasi man mano che il modello genera la risposta"
+        )
         analyze_btn = gr.Button("Analizza Confidenza")
         results_html = gr.HTML()
         
         # Collegamento per l'analisi con indicatore di caricamento incorporato
         analyze_btn.click(
             run_analysis,
-            inputs=[api_key_input, model_select, prompt_input],
+            inputs=[api_key_input, model_select, prompt_input, stream_checkbox],
             outputs=[results_html],
             show_progress=True
         )
@@ -235,5 +234,7 @@ def create_interface():
 
 # Avvia l'applicazione
 if __name__ == "__main__":
+    # Metriche Prometheus su /metrics se LOGPROB_METRICS_PORT è impostata
+    start_metrics_server()
     app = create_interface()
     app.launch()
@@ -0,0 +1,15 @@
+import pytest
+
+from logprob import transport
+from logprob.mock_server import MockSettings, start_server
+
+
+@pytest.fixture
+def mock_api():
+    """Server di prova (logprob.mock_server) usato come URL base dell'API."""
+    server = start_server(MockSettings(latency=0.3, min_tokens=50, max_tokens=50))
+    previous = transport.get_settings()
+    transport.configure(api_base=server.url)
+    yield server
+    transport.configure(api_base=previous.api_base)
+    server.stop()
@@ -0,0 +1,94 @@
+"""Segmentazione in un'unica passata (logprob.analysis.segment_spans)."""
+import random
+import re
+
+from logprob.analysis import segment_spans
+
+PROSE = [
+    "Un paragrafo introduttivo. Il Dr. Rossi arriva ad es. domani! Poi? Va bene.",
+    "Prima frase.  Seconda frase\nsu due righe. terza in minuscolo. Quarta",
+    "Nessuna punteggiatura finale e nessuna maiuscola. ok. Davvero",
+    "Numeri come 3.14 e 2.5 restano interi. Fine.",
+    "   Spazi iniziali e finali. Restano fuori dagli span.   ",
+]
+
+
+def _legacy_segments(text):
+    # Regole di segment_text, la funzione sostituita, per testo senza titoli
+    # né elenchi: spazi normalizzati e divisione dopo . ! ? seguiti da maiuscola
+    text = re.sub(r'\s+', ' ', text).strip()
+    return [part.strip() for part in re.split(r'(?<=[.!?])\s+(?=[A-Z])', text) if part.strip()]
+
+
+def _texts(text, start=0):
+    return [(text[s:e], kind) for s, e, kind in segment_spans(text, start)]
+
+
+def _random_prose(rnd):
+    words = ["alpha", "beta", "Gamma", "delta", "es.", "Dr.", "3.14", "fine!", "vero?", "x"]
+    sentences = []
+    for _ in range(rnd.randint(1, 12)):
+        sentence = " ".join(rnd.choice(words) for _ in range(rnd.randint(1, 8)))
+        sentences.append(sentence[0].upper() + sentence[1:] + rnd.choice([".", "!", "?", ""]))
+    return rnd.choice([" ", "  ", "\n"]).join(sentences)
+
+
+def test_prose_matches_legacy_segmentation():
+    rnd = random.Random(0)
+    for text in PROSE + [_random_prose(rnd) for _ in range(300)]:
+        spans = segment_spans(text)
+        assert [re.sub(r'\s+', ' ', text[s:e]) for s, e, _ in spans] == _legacy_segments(text), text
+        assert all(kind == "sentence" for _, _, kind in spans)
+
+
+def test_spans_are_stripped_positions_in_the_original_text():
+    for text in PROSE:
+        for start, end, _ in segment_spans(text):
+            assert text[start:end] == text[start:end].strip() != ""
+
+
+def test_headings_and_list_items_are_separate_segments():
+    text = ("# Titolo principale\n"
+            "Un paragrafo. Il Dr. Rossi arriva!\n"
+            "\n"
+            "## Sezione 2\n"
+            "1. primo punto\n"
+            "2) secondo punto. Con due frasi\n"
+            "- voce con trattino\n"
+            "* voce con asterisco\n"
+            "+ voce con più\n"
+            "Testo finale senza punteggiatura")
+    assert _texts(text) == [
+        ("# Titolo principale", "heading"),
+        ("Un paragrafo.", "sentence"),
+        ("Il Dr.", "sentence"),
+        ("Rossi arriva!", "sentence"),
+        ("## Sezione 2", "heading"),
+        ("1. primo punto", "list_item"),
+        ("2) secondo punto. Con due frasi", "list_item"),
+        ("- voce con trattino", "list_item"),
+        ("* voce con asterisco", "list_item"),
+        ("+ voce con più", "list_item"),
+        ("Testo finale senza punteggiatura", "sentence"),
+    ]
+
+
+def test_blank_lines_and_markers_end_sentences():
+    assert _texts("Prima parte senza punto\n\nseconda parte") == [
+        ("Prima parte senza punto", "sentence"), ("seconda parte", "sentence")]
+    assert _texts("Fine frase. - elenco in linea") == [
+        ("Fine frase.", "sentence"), ("- elenco in linea", "sentence")]
+    assert _texts('Disse "basta." Poi uscì.') == [('Disse "basta."', "sentence"), ("Poi uscì.", "sentence")]
+
+
+def test_markers_need_a_line_start_and_a_space():
+    assert _texts("Il valore #1 e -5 restano nella frase. #hashtag\n-trattino") == [
+        ("Il valore #1 e -5 restano nella frase.", "sentence"), ("#hashtag\n-trattino", "sentence")]
+
+
+def test_scan_from_start_uses_line_starts_of_the_full_text():
+    text = "Frase iniziale.\n# Titolo\nAltro testo."
+    start = text.index("#")
+    assert _texts(text, start) == [("# Titolo", "heading"), ("Altro testo.", "sentence")]
+    # A metà riga lo stesso marcatore non è un titolo
+    assert _texts("ab # non titolo", 3) == [("# non titolo", "sentence")]
@@ -0,0 +1,31 @@
+"""Unione delle richieste identiche in corso (logprob.api, logprob.singleflight)."""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from logprob.api import build_payload, request_completion
+
+
+def _request_all(api_keys):
+    payload = build_payload("gpt-4o-mini-2024-07-18", "Parlami di Göbekli Tepe")
+    with ThreadPoolExecutor(len(api_keys)) as pool:
+        return list(pool.map(lambda api_key: request_completion(api_key, payload, use_cache=False), api_keys))
+
+
+def _served(server, expected):
+    # Il server conta la richiesta dopo aver inviato la risposta
+    deadline = time.monotonic() + 2
+    while server.counts.get("200", 0) < expected and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return server.counts.get("200", 0)
+
+
+def test_same_api_key_requests_are_merged(mock_api):
+    completions = _request_all(["sk-a"] * 4)
+    assert len({completion.text for completion in completions}) == 1
+    time.sleep(0.1)
+    assert _served(mock_api, 1) == 1
+
+
+def test_different_api_keys_are_not_merged(mock_api):
+    _request_all(["sk-a", "sk-b"])
+    assert _served(mock_api, 2) == 2
@@ -0,0 +1,46 @@
+"""Cache su disco delle risposte (logprob.cache)."""
+import os
+import time
+
+from logprob import cache
+from logprob.cache import ResponseCache
+
+
+def _fill(response_cache, count):
+    for i in range(count):
+        response_cache.put(f"{i:064x}", {"text": os.urandom(512).hex()})
+
+
+def test_evict_keeps_pending_temporary_files(tmp_path):
+    response_cache = ResponseCache(str(tmp_path), max_bytes=4096, memory_items=0)
+    pending = tmp_path / "ab" / "pending.tmp"
+    pending.parent.mkdir()
+    pending.write_bytes(b"x" * 8192)
+
+    _fill(response_cache, 20)
+    response_cache.evict()
+
+    assert pending.exists()
+    total = sum(os.path.getsize(os.path.join(root, name))
+                for root, _, files in os.walk(tmp_path) for name in files if not name.endswith(".tmp"))
+    assert total <= 4096
+
+
+def test_evict_removes_orphan_temporary_files(tmp_path):
+    response_cache = ResponseCache(str(tmp_path), max_bytes=4096, memory_items=0)
+    orphan = tmp_path / "ab" / "orphan.tmp"
+    orphan.parent.mkdir()
+    orphan.write_bytes(b"x")
+    old = time.time() - cache.TMP_GRACE_SECONDS - 60
+    os.utime(orphan, (old, old))
+
+    response_cache.evict()
+
+    assert not orphan.exists()
+
+
+def test_put_and_get_roundtrip(tmp_path):
+    response_cache = ResponseCache(str(tmp_path), memory_items=0)
+    response_cache.put("cd" * 32, {"choices": [1, 2, 3]})
+    assert response_cache.get("cd" * 32) == {"choices": [1, 2, 3]}
+    assert response_cache.get("ef" * 32) is None
@@ -0,0 +1,73 @@
+"""Accordo tra risposte campionate (logprob.consensus)."""
+import numpy as np
+import pytest
+
+from logprob.consensus import analyze_samples, bag_of_words, best_matches
+from logprob.tokens import TokenTable
+
+
+def _sample(text, logprob):
+    words = text.split(" ")
+    texts = [word if i == 0 else " " + word for i, word in enumerate(words)]
+    return text, TokenTable.from_texts(texts, [logprob] * len(texts))
+
+
+def test_best_matches_agree_with_pairwise_search():
+    rnd = np.random.default_rng(1)
+    counts = [3, 0, 5, 1]
+    vectors = rnd.random((sum(counts), 6)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    reference = vectors[3:8]
+
+    best, index = best_matches(reference, vectors, counts)
+
+    assert best.shape == index.shape == (5, 4)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    for row in range(5):
+        for sample, (start, count) in enumerate(zip(starts, counts)):
+            if count == 0:
+                assert best[row, sample] == -1
+                continue
+            similarity = vectors[start:start + count] @ reference[row]
+            assert index[row, sample] == start + similarity.argmax()
+            assert best[row, sample] == pytest.approx(similarity.max())
+
+
+def test_bag_of_words_rows_have_unit_norm():
+    matrix = bag_of_words(["Il gatto dorme", "il GATTO", ""])
+    np.testing.assert_allclose(np.linalg.norm(matrix, axis=1), [1, 1, 0], atol=1e-6)
+    assert matrix[0] @ matrix[1] == pytest.approx(2 / np.sqrt(6))
+
+
+def test_identical_samples_fully_agree():
+    text = "Il gatto dorme sul divano. La casa è silenziosa."
+    result = analyze_samples([_sample(text, -0.2), _sample(text, -0.1), _sample(text, -0.3)])
+
+    assert result['reference'] == 1
+    assert result['agreement'] == 1.0
+    assert [segment['text'] for segment in result['segments']] == [
+        "Il gatto dorme sul divano.", "La casa è silenziosa."]
+    for segment in result['segments']:
+        assert segment['matches'] == 2
+        assert segment['similarity'] == pytest.approx(1.0)
+        assert segment['consensus_logprob'] == pytest.approx(-0.2)
+    assert set(result['analyses']) == {"token", "word", "sentence"}
+
+
+def test_diverging_sample_lowers_agreement():
+    result = analyze_samples([
+        _sample("Il gatto dorme sul divano. La casa è silenziosa.", -0.1),
+        _sample("Il gatto dorme sul divano. Fuori piove forte.", -0.2),
+        _sample("Oggi il mercato chiude presto.", -0.3),
+    ])
+
+    first, second = result['segments']
+    assert first['agreement'] == 0.5 and first['matches'] == 1
+    assert second['agreement'] == 0.0 and second['matches'] == 0
+    assert second['consensus_logprob'] == pytest.approx(-0.1)
+    assert result['agreement'] == 0.25
+
+
+def test_single_sample_agrees_with_itself():
+    result = analyze_samples([_sample("Una sola risposta.", -0.5)])
+    assert result['samples'] == 1 and result['agreement'] == 1.0
@@ -0,0 +1,65 @@
+"""Decodifica delle risposte con i backend JSON disponibili (logprob.decoding)."""
+import json
+
+import numpy as np
+import pytest
+
+from logprob import decoding
+from logprob.synthetic import generate_completion
+
+
+def _backends(monkeypatch):
+    """Funzioni di decodifica di tutti i backend installati, per nome."""
+    def generic(loads):
+        def decode(body, top_logprobs):
+            monkeypatch.setattr(decoding, "loads", loads)
+            return decoding._decode_generic(body, top_logprobs)
+        return decode
+
+    backends = {"json": generic(json.loads)}
+    if decoding.orjson is not None:
+        backends["orjson"] = generic(decoding.orjson.loads)
+    if decoding.msgspec is not None:
+        backends["msgspec"] = decoding._decode_msgspec
+    return backends
+
+
+def _response(top_logprobs, split_characters, choices=1):
+    data = generate_completion(400, seed=11, top_logprobs=top_logprobs, split_characters=split_characters)
+    data['choices'] = [dict(data['choices'][0], index=i) for i in range(choices)]
+    # Una scelta senza logprobs
+    if choices > 1:
+        data['choices'][-1] = dict(data['choices'][-1], logprobs=None)
+    return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+
+@pytest.mark.parametrize("top_logprobs", [1, 5])
+@pytest.mark.parametrize("split_characters", [False, True])
+def test_backends_produce_identical_tables(monkeypatch, top_logprobs, split_characters):
+    body = _response(top_logprobs, split_characters, choices=3)
+    results = {name: decode(body, top_logprobs > 1) for name, decode in _backends(monkeypatch).items()}
+    expected = results.pop("json")
+    assert expected[0].table.text == expected[0].text
+    assert expected[2].table is None
+
+    for name, decoded in results.items():
+        assert len(decoded) == len(expected), name
+        for got, want in zip(decoded, expected):
+            assert (got.text, got.usage) == (want.text, want.usage), name
+            if want.table is None:
+                assert got.table is None, name
+                continue
+            assert got.table.token_texts() == want.table.token_texts(), name
+            np.testing.assert_array_equal(got.table.offsets, want.table.offsets)
+            np.testing.assert_array_equal(got.table.logprobs, want.table.logprobs)
+            if top_logprobs > 1:
+                np.testing.assert_array_equal(got.table.top_logprobs, want.table.top_logprobs)
+            else:
+                assert got.table.top_logprobs is None
+
+
+@pytest.mark.parametrize("body", [b"{", b"[]", b'{"choices": [{"logprobs": null}]}'])
+def test_invalid_responses_raise_value_error(monkeypatch, body):
+    for name, decode in _backends(monkeypatch).items():
+        with pytest.raises(ValueError):
+            decode(body, False)
@@ -0,0 +1,70 @@
+"""Esportazione Arrow/Parquet e rilettura (logprob.export)."""
+import datetime
+
+import numpy as np
+import pytest
+
+from logprob.analysis import create_confidence_analyses
+from logprob.synthetic import generate_tokens
+
+pa = pytest.importorskip("pyarrow")
+pc = pytest.importorskip("pyarrow.compute")
+
+from logprob.export import export_analysis, file_metadata, read_run, read_table, run_summary  # noqa: E402
+
+TIMESTAMP = datetime.datetime(2026, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc)
+
+
+def _analyses(top_logprobs):
+    tokens = generate_tokens(400, seed=12, top_logprobs=top_logprobs, split_characters=True)
+    return create_confidence_analyses("", tokens)
+
+
+@pytest.mark.parametrize("format", ["arrow", "parquet"])
+@pytest.mark.parametrize("top_logprobs", [1, 5])
+def test_export_round_trip(tmp_path, format, top_logprobs):
+    analyses = _analyses(top_logprobs)
+    result = analyses['word']
+    table = result['table']
+    paths = export_analysis(str(tmp_path), result, "gpt-4o", "Parlami di Göbekli Tepe", format,
+                            run_id="run-1", timestamp=TIMESTAMP)
+
+    tokens = read_run(paths['tokens'])
+    assert tokens.num_rows == len(table)
+    assert tokens['token'].to_pylist() == table.token_texts()
+    np.testing.assert_array_equal(tokens['logprob'].to_numpy(), table.logprobs)
+    np.testing.assert_allclose(tokens['confidence'].to_numpy(), table.confidences)
+    entropy = tokens['entropy'].to_numpy(zero_copy_only=False)
+    if top_logprobs > 1:
+        np.testing.assert_allclose(entropy, table.uncertainty[:, 0])
+    else:
+        assert tokens['entropy'].null_count == len(table)
+
+    # I segmenti di un'analisi a parole vengono ricalcolati a livello di frase
+    segments = read_run(paths['segments'])
+    sentences = analyses['sentence']['segments']
+    assert segments['text'].to_pylist() == [segment['text'] for segment in sentences]
+    assert segments['kind'].to_pylist() == [segment['kind'] for segment in sentences]
+    np.testing.assert_allclose(segments['confidence'].to_numpy(), [segment['confidence'] for segment in sentences])
+
+    metadata = file_metadata(paths['tokens'])
+    assert metadata['run_id'] == "run-1" and metadata['model'] == "gpt-4o" and metadata['kind'] == "tokens"
+    assert metadata['timestamp'] == TIMESTAMP.isoformat()
+
+
+def test_dataset_filters_and_summary_span_runs(tmp_path):
+    first = _analyses(5)['sentence']
+    second = create_confidence_analyses("", generate_tokens(100, seed=3))['sentence']
+    export_analysis(str(tmp_path), first, "gpt-4o", "a", run_id="a", timestamp=TIMESTAMP)
+    export_analysis(str(tmp_path), second, "gpt-4o-mini", "b", "parquet", run_id="b",
+                    timestamp=TIMESTAMP + datetime.timedelta(hours=1))
+
+    assert read_table(str(tmp_path), "tokens").num_rows == 500
+    mini = read_table(str(tmp_path), "tokens", ["token"], filter=pc.field("model") == "gpt-4o-mini")
+    assert mini.num_rows == 100
+
+    summary = run_summary(str(tmp_path)).to_pylist()
+    assert [row['run_id'] for row in summary] == ["a", "b"]
+    assert [row['tokens'] for row in summary] == [400, 100]
+    assert summary[0]['mean_logprob'] == pytest.approx(float(first['table'].logprobs.mean()))
+    assert summary[1]['mean_entropy'] is None
@@ -0,0 +1,49 @@
+"""Storico delle analisi separato per API key (logprob.history)."""
+import sqlite3
+
+from logprob.analysis import create_confidence_analyses
+from logprob.cache import api_key_hash
+from logprob.history import HistoryStore
+from logprob.synthetic import generate_completion
+from logprob.tokens import TokenTable
+
+
+def _result(seed):
+    data = generate_completion(300, seed=seed)
+    table = TokenTable.from_tokens(data['choices'][0]['logprobs']['content'])
+    return {'analyses': create_confidence_analyses(table.text, table)}
+
+
+def test_runs_are_visible_only_to_their_owner(tmp_path):
+    history = HistoryStore(str(tmp_path / "history.sqlite3"))
+    alice, bob = api_key_hash("sk-alice"), api_key_hash("sk-bob")
+    run_id = history.record(_result(1), "gpt-4o", "prompt di alice", alice)
+    history.record(_result(2), "gpt-4o", "prompt di bob", bob)
+
+    assert [run['prompt'] for run in history.runs(alice)] == ["prompt di alice"]
+    assert [run['prompt'] for run in history.runs(bob)] == ["prompt di bob"]
+    assert {row['run_id'] for row in history.low_confidence_segments(alice, 100)} == {run_id}
+    assert history.load_run(run_id, alice) is not None
+    assert history.load_run(run_id, bob) is None
+
+    history.delete_run(run_id, bob)
+    assert history.load_run(run_id, alice) is not None
+    history.close()
+
+
+def test_existing_database_gains_owner_column(tmp_path):
+    path = str(tmp_path / "history.sqlite3")
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE runs (id INTEGER PRIMARY KEY, created REAL NOT NULL, model TEXT NOT NULL,"
+                       " prompt_hash TEXT NOT NULL, prompt TEXT NOT NULL, text TEXT NOT NULL,"
+                       " tokens INTEGER NOT NULL, confidence REAL)")
+    connection.execute("INSERT INTO runs VALUES (1, 0, 'gpt-4o', 'x', 'vecchio prompt', 'testo', 1, 50)")
+    connection.commit()
+    connection.close()
+
+    history = HistoryStore(path)
+    owner = api_key_hash("sk-alice")
+    assert history.runs(owner) == []
+    history.record(_result(3), "gpt-4o", "nuovo prompt", owner)
+    assert [run['prompt'] for run in history.runs(owner)] == ["nuovo prompt"]
+    history.close()
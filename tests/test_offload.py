@@ -0,0 +1,63 @@
+"""Forma binaria della tabella dei token e analisi nel pool di processi (logprob.tokens, logprob.offload)."""
+import numpy as np
+import pytest
+
+from logprob import offload
+from logprob.analysis import create_confidence_analyses
+from logprob.synthetic import generate_tokens
+from logprob.tokens import TokenTable
+
+
+def _assert_same_table(got, want):
+    assert got.text == want.text
+    np.testing.assert_array_equal(got.offsets, want.offsets)
+    np.testing.assert_array_equal(got.logprobs, want.logprobs)
+    if want.top_logprobs is None:
+        assert got.top_logprobs is None
+    else:
+        np.testing.assert_array_equal(got.top_logprobs, want.top_logprobs)
+
+
+@pytest.mark.parametrize("top_logprobs", [1, 5])
+def test_to_bytes_round_trip(top_logprobs):
+    table = TokenTable.from_tokens(generate_tokens(500, seed=13, top_logprobs=top_logprobs, split_characters=True))
+    restored = TokenTable.from_bytes(table.to_bytes())
+    _assert_same_table(restored, table)
+    if top_logprobs > 1:
+        np.testing.assert_array_equal(restored.uncertainty, table.uncertainty)
+
+
+def test_to_bytes_round_trip_of_edge_cases():
+    _assert_same_table(TokenTable.from_bytes(TokenTable().to_bytes()), TokenTable())
+    # Surrogati isolati (testi di token non validi in UTF-8) sopravvivono al viaggio
+    table = TokenTable.from_texts(["a", "\ud83d", "b"], [-0.1, -0.2, -0.3])
+    _assert_same_table(TokenTable.from_bytes(table.to_bytes()), table)
+
+
+def test_table_from_bytes_can_grow():
+    tokens = generate_tokens(30, seed=2, top_logprobs=3)
+    restored = TokenTable.from_bytes(TokenTable.from_tokens(tokens[:20]).to_bytes())
+    restored.uncertainty
+    restored.extend(tokens[20:])
+    _assert_same_table(restored, TokenTable.from_tokens(tokens))
+    np.testing.assert_allclose(restored.uncertainty, TokenTable.from_tokens(tokens).uncertainty)
+
+
+@pytest.fixture
+def pool():
+    previous = offload.get_settings()
+    offload.configure(workers=1, warmup=False, min_tokens=0)
+    yield
+    offload.configure(workers=previous.workers, warmup=previous.warmup, min_tokens=previous.min_tokens)
+
+
+def test_offloaded_analysis_matches_local_analysis(pool):
+    table = TokenTable.from_tokens(generate_tokens(800, seed=14, top_logprobs=5, split_characters=True))
+    remote = offload.analyze_table(table)
+    assert offload.get_pool() is not None
+    local = create_confidence_analyses(table.text, table)
+
+    assert set(remote) == set(local)
+    for granularity, analysis in local.items():
+        assert remote[granularity]['segments'] == analysis['segments']
+        assert remote[granularity]['table'] is table
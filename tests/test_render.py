@@ -0,0 +1,31 @@
+"""Escape del testo generato nell'HTML delle due interfacce (logprob.render, logprob_gradio)."""
+import logprob_gradio
+from logprob.analysis import create_confidence_analyses
+from logprob.render import format_results
+from logprob.tokens import TokenTable
+
+MARKUP = "<img src=x onerror=alert(1)>"
+
+
+def test_basic_frontend_escapes_sentences_and_errors():
+    html = logprob_gradio.format_results([
+        {'text': f"Frase con {MARKUP} dentro.", 'confidence': 91.5},
+        {'text': "Seconda & ultima.", 'confidence': 40.0},
+    ])
+    assert MARKUP not in html
+    assert "&lt;img src=x onerror=alert(1)&gt;" in html
+    assert "Seconda &amp; ultima." in html
+    assert html.count("<strong>Frase ") == 2
+
+    error = logprob_gradio.format_results({"error": f"Errore API: {MARKUP}"})
+    assert MARKUP not in error and "&lt;img" in error
+
+
+def test_advanced_frontend_escapes_segments_and_errors():
+    table = TokenTable.from_texts(["Testo ", MARKUP, " finale."], [-0.1, -0.2, -0.3])
+    analyses = create_confidence_analyses(table.text, table)
+    for granularity, analysis in analyses.items():
+        html = format_results(analysis)
+        assert MARKUP not in html, granularity
+        assert "&lt;" in html and "&gt;" in html, granularity
+    assert MARKUP not in format_results({"error": MARKUP})
@@ -0,0 +1,89 @@
+"""Riallineamento del limitatore per API key al consumo effettivo (gradio2, logprob.serving)."""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import gradio2
+from logprob import api, core, serving
+from logprob.api import APIError, TokenStream
+from logprob.cache import ResponseCache
+from logprob.ratelimit import estimate_tokens
+from logprob.synthetic import generate_tokens
+
+PROMPT = "Parlami di Göbekli Tepe"
+
+
+def _recorded_usage(monkeypatch):
+    calls = []
+    monkeypatch.setenv("LOGPROB_HISTORY", "0")
+    monkeypatch.setattr(serving, "record_usage", lambda api_key, estimated, usage: calls.append((api_key, usage)))
+    return calls
+
+
+def test_streaming_analysis_records_usage(mock_api, monkeypatch):
+    calls = _recorded_usage(monkeypatch)
+    outputs = list(gradio2.run_analysis("sk-a", gradio2.MODEL_CHOICES[0], PROMPT, "sentence",
+                                        stream=True, use_cache=False))
+
+    assert outputs[-1][1] is not None
+    assert calls == [("sk-a", {'prompt_tokens': estimate_tokens(PROMPT, 0), 'completion_tokens': 50,
+                               'total_tokens': estimate_tokens(PROMPT, 0) + 50})]
+
+
+def test_consensus_analysis_records_usage(mock_api, monkeypatch):
+    calls = _recorded_usage(monkeypatch)
+    list(gradio2.run_analysis("sk-a", gradio2.MODEL_CHOICES[0], PROMPT, "sentence", use_cache=False, samples=3))
+
+    assert len(calls) == 1 and calls[0][1]['completion_tokens'] == 150
+
+
+def test_comparison_records_usage_of_all_models(mock_api, monkeypatch):
+    calls = _recorded_usage(monkeypatch)
+    list(gradio2.run_comparison("sk-a", gradio2.MODEL_CHOICES[:2], PROMPT, use_cache=False))
+
+    assert len(calls) == 1 and calls[0][1]['total_tokens'] == 2 * (32 + 50)
+
+
+def _no_tokens(usage):
+    return usage is not None and usage['total_tokens'] == 0
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_cached_analysis_records_no_usage(mock_api, monkeypatch, tmp_path, stream):
+    calls = _recorded_usage(monkeypatch)
+    monkeypatch.setattr(api, "get_cache", lambda: ResponseCache(str(tmp_path)))
+    for _ in range(2):
+        list(gradio2.run_analysis("sk-a", gradio2.MODEL_CHOICES[0], PROMPT, "sentence", stream=stream))
+
+    assert calls[0][1]['completion_tokens'] == 50
+    assert _no_tokens(calls[1][1])
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_coalesced_analysis_records_no_usage(mock_api, monkeypatch, stream):
+    calls = _recorded_usage(monkeypatch)
+    with ThreadPoolExecutor(2) as pool:
+        list(pool.map(lambda _: list(gradio2.run_analysis("sk-a", gradio2.MODEL_CHOICES[0], PROMPT, "sentence",
+                                                          stream=stream, use_cache=False)), range(2)))
+
+    assert sorted(usage['completion_tokens'] for _, usage in calls) == [0, 50]
+
+
+def test_stream_error_records_received_tokens(monkeypatch):
+    calls = _recorded_usage(monkeypatch)
+    tokens = generate_tokens(20, seed=1)
+
+    def failing_stream():
+        yield from tokens
+        raise APIError("Errore API: stream interrotto")
+
+    fetched = threading.Event()
+    fetched.set()
+    monkeypatch.setattr(core, "stream_completion",
+                        lambda api_key, payload, use_cache=True: TokenStream(failing_stream(), fetched))
+    outputs = list(gradio2.run_analysis("sk-a", gradio2.MODEL_CHOICES[0], PROMPT, "sentence", stream=True))
+
+    assert outputs[-1][1] is None
+    assert calls == [("sk-a", {'prompt_tokens': estimate_tokens(PROMPT, 0), 'completion_tokens': 20,
+                               'total_tokens': estimate_tokens(PROMPT, 0) + 20})]
@@ -0,0 +1,36 @@
+"""Analisi in streaming con caratteri multibyte divisi tra più token."""
+import logprob_gradio
+from logprob.synthetic import completion_text, generate_tokens
+
+
+def test_stream_splits_sentences_on_byte_exact_text(monkeypatch):
+    tokens = generate_tokens(1500, seed=4, split_characters=True)
+    assert any('\\x' in token['token'] for token in tokens)
+    monkeypatch.setattr(logprob_gradio, "stream_completion", lambda api_key, payload: iter(tokens))
+
+    results = list(logprob_gradio.analyze_confidence_stream("sk-test", "gpt-4o", "prompt"))
+    final = results[-1]
+    expected = logprob_gradio.group_tokens_into_sentences(completion_text(tokens), tokens)
+
+    assert [sentence['text'] for sentence in final] == [sentence['text'] for sentence in expected]
+    assert not any('\\x' in sentence['text'] for sentence in final)
+    assert len(final) > 3
+
+
+def test_incremental_segmenter_matches_full_segmentation():
+    from logprob.analysis import segment_spans
+    from logprob.streaming import IncrementalSegmenter
+
+    text = completion_text(generate_tokens(3000, seed=7))
+    text = "# Titolo\nPrima frase. Seconda!\n\n- elemento uno\n- elemento due\nAncora testo? Sì.\n" + text
+    segmenter = IncrementalSegmenter(segment_spans)
+    spans = []
+    for position in range(0, len(text), 3):
+        spans += segmenter.feed(text[position:position + 3])
+        assert len(segmenter.pending) < 2000
+    spans += segmenter.finish()
+
+    assert spans == segment_spans(text)
+    assert segmenter.text == text
+    assert [segmenter.span_text(start, end) for start, end, _ in spans] == [text[start:end] for start, end, _ in spans]
+    assert segmenter.span_text(0, len(text)) == text
@@ -0,0 +1,39 @@
+"""Risposte sintetiche (logprob.synthetic)."""
+import math
+
+import numpy as np
+
+from logprob.analysis import create_confidence_analyses
+from logprob.synthetic import completion_text, generate_completion, generate_tokens
+from logprob.tokens import TokenTable
+
+
+def test_generation_is_deterministic():
+    assert generate_tokens(500, seed=2, top_logprobs=3) == generate_tokens(500, seed=2, top_logprobs=3)
+
+
+def test_top_logprobs_mass_is_at_most_one():
+    for top_logprobs in (2, 5, 20):
+        for token in generate_tokens(3000, seed=1, top_logprobs=top_logprobs):
+            alternatives = token['top_logprobs']
+            assert len(alternatives) == top_logprobs
+            assert alternatives[0]['logprob'] == token['logprob']
+            assert sum(math.exp(alternative['logprob']) for alternative in alternatives) <= 1 + 1e-9
+            logprobs = [alternative['logprob'] for alternative in alternatives]
+            assert logprobs == sorted(logprobs, reverse=True)
+
+
+def test_segment_mass_is_at_most_one():
+    data = generate_completion(3000, seed=5, top_logprobs=5)
+    table = TokenTable.from_tokens(data['choices'][0]['logprobs']['content'])
+    segments = create_confidence_analyses(table.text, table, ("sentence",))['sentence']['segments']
+    assert max(segment['mass'] for segment in segments) <= 1 + 1e-9
+    assert np.nanmax(table.uncertainty[:, 2]) <= 1 + 1e-9
+
+
+def test_split_characters_keep_bytes_exact():
+    data = generate_completion(2000, seed=3, split_characters=True)
+    tokens = data['choices'][0]['logprobs']['content']
+    assert len(tokens) == 2000
+    assert any('\\x' in token['token'] for token in tokens)
+    assert completion_text(tokens) == data['choices'][0]['message']['content']
@@ -0,0 +1,80 @@
+"""Tabella colonnare dei token e indice di allineamento (logprob.tokens, logprob.alignment)."""
+import numpy as np
+
+from logprob.alignment import AlignmentIndex
+from logprob.synthetic import generate_tokens
+from logprob.tokens import TokenTable
+from logprob.uncertainty import token_uncertainty
+
+
+def test_streamed_columns_match_batch_table():
+    tokens = generate_tokens(700, seed=6, top_logprobs=5, split_characters=True)
+    batch = TokenTable.from_tokens(tokens)
+    streamed = TokenTable()
+    for i, token in enumerate(tokens):
+        streamed.append_token(token)
+        if i % 50 == 0:
+            # Letture intermedie: le righe già calcolate non vengono ricalcolate
+            assert len(streamed.uncertainty) == len(streamed.confidences) == i + 1
+
+    assert streamed.text == batch.text
+    np.testing.assert_array_equal(streamed.offsets, batch.offsets)
+    np.testing.assert_allclose(streamed.confidences, batch.confidences)
+    np.testing.assert_allclose(streamed.uncertainty, token_uncertainty(batch.top_logprobs))
+
+
+def test_table_columns_and_token_texts():
+    tokens = generate_tokens(300, seed=2)
+    table = TokenTable.from_tokens(tokens)
+    assert len(table) == 300
+    assert table.token_texts() == [token['token'] for token in tokens]
+    assert table.text == "".join(token['token'] for token in tokens)
+    np.testing.assert_array_equal(table.logprobs, [token['logprob'] for token in tokens])
+    assert table.offsets[0] == 0 and table.offsets[-1] == len(table.text)
+    assert table.top_logprobs is None and table.uncertainty is None
+    assert TokenTable.from_dict(table.to_dict()).token_texts() == table.token_texts()
+
+
+def test_split_characters_belong_to_the_token_with_their_first_byte():
+    tokens = [{'token': "G", 'logprob': -0.1, 'bytes': [71]},
+              {'token': "\\xc3", 'logprob': -0.2, 'bytes': [195]},
+              {'token': "\\xb6bek", 'logprob': -0.3, 'bytes': [182, 98, 101, 107]}]
+    table = TokenTable.from_tokens(tokens)
+    assert table.text == "Göbek"
+    assert table.token_texts() == ["G", "ö", "bek"]
+
+    streamed = TokenTable()
+    assert [streamed.append_token(token) for token in tokens] == ["G", "", "öbek"]
+    assert streamed.text == table.text
+    np.testing.assert_array_equal(streamed.offsets, table.offsets)
+
+
+def test_token_ranges_cover_overlapping_tokens():
+    index = AlignmentIndex(TokenTable.from_texts(["Ciao", " mon", "do", "!"], [-0.1, -0.2, -0.3, -0.4]))
+    assert index.token_range(0, 4) == (0, 1)
+    assert index.token_range(2, 6) == (0, 2)
+    assert index.token_range(5, 8) == (1, 2)
+    assert index.token_range(5, 9) == (1, 3)
+    assert index.token_range(3, 3) == (0, 0)
+    firsts, lasts = index.token_ranges([0, 2, 5, 3, 8], [4, 6, 9, 3, 20])
+    assert list(zip(firsts.tolist(), lasts.tolist())) == [(0, 1), (0, 2), (1, 3), (0, 0), (2, 4)]
+
+
+def test_segment_stats_match_per_range_reductions():
+    rnd = np.random.default_rng(0)
+    tokens = generate_tokens(500, seed=8, top_logprobs=4)
+    index = AlignmentIndex(tokens)
+    firsts = rnd.integers(0, 500, 200)
+    lasts = np.minimum(firsts + rnd.integers(-3, 40, 200), 500)
+    means, minima = index.segment_stats(firsts, lasts)
+    columns = index.table.uncertainty
+    column_means = index.segment_means(columns, firsts, lasts)
+
+    logprobs = index.table.logprobs
+    for i, (first, last) in enumerate(zip(firsts, lasts)):
+        if first >= last:
+            assert np.isnan(means[i]) and np.isnan(minima[i]) and np.isnan(column_means[i]).all()
+            continue
+        assert np.isclose(means[i], logprobs[first:last].mean())
+        assert minima[i] == logprobs[first:last].min()
+        np.testing.assert_allclose(column_means[i], np.nanmean(columns[first:last], axis=0))
@@ -0,0 +1,66 @@
+"""Timeout e retry del trasporto HTTP (logprob.transport)."""
+import socket
+import time
+
+import pytest
+import requests
+
+from logprob import transport
+from logprob.mock_server import MockSettings, start_server
+
+
+@pytest.fixture
+def retries(monkeypatch):
+    attempts = []
+
+    def no_wait(attempt, settings):
+        attempts.append(attempt)
+        return 0.0
+
+    monkeypatch.setattr(transport, "backoff_delay", no_wait)
+    return attempts
+
+
+@pytest.fixture
+def settings():
+    previous = transport.get_settings()
+    yield transport.configure
+    transport.configure(**vars(previous))
+
+
+def _closed_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_post_is_not_retried_after_read_timeout(retries, settings):
+    server = start_server(MockSettings(latency=1.0, min_tokens=5, max_tokens=5))
+    try:
+        settings(api_base=server.url, read_timeout=0.2)
+        with pytest.raises(requests.ReadTimeout):
+            transport.request("POST", "/chat/completions", "sk-a",
+                              json={"model": "m", "messages": [{"role": "user", "content": "x"}]})
+        assert retries == []
+    finally:
+        server.stop()
+
+
+def test_post_is_retried_when_connection_fails(retries, settings):
+    settings(api_base=f"http://127.0.0.1:{_closed_port()}/v1", max_retries=2)
+    with pytest.raises(requests.ConnectionError):
+        transport.request("POST", "/chat/completions", "sk-a", json={})
+    assert retries == [0, 1]
+
+
+def test_retries_stop_at_deadline(settings):
+    server = start_server(MockSettings(error_rate_429=1.0, retry_after=1.0))
+    try:
+        settings(api_base=server.url, retry_deadline=0.5)
+        started = time.monotonic()
+        response = transport.request("POST", "/chat/completions", "sk-a",
+                                      json={"model": "m", "messages": [{"role": "user", "content": "x"}]})
+        assert response.status_code == 429
+        assert time.monotonic() - started < 0.5
+    finally:
+        server.stop()